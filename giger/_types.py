@@ -1,3 +1,27 @@
 from collections import namedtuple
 
-Measurement = namedtuple('Measurement', ['timestamp', 'value'])
\ No newline at end of file
+Measurement = namedtuple('Measurement', ['timestamp', 'value'])
+
+# Event bus payloads, all stamped with time() on receipt
+HRSample = namedtuple('HRSample', ['timestamp', 'hr', 'filtered_hr'])
+PIDOutput = namedtuple('PIDOutput', ['timestamp', 'hr', 'setpoint', 'output'])
+PIDComponents = namedtuple('PIDComponents', ['timestamp', 'error', 'p', 'i', 'd', 'output', 'clamp'])
+PowerWrite = namedtuple('PowerWrite', ['timestamp', 'watts'])
+ConnectionEvent = namedtuple('ConnectionEvent', ['timestamp', 'device', 'address', 'connected'])
+DeviceSwap = namedtuple('DeviceSwap', ['timestamp', 'device', 'old_address', 'new_address', 'gap'])
+DeadlineMiss = namedtuple('DeadlineMiss', ['timestamp', 'deadline', 'elapsed', 'loop_delay'])
+ModelEstimate = namedtuple('ModelEstimate', ['timestamp', 'gain', 'time_constant', 'dead_time', 'offset', 'kp', 'ki', 'kd'])
+ControllerCheckpoint = namedtuple('ControllerCheckpoint', ['timestamp', 'running', 'control_mode', 'hr_setpoint', 'min_power', 'max_power', 'kp', 'ki', 'kd', 'integral', 'last_input', 'last_output', 'target_power', 'written_power', 'gear'])
+CyclingPowerData = namedtuple('CyclingPowerData', ['timestamp', 'instantaneous_power', 'crank_revolutions', 'crank_event_time'])
+# Sensor streams aligned and resampled by `fusion`, stamped with the grid time
+FusedSample = namedtuple('FusedSample', ['timestamp', 'hr', 'filtered_hr', 'power', 'cadence', 'trainer_power', 'meter_power'])
+
+# Decoded FE-C data pages, raw units as sent by the trainer (see `fec`)
+GeneralFEData = namedtuple('GeneralFEData', ['timestamp', 'equipment_type', 'elapsed_time', 'distance', 'speed', 'heart_rate', 'capabilities', 'fe_state'])
+GeneralSettings = namedtuple('GeneralSettings', ['timestamp', 'cycle_length', 'incline', 'resistance_level', 'capabilities', 'fe_state'])
+TrainerData = namedtuple('TrainerData', ['timestamp', 'event_count', 'cadence', 'accumulated_power', 'instantaneous_power', 'trainer_status', 'flags', 'fe_state'])
+TrainerTorqueData = namedtuple('TrainerTorqueData', ['timestamp', 'event_count', 'wheel_ticks', 'wheel_period', 'accumulated_torque', 'capabilities', 'fe_state'])
+CommandStatus = namedtuple('CommandStatus', ['timestamp', 'last_command', 'sequence', 'status', 'data'])
+ManufacturerInfo = namedtuple('ManufacturerInfo', ['timestamp', 'hw_revision', 'manufacturer_id', 'model_number'])
+ProductInfo = namedtuple('ProductInfo', ['timestamp', 'sw_revision_supplemental', 'sw_revision', 'serial_number'])
+CommandsApplied = namedtuple('CommandsApplied', ['timestamp', 'state'])
\ No newline at end of file
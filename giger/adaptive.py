@@ -0,0 +1,129 @@
+import math
+from collections import deque
+from typing import List, Optional, Sequence, Tuple
+
+from sysid import RiderModel, pid_gains
+
+# Used until the rider has a fitted model
+DEFAULT_MODEL = RiderModel(
+    gain=0.25, time_constant=45.0, dead_time=15.0, offset=70.0, r_squared=0.0
+)
+FORGETTING_FACTOR = 0.998
+INITIAL_COVARIANCE = 100.0
+WARMUP_SAMPLES = 60
+# Estimates outside these are treated as the model having lost track
+GAIN_LIMITS = (0.05, 1.0)
+TIME_CONSTANT_LIMITS = (10.0, 300.0)
+# Longest gap between HR samples that is interpolated across; after a
+# longer one the model starts collecting history again
+MAX_SAMPLE_GAP_S = 5.0
+
+
+class RecursiveLeastSquares:
+    """Exponentially weighted RLS; O(n^2) per update for n parameters, here n = 3."""
+
+    def __init__(
+        self,
+        theta: Sequence[float],
+        covariance: float = INITIAL_COVARIANCE,
+        forgetting: float = FORGETTING_FACTOR,
+    ):
+        n = len(theta)
+        self.theta: List[float] = list(theta)
+        self._p = [[covariance if i == j else 0.0 for j in range(n)] for i in range(n)]
+        self._forgetting = forgetting
+
+    def update(self, phi: Sequence[float], y: float) -> float:
+        p = self._p
+        n = len(phi)
+        p_phi = [sum(p[i][j] * phi[j] for j in range(n)) for i in range(n)]
+        denominator = self._forgetting + sum(phi[i] * p_phi[i] for i in range(n))
+        k = [value / denominator for value in p_phi]
+        error = y - sum(self.theta[i] * phi[i] for i in range(n))
+        for i in range(n):
+            self.theta[i] += k[i] * error
+        # P is symmetric, so phi' P == (P phi)'
+        for i in range(n):
+            row = p[i]
+            for j in range(n):
+                row[j] = (row[j] - k[i] * p_phi[j]) / self._forgetting
+        return error
+
+
+class AdaptiveModel:
+    """
+    Tracks the rider's HR response online, once per `sample_period`.
+
+        hr[k] = a * hr[k-1] + b * power[k-1-delay] + c
+
+    The dead time (`delay` samples) is held from the rider's fitted model;
+    a, b and c are re-estimated by RLS so gain and time constant follow
+    cardiac drift, heat and fatigue over a session. HR samples can arrive
+    at any rate: they are resampled onto the `sample_period` grid from
+    their timestamps, HR interpolated and power held between samples.
+    """
+
+    def __init__(self, model: Optional[RiderModel] = None, sample_period: float = 1.0):
+        model = model or DEFAULT_MODEL
+        self._sample_period = sample_period
+        self.dead_time = model.dead_time
+        delay = max(int(round(model.dead_time / sample_period)), 0)
+        a = math.exp(-sample_period / model.time_constant)
+        self._rls = RecursiveLeastSquares(
+            (a, model.gain * (1 - a), model.offset * (1 - a))
+        )
+        self._powers: deque = deque(maxlen=delay + 1)
+        self._last_hr: Optional[float] = None
+        # (timestamp, hr, power) of the last sample fed in, and the next grid time
+        self._last_sample: Optional[Tuple[float, float, float]] = None
+        self._next_time = 0.0
+        self.samples = 0
+        self.model = model
+
+    def update(self, timestamp: float, hr: float, power: float) -> Optional[RiderModel]:
+        """Feed one sample; returns the current model once it is trustworthy."""
+        last = self._last_sample
+        self._last_sample = (timestamp, hr, power)
+        if last is None or not 0 < timestamp - last[0] <= MAX_SAMPLE_GAP_S:
+            # First sample, or too long a gap to interpolate across: start
+            # the grid again from here
+            self._powers.clear()
+            self._last_hr = None
+            self._next_time = timestamp
+        stepped = False
+        while self._next_time <= timestamp:
+            if self._next_time == timestamp:
+                self._step(hr, power)
+            else:
+                fraction = (self._next_time - last[0]) / (timestamp - last[0])
+                self._step(last[1] + (hr - last[1]) * fraction, last[2])
+            self._next_time += self._sample_period
+            stepped = True
+        return self._estimate() if stepped else None
+
+    def _step(self, hr: float, power: float):
+        powers = self._powers
+        if self._last_hr is not None and len(powers) == powers.maxlen:
+            self._rls.update((self._last_hr, powers[0], 1.0), hr)
+            self.samples += 1
+        powers.append(power)
+        self._last_hr = hr
+
+    def _estimate(self) -> Optional[RiderModel]:
+        if self.samples < WARMUP_SAMPLES:
+            return None
+        a, b, c = self._rls.theta
+        if not 0 < a < 1 or b <= 0:
+            return None
+        gain = b / (1 - a)
+        time_constant = -self._sample_period / math.log(a)
+        if not (
+            GAIN_LIMITS[0] <= gain <= GAIN_LIMITS[1]
+            and TIME_CONSTANT_LIMITS[0] <= time_constant <= TIME_CONSTANT_LIMITS[1]
+        ):
+            return None
+        self.model = RiderModel(gain, time_constant, self.dead_time, c / (1 - a), 0.0)
+        return self.model
+
+    def gains(self) -> Tuple[float, float, float]:
+        return pid_gains(self.model)
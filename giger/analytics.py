@@ -0,0 +1,176 @@
+"""
+Post-ride analytics over recorded session files.
+
+    python analytics.py rides/*.giger
+"""
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from recorder import HEADER_SIZE, ROW_SIZE, SESSION_COLUMNS, read_header
+
+SESSION_DTYPE = np.dtype([(name, "<" + fmt) for name, fmt in SESSION_COLUMNS])
+assert SESSION_DTYPE.itemsize == ROW_SIZE
+
+CACHE_DIRECTORY = os.path.join("rides", ".analytics_cache")
+CACHE_VERSION = 1
+
+DEFAULT_FTP = 200
+DEFAULT_THRESHOLD_HR = 165
+NP_WINDOW_S = 30
+MAX_HR_LAG_S = 120
+SETPOINT_TOLERANCE_BPM = 3
+
+# Zone lower bounds as fractions of FTP / threshold HR
+POWER_ZONES = (0, 0.55, 0.75, 0.90, 1.05, 1.20, 1.50)
+HR_ZONES = (0, 0.81, 0.90, 0.94, 1.00, 1.03)
+
+
+def open_session(path: str) -> Tuple[dict, np.memmap]:
+    """Header metadata and a read-only memory map over the session's rows."""
+    with open(path, "rb") as f:
+        metadata = read_header(f)
+    # A crash can leave a partial last row; map whole rows only
+    rows = (os.path.getsize(path) - HEADER_SIZE) // ROW_SIZE
+    if rows <= 0:
+        return metadata, np.zeros(0, dtype=SESSION_DTYPE)
+    return metadata, np.memmap(
+        path, dtype=SESSION_DTYPE, mode="r", offset=HEADER_SIZE, shape=(rows,)
+    )
+
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    if len(values) < window:
+        return values[:0]
+    cumsum = np.cumsum(values, dtype=np.float64)
+    cumsum[window:] = cumsum[window:] - cumsum[:-window]
+    return cumsum[window - 1 :] / window
+
+
+def normalized_power(power: np.ndarray, rate_hz: float) -> float:
+    rolling = _rolling_mean(power, max(int(NP_WINDOW_S * rate_hz), 1))
+    if not len(rolling):
+        return float(np.mean(power)) if len(power) else 0.0
+    return float(np.mean(rolling**4) ** 0.25)
+
+
+def time_in_zones(values: np.ndarray, threshold: float, zones, dt: float) -> list:
+    edges = np.append(np.asarray(zones) * threshold, np.inf)
+    counts, _ = np.histogram(values, bins=edges)
+    return (counts * dt).tolist()
+
+
+def hr_drift(hr: np.ndarray, power: np.ndarray) -> float:
+    """Aerobic decoupling: % fall in power per heartbeat from first to second half."""
+    half = len(hr) // 2
+    if not half:
+        return 0.0
+    first = np.mean(power[:half]) / np.mean(hr[:half])
+    second = np.mean(power[half:]) / np.mean(hr[half:])
+    return float((first - second) / first * 100)
+
+
+def hr_power_lag(hr: np.ndarray, power: np.ndarray, rate_hz: float) -> float:
+    """Delay in seconds at which HR best correlates with earlier power (FFT xcorr)."""
+    n = len(hr)
+    if n < 2:
+        return 0.0
+    hr = hr - hr.mean()
+    power = power - power.mean()
+    size = 1 << (2 * n - 1).bit_length()
+    xcorr = np.fft.irfft(np.fft.rfft(hr, size) * np.conj(np.fft.rfft(power, size)), size)
+    max_lag = min(int(MAX_HR_LAG_S * rate_hz), n - 1)
+    return float(np.argmax(xcorr[: max_lag + 1]) / rate_hz)
+
+
+def setpoint_tracking(hr: np.ndarray, setpoint: np.ndarray, pid_output: np.ndarray) -> dict:
+    controlled = ~np.isnan(pid_output)
+    if not controlled.any():
+        return {"controlled_s": 0, "rmse_bpm": None, "mae_bpm": None, "within_tolerance": None}
+    error = hr[controlled] - setpoint[controlled]
+    return {
+        "controlled_s": int(controlled.sum()),
+        "rmse_bpm": float(np.sqrt(np.mean(error**2))),
+        "mae_bpm": float(np.mean(np.abs(error))),
+        "within_tolerance": float(np.mean(np.abs(error) <= SETPOINT_TOLERANCE_BPM)),
+    }
+
+
+def analyze_session(
+    path: str, ftp: Optional[float] = None, threshold_hr: Optional[float] = None
+) -> Dict:
+    metadata, rows = open_session(path)
+    ftp = ftp or metadata.get("ftp") or DEFAULT_FTP
+    threshold_hr = threshold_hr or metadata.get("threshold_hr") or DEFAULT_THRESHOLD_HR
+    rate_hz = metadata.get("rate_hz", 1)
+    dt = 1 / rate_hz
+
+    # Samples recorded before the strap or trainer reported are NaN
+    valid = ~(np.isnan(rows["hr"]) | np.isnan(rows["power"]))
+    hr = np.asarray(rows["hr"][valid], dtype=np.float64)
+    power = np.asarray(rows["power"][valid], dtype=np.float64)
+
+    duration = len(rows) * dt
+    np_ = normalized_power(power, rate_hz)
+    intensity = np_ / ftp
+    return {
+        "path": path,
+        "rider": metadata.get("rider"),
+        "station": metadata.get("station"),
+        "start": metadata.get("start"),
+        "duration_s": duration,
+        "average_power": float(power.mean()) if len(power) else 0.0,
+        "normalized_power": np_,
+        "intensity_factor": intensity,
+        "tss": duration * np_ * intensity / (ftp * 3600) * 100,
+        "average_hr": float(hr.mean()) if len(hr) else 0.0,
+        "time_in_power_zones": time_in_zones(power, ftp, POWER_ZONES, dt),
+        "time_in_hr_zones": time_in_zones(hr, threshold_hr, HR_ZONES, dt),
+        "hr_drift_pct": hr_drift(hr, power),
+        "hr_power_lag_s": hr_power_lag(hr, power, rate_hz),
+        "setpoint_tracking": setpoint_tracking(
+            rows["hr"], rows["setpoint"], rows["pid_output"]
+        ),
+    }
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def analyze_cached(path: str, cache_directory: str = CACHE_DIRECTORY) -> Dict:
+    """`analyze_session`, memoized on disk by the file's content hash."""
+    cache_path = os.path.join(
+        cache_directory, f"{file_digest(path)}-v{CACHE_VERSION}.json"
+    )
+    try:
+        with open(cache_path) as f:
+            result = json.load(f)
+        result["path"] = path
+        return result
+    except (OSError, ValueError):
+        pass
+    result = analyze_session(path)
+    os.makedirs(cache_directory, exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(result, f)
+    return result
+
+
+def analyze_season(paths: Iterable[str], processes: Optional[int] = None) -> list:
+    paths = list(paths)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(analyze_cached, paths, chunksize=4))
+
+
+if __name__ == "__main__":
+    for result in analyze_season(sys.argv[1:]):
+        print(json.dumps(result))
@@ -0,0 +1,33 @@
+"""Decode throughput for FE-C pages: python bench_fec.py [pages]"""
+import random
+import sys
+from time import perf_counter
+
+from fec import PAGE_DECODERS, FecTelemetry, build_fec_message
+
+
+def make_message(page: int) -> bytes:
+    return build_fec_message(bytes([page]) + bytes(random.randrange(256) for _ in range(7)))
+
+
+def bench(pages: int):
+    # A realistic mix is mostly pages 16 and 25, with the odd other page
+    weights = {16: 4, 25: 4, 17: 1, 26: 1, 71: 1, 80: 1, 81: 1}
+    assert set(weights) == set(PAGE_DECODERS)
+    population = [page for page, weight in weights.items() for _ in range(weight)]
+    messages = [make_message(random.choice(population)) for _ in range(4096)]
+    telemetry = FecTelemetry()
+    decode = telemetry.decode
+    started = perf_counter()
+    for i in range(pages):
+        decode(messages[i & 4095], 0.0)
+    elapsed = perf_counter() - started
+    return pages / elapsed, elapsed / pages * 1e9
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # Cost per page should stay flat however many pages are pushed through
+    for pages in (total // 100, total // 10, total):
+        rate, ns_per_page = bench(pages)
+        print(f"{pages:>10} pages: {rate:>12,.0f} pages/s, {ns_per_page:6.0f} ns/page")
@@ -0,0 +1,113 @@
+import asyncio
+import math
+import mmap
+import os
+import struct
+import zlib
+from time import time
+from typing import Optional
+
+from _types import ControllerCheckpoint
+
+CHECKPOINT_RATE_HZ = 5
+# Older than this and it's a new ride, not a crash being recovered from
+CHECKPOINT_MAX_AGE_S = 600
+
+# Optional fields are stored as NaN (floats) or -1 (gear) when unset
+_PAYLOAD = struct.Struct("<d?Bdddddddddddi")
+_SLOT_HEADER = struct.Struct("<QI")
+_SLOT_SIZE = _SLOT_HEADER.size + _PAYLOAD.size
+_FILE_SIZE = 2 * _SLOT_SIZE
+
+
+def _to_float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _from_float(value: float):
+    return None if math.isnan(value) else value
+
+
+class Checkpointer:
+    """
+    Keeps the latest controller checkpoint in a small memory-mapped file.
+
+    Two slots are written alternately, each with a sequence number and a
+    CRC, so a crash part way through a write still leaves the previous
+    checkpoint readable. Writes go to the page cache without an fsync: they
+    survive the app crashing, which is what this is for, and cost a few
+    microseconds.
+    """
+
+    def __init__(self, path: str, rate_hz: float = CHECKPOINT_RATE_HZ):
+        self.path = path
+        self._period = 1 / rate_hz
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != _FILE_SIZE:
+                os.ftruncate(fd, _FILE_SIZE)
+            self._mmap = mmap.mmap(fd, _FILE_SIZE)
+        finally:
+            os.close(fd)
+        self._sequence = max(
+            _SLOT_HEADER.unpack_from(self._mmap, slot * _SLOT_SIZE)[0] for slot in (0, 1)
+        )
+
+    def save(self, checkpoint: ControllerCheckpoint):
+        payload = _PAYLOAD.pack(
+            checkpoint.timestamp,
+            checkpoint.running,
+            checkpoint.control_mode,
+            checkpoint.hr_setpoint,
+            checkpoint.min_power,
+            checkpoint.max_power,
+            checkpoint.kp,
+            checkpoint.ki,
+            checkpoint.kd,
+            checkpoint.integral,
+            _to_float(checkpoint.last_input),
+            _to_float(checkpoint.last_output),
+            checkpoint.target_power,
+            _to_float(checkpoint.written_power),
+            -1 if checkpoint.gear is None else checkpoint.gear,
+        )
+        self._sequence += 1
+        offset = (self._sequence % 2) * _SLOT_SIZE
+        # Payload first, so a slot's header never vouches for a half-written payload
+        self._mmap[offset + _SLOT_HEADER.size : offset + _SLOT_SIZE] = payload
+        _SLOT_HEADER.pack_into(self._mmap, offset, self._sequence, zlib.crc32(payload))
+
+    def load(self, max_age: float = CHECKPOINT_MAX_AGE_S) -> Optional[ControllerCheckpoint]:
+        """The newest intact checkpoint, or None if there isn't a recent one."""
+        best = None
+        for slot in (0, 1):
+            offset = slot * _SLOT_SIZE
+            sequence, crc = _SLOT_HEADER.unpack_from(self._mmap, offset)
+            payload = self._mmap[offset + _SLOT_HEADER.size : offset + _SLOT_SIZE]
+            if sequence and zlib.crc32(payload) == crc:
+                if best is None or sequence > best[0]:
+                    best = (sequence, payload)
+        if best is None:
+            return None
+        fields = list(_PAYLOAD.unpack(best[1]))
+        for idx in (10, 11, 13):
+            fields[idx] = _from_float(fields[idx])
+        fields[14] = None if fields[14] < 0 else fields[14]
+        checkpoint = ControllerCheckpoint(*fields)
+        if time() - checkpoint.timestamp > max_age:
+            return None
+        return checkpoint
+
+    def clear(self):
+        """Forget the checkpoint, after a clean shutdown."""
+        self._mmap[:] = bytes(_FILE_SIZE)
+        self._mmap.flush()
+        self._sequence = 0
+
+    async def run(self, giger):
+        while True:
+            self.save(giger.checkpoint())
+            await asyncio.sleep(self._period)
+
+    def close(self):
+        self._mmap.close()
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+from typing import Optional
+
+from loguru import logger
+
+# Addresses are "tcp:<host>:<port>" or "unix:<path>"
+DEFAULT_COMMAND_ADDRESS = "tcp:127.0.0.1:8765"
+
+
+class CommandServer:
+    """
+    Line-delimited JSON command endpoint running on the controller's event loop.
+
+    Each request is a single line such as
+        {"id": 7, "commands": {"target_hr": 142, "max_power": 280, "kp": 0.6}}
+    and every command in it is applied by `Giger.apply_commands` before the
+    next HR sample is handled. The reply carries the values actually applied:
+        {"id": 7, "ok": true, "applied": {...}}
+
+    With a `Diagnostics` attached, {"diagnostics": true} returns its summary
+    and {"profile": {"subsystem": "controller", "seconds": 10}} starts a
+    profile and returns the path it will be written to.
+    """
+
+    def __init__(self, giger, address: str = DEFAULT_COMMAND_ADDRESS, diagnostics=None):
+        self._giger = giger
+        self._diagnostics = diagnostics
+        self.address = address
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        scheme, _, location = self.address.partition(":")
+        if scheme == "unix":
+            if os.path.exists(location):
+                os.unlink(location)
+            self._server = await asyncio.start_unix_server(
+                self._handle_client, path=location
+            )
+        elif scheme == "tcp":
+            host, _, port = location.rpartition(":")
+            self._server = await asyncio.start_server(
+                self._handle_client, host=host, port=int(port)
+            )
+        else:
+            raise ValueError(f"Unsupported command server address: {self.address}")
+        logger.info(f"Command server listening on {self.address}")
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_client(self, reader, writer):
+        peer = writer.get_extra_info("peername") or self.address
+        logger.info(f"Command client connected: {peer}")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._handle_line(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            logger.info(f"Command client disconnected: {peer}")
+
+    async def _handle_line(self, line: bytes) -> dict:
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if "diagnostics" in request or "profile" in request:
+                return {"id": request_id, "ok": True, **self._diagnose(request)}
+            applied = await self._giger.apply_commands(request.get("commands", {}))
+        except Exception as e:
+            # Whatever failed, even a trainer write, the client gets a reply
+            # and the connection stays up
+            if not isinstance(e, (ValueError, TypeError)):
+                logger.warning(f"Command request {request_id} failed: {e!r}")
+            return {"id": request_id, "ok": False, "error": str(e)}
+        return {"id": request_id, "ok": True, "applied": applied}
+
+    def _diagnose(self, request: dict) -> dict:
+        if self._diagnostics is None:
+            raise ValueError("Diagnostics are not enabled")
+        response = {}
+        if request.get("diagnostics"):
+            response["diagnostics"] = self._diagnostics.summary()
+        if "profile" in request:
+            profile = request["profile"]
+            response["profile"] = self._diagnostics.profile(
+                profile.get("subsystem", "controller"),
+                float(profile.get("seconds", 10)),
+            )
+        return response
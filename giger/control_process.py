@@ -0,0 +1,401 @@
+import asyncio
+import multiprocessing
+import queue
+import struct
+from multiprocessing import shared_memory
+from threading import Lock, Thread
+from time import time
+from typing import List, Optional, Tuple
+
+from _types import CommandsApplied, HRSample, PowerWrite, TrainerData
+from loguru import logger
+
+# Ring layout: an 8 byte write counter followed by `capacity` fixed-size records
+_COUNTER = struct.Struct("<Q")
+_RECORD = struct.Struct("<dffffB3x")
+
+FLAG_RUNNING = 0x01
+FLAG_HRM_CONNECTED = 0x02
+FLAG_TRAINER_CONNECTED = 0x04
+
+# Log lines and states waiting for the pipe to the UI; past this they are
+# dropped rather than block the control loop on a UI that has stopped reading
+LOG_QUEUE_SIZE = 1000
+
+TelemetryRecord = Tuple[float, float, float, float, float, int]
+
+
+class TelemetryRing:
+    """
+    Single-writer ring of telemetry records in shared memory.
+
+    A record is (timestamp, hr, trainer_power, hr_setpoint, target_power,
+    flags). The writer fills a slot before bumping the counter, and readers
+    re-check the counter afterwards so a lapped slot is never returned.
+    """
+
+    def __init__(self, name: Optional[str] = None, capacity: int = 4096):
+        size = _COUNTER.size + capacity * _RECORD.size
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            _COUNTER.pack_into(self._shm.buf, 0, 0)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = name is None
+        self.capacity = capacity
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def count(self) -> int:
+        return _COUNTER.unpack_from(self._shm.buf, 0)[0]
+
+    def _offset(self, index: int) -> int:
+        return _COUNTER.size + (index % self.capacity) * _RECORD.size
+
+    def write(self, *record):
+        index = self.count
+        _RECORD.pack_into(self._shm.buf, self._offset(index), *record)
+        _COUNTER.pack_into(self._shm.buf, 0, index + 1)
+
+    def latest(self) -> Optional[TelemetryRecord]:
+        count = self.count
+        if not count:
+            return None
+        return _RECORD.unpack_from(self._shm.buf, self._offset(count - 1))
+
+    def read_since(self, index: int) -> Tuple[int, List[TelemetryRecord]]:
+        """Return the new write counter and the records written after `index`."""
+        count = self.count
+        start = max(index, count - self.capacity + 1)
+        records = [
+            _RECORD.unpack_from(self._shm.buf, self._offset(i))
+            for i in range(start, count)
+        ]
+        # Drop anything the writer lapped while we were copying
+        lapped = self.count - self.capacity + 1 - start
+        if lapped > 0:
+            records = records[lapped:]
+        return count, records
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _control_process_main(
+    ring_name, capacity, conn, giger_kwargs, command_address, simulate, checkpoint_path
+):
+    # Imported here so the UI process never pays for them
+    import devices
+    from checkpoint import Checkpointer
+    from command_server import CommandServer
+    from controller import Giger
+    from diagnostics import Diagnostics
+    from event_bus import EventBus
+    from recorder import SessionRecorder
+    from settings import settings
+    from sim import SIM_HRM_ADDRESS, SIM_TRAINER_ADDRESS, SimulatedRide
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    dropped = [0]
+
+    def queue_message(kind, payload):
+        try:
+            log_queue.put_nowait((kind, payload))
+        except queue.Full:
+            dropped[0] += 1
+
+    def send_logs():
+        # Its own thread, so a full pipe only ever blocks this one
+        reported = 0
+        while True:
+            message = log_queue.get()
+            lost = dropped[0] - reported
+            try:
+                if lost:
+                    conn.send(("log", ("WARNING", f"Dropped {lost} log lines")))
+                    reported += lost
+                conn.send(message)
+            except (BrokenPipeError, OSError):
+                return
+
+    logger.remove()
+    logger.add(
+        lambda message: queue_message(
+            "log", (message.record["level"].name, message.record["message"])
+        )
+    )
+    Thread(target=send_logs, name="giger-log-sender", daemon=True).start()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    ring = TelemetryRing(ring_name, capacity)
+    giger = Giger(None, None, event_bus=EventBus(loop), **giger_kwargs)
+    diagnostics = Diagnostics(giger.event_bus)
+    recorder = SessionRecorder(giger)
+    checkpointer = None
+    if checkpoint_path is not None:
+        checkpointer = Checkpointer(checkpoint_path)
+        restored = checkpointer.load()
+        if restored is not None:
+            giger.restore(restored)
+
+    def write_telemetry(_):
+        flags = FLAG_RUNNING if giger._is_running else 0
+        if giger.hr_client is not None and giger.hr_client.is_connected:
+            flags |= FLAG_HRM_CONNECTED
+        if (
+            giger.trainer_control is not None
+            and giger.trainer_control._client.is_connected
+        ):
+            flags |= FLAG_TRAINER_CONNECTED
+        ring.write(
+            time(),
+            giger.current_hr,
+            giger.current_trainer_power,
+            giger.hr_setpoint,
+            giger.current_pid_control_power,
+            flags,
+        )
+
+    giger.event_bus.subscribe(
+        "telemetry_ring", write_telemetry, HRSample, TrainerData, PowerWrite
+    )
+    # So the UI's sliders follow changes made through the command server
+    giger.event_bus.subscribe(
+        "remote_state", lambda event: queue_message("state", event.state), CommandsApplied
+    )
+
+    device_source = SimulatedRide() if simulate else devices
+
+    async def set_hr(address):
+        await giger.set_hr_client(await device_source.set_up_hr(address))
+
+    async def set_trainer(address):
+        await giger.set_trainer_control(await device_source.set_up_trainer(address))
+
+    async def set_power_meter(address):
+        await giger.set_power_meter_client(await devices.set_up_power_meter(address))
+
+    async def run_command(name, args):
+        try:
+            if name == "apply":
+                await giger.apply_commands(*args)
+            elif name == "set_hr":
+                await set_hr(*args)
+            elif name == "set_trainer":
+                await set_trainer(*args)
+            elif name == "set_power_meter":
+                await set_power_meter(*args)
+            else:
+                getattr(giger, name)(*args)
+        except Exception as e:
+            logger.error(f"Control process command {name} failed: {e}")
+        write_telemetry(None)
+
+    def on_command():
+        while conn.poll():
+            try:
+                name, args = conn.recv()
+            except EOFError:
+                loop.stop()
+                return
+            if name == "shutdown":
+                loop.stop()
+                return
+            loop.create_task(run_command(name, args))
+
+    async def record_when_connected():
+        while not giger.devices_connected:
+            await asyncio.sleep(1)
+        recorder.start()
+
+    async def main():
+        loop.add_reader(conn.fileno(), on_command)
+        loop.create_task(diagnostics.loop_lag.run())
+        if giger.watchdog is not None:
+            giger.watchdog.start(loop)
+            diagnostics.watch_deadlines(giger.watchdog)
+        diagnostics.watch_trainer_writes(giger.trainer_write_stats)
+        if checkpointer is not None:
+            loop.create_task(checkpointer.run(giger))
+        try:
+            await CommandServer(giger, command_address, diagnostics).start()
+        except OSError as e:
+            logger.error(f"Command server not started on {command_address}: {e}")
+        if giger.control_rate_hz is not None:
+            loop.create_task(giger.run_control_loop())
+        if simulate:
+            addresses = (SIM_HRM_ADDRESS, SIM_TRAINER_ADDRESS, None)
+        else:
+            addresses = (
+                settings.last_used_hrm_uuid,
+                settings.last_used_trainer_uuid,
+                settings.last_used_power_meter_uuid,
+            )
+        for name, address in zip(("set_hr", "set_trainer", "set_power_meter"), addresses):
+            if address is not None:
+                loop.create_task(run_command(name, (address,)))
+        loop.create_task(record_when_connected())
+
+    loop.run_until_complete(main())
+    loop.run_forever()
+    if giger.watchdog is not None:
+        giger.watchdog.stop()
+    recorder.stop()
+    if checkpointer is not None:
+        checkpointer.clear()
+    ring.close()
+
+
+class ControlProcess:
+    """
+    Runs `Giger` and its BLE clients in a child process.
+
+    Exposes the parts of the `Giger` API the UI uses. Reads come from the
+    shared-memory telemetry ring; writes are sent to the child over a pipe
+    and never wait on it.
+    """
+
+    def __init__(
+        self,
+        command_address: str,
+        capacity: int = 4096,
+        simulate: bool = False,
+        checkpoint_path: Optional[str] = None,
+        **giger_kwargs,
+    ):
+        self._ring = TelemetryRing(capacity=capacity)
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._send_lock = Lock()
+        self._state: Optional[dict] = None
+        self.hr_setpoint = giger_kwargs.get("hr_setpoint", 135)
+        self.control_rate_hz = giger_kwargs.get("control_rate_hz")
+        context = multiprocessing.get_context("spawn")
+        self._process = context.Process(
+            target=_control_process_main,
+            args=(
+                self._ring.name,
+                capacity,
+                child_conn,
+                giger_kwargs,
+                command_address,
+                simulate,
+                checkpoint_path,
+            ),
+            daemon=True,
+        )
+
+    def launch(self):
+        self._process.start()
+
+    def shutdown(self):
+        try:
+            self._send("shutdown")
+        except (BrokenPipeError, OSError):
+            # The child has exited already; there's nothing left to tell it
+            logger.warning("Control process had already stopped")
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._ring.close()
+
+    def _send(self, name, *args):
+        with self._send_lock:
+            self._conn.send((name, args))
+
+    def drain_logs(self) -> List[Tuple[str, str]]:
+        """
+        Return (level, message) pairs logged by the child since the last
+        call. The latest controller state it sent is kept for `pop_state`.
+        """
+        lines = []
+        while self._conn.poll():
+            kind, payload = self._conn.recv()
+            if kind == "log":
+                lines.append(payload)
+            elif kind == "state":
+                self._state = payload
+                self.hr_setpoint = payload["target_hr"]
+        return lines
+
+    def pop_state(self) -> Optional[dict]:
+        """The controller state from the last applied commands, once."""
+        state, self._state = self._state, None
+        return state
+
+    @property
+    def telemetry(self) -> TelemetryRing:
+        return self._ring
+
+    def _latest(self, field: int, default=0):
+        record = self._ring.latest()
+        return default if record is None else record[field]
+
+    @property
+    def current_hr(self):
+        return self._latest(1)
+
+    @property
+    def current_trainer_power(self):
+        return self._latest(2)
+
+    @property
+    def current_pid_control_power(self):
+        return self._latest(4)
+
+    @property
+    def devices_connected(self) -> bool:
+        connected = FLAG_HRM_CONNECTED | FLAG_TRAINER_CONNECTED
+        return self._latest(5) & connected == connected
+
+    def start(self):
+        if not self.devices_connected:
+            logger.info("Trainer control and HR client must be added to start")
+            return False
+        self._send("start")
+        return True
+
+    def stop(self):
+        self._send("stop")
+
+    def reset(self):
+        self._send("reset")
+
+    def set_target_hr(self, value):
+        self.hr_setpoint = value
+        self._send("set_target_hr", value)
+
+    def set_min_power(self, watts):
+        self._send("set_min_power", watts)
+
+    def set_max_power(self, watts):
+        self._send("set_max_power", watts)
+
+    def set_power_limits(self, min_power, max_power):
+        self._send("set_power_limits", min_power, max_power)
+
+    def set_kp(self, value):
+        self._send("set_kp", value)
+
+    def set_ki(self, value):
+        self._send("set_ki", value)
+
+    def set_kd(self, value):
+        self._send("set_kd", value)
+
+    def set_control_mode(self, mode):
+        self._send("set_control_mode", mode)
+
+    async def set_current_power(self, watts):
+        self._send("apply", {"power": watts})
+
+    async def set_hr_client(self, hr_client):
+        self._send("set_hr", hr_client.address)
+
+    async def set_trainer_control(self, trainer_control):
+        self._send("set_trainer", trainer_control._client.address)
@@ -1,24 +1,85 @@
+import asyncio
+import math
 import struct
 
 from collections import deque
+from time import time
 from typing import Callable, Optional, Union
 
+from _types import (
+    CommandsApplied,
+    CommandStatus,
+    ConnectionEvent,
+    ControllerCheckpoint,
+    DeadlineMiss,
+    DeviceSwap,
+    HRSample,
+    Measurement,
+    ModelEstimate,
+    PIDOutput,
+    PowerWrite,
+    TrainerData,
+)
+from adaptive import AdaptiveModel
 from bleak import BleakClient
-from devices import HR_MEASUREMENT_UUID
+from devices import (
+    CRANK_EVENT_TIME_WRAP,
+    CYCLING_POWER_MEASUREMENT_UUID,
+    HR_MEASUREMENT_UUID,
+    TACX_FEC_READ_UUID,
+    parse_cycling_power_measurement,
+)
+from event_bus import EventBus
+from fec import FecTelemetry
+from fec_transport import FecTransport, WriteStats
+from fusion import SensorFusion
+from gain_schedule import GainSchedule
+from hr_filters import HRFilter, parse_hr_measurement
+from mmp import MeanMaxPower
+from pid_telemetry import CLAMP_HIGH, CLAMP_LOW, CLAMP_NONE, PIDComponentRing
+from ramp import PowerRamp
 from loguru import logger
 from settings import settings
 from simple_pid import PID
-from pycycling.tacx_trainer_control import TacxTrainerControl
+from sysid import RiderModel
+from watchdog import (
+    CONTROL_TICK_DEADLINE,
+    CONTROL_TICK_DEADLINE_PERIODS,
+    FALLBACKS,
+    HR_DEADLINE,
+    HR_DEADLINE_S,
+    POWER_WRITE_DEADLINE,
+    POWER_WRITE_DEADLINE_S,
+    Watchdog,
+)
 
 # Safety limits
 MAX_POWER = 500  # Maximum power in watts
 MIN_POWER = 50  # Minimum power in watts
 
+CONTROL_MODES = ("pid", "adaptive", "scheduled")
+
+# Used by the "ramp_down" fallback when power changes aren't otherwise ramped
+FALLBACK_RAMP_RATE_W_PER_S = 10
+
+
+class SampleHold:
+    """Holds the most recent measurement until the next one replaces it."""
+
+    def __init__(self):
+        self._latest: Optional[Measurement] = None
+
+    def put(self, timestamp: float, value):
+        self._latest = Measurement(timestamp, value)
+
+    def get(self) -> Optional[Measurement]:
+        return self._latest
+
 
 class Giger:
     def __init__(
         self,
-        trainer_control: Optional[TacxTrainerControl],
+        trainer_control: Optional[FecTransport],
         hr_client: Optional[BleakClient],
         max_power: int = 600,
         min_power: int = 50,
@@ -26,23 +87,53 @@ class Giger:
         starting_power: int = 180,
         update_hr_callback: Optional[Callable] = None,
         update_power_callback: Optional[Callable] = None,
+        event_bus: Optional[EventBus] = None,
+        control_rate_hz: Optional[float] = None,
+        control_mode: str = "pid",
+        hr_filter: Optional[HRFilter] = None,
+        ramp_rate: Optional[float] = None,
+        remember_devices: bool = True,
+        fallback: Optional[str] = None,
+        fusion_delay: Optional[float] = None,
     ):
         """
         Initialize the Giger class.
 
         Parameters:
-        trainer_control (TacxTrainerControl): The trainer control interface.
+        trainer_control (FecTransport): The trainer control interface.
         hr_client (BleakClient): The BLE client for heart rate monitoring.
         hr_setpoint (int, optional): Desired heart rate in bpm. Default is 135.
         hr_tolerance (int, optional): Acceptable deviation in bpm. Default is 3.
         power_step (int, optional): Watts to adjust per step. Default is 5.
         max_power (int, optional): Maximum power in watts. Default is 600.
         min_power (int, optional): Minimum power in watts. Default is 50.
+        event_bus (EventBus, optional): Bus that HR samples, trainer data, PID
+            outputs, power writes and connection changes are published to.
+        control_rate_hz (float, optional): Run the PID from `run_control_loop`
+            at this rate instead of on every HR notification. Default is None.
+        control_mode (str, optional): "pid" for fixed gains, "adaptive" to
+            retune them from an online model of the rider, or "scheduled" to
+            look them up by setpoint and HR from the rider's gain schedule.
+            Default is "pid".
+        hr_filter (HRFilter, optional): Conditions HR between the parser and
+            the controller. Default is no filtering.
+        ramp_rate (float, optional): Slew new power targets at this many
+            watts per second instead of stepping. Default is None.
+        remember_devices (bool, optional): Store connected device addresses
+            in settings for the next run. Default is True.
+        fallback (str, optional): Watch deadlines for HR, control ticks and
+            power writes, and on a miss "hold" the current power, "ramp_down"
+            to min_power or "freeze" the PID. Default is None, no watchdog.
+        fusion_delay (float, optional): Align HR, trainer and power meter
+            samples onto the control_rate_hz grid this many seconds behind
+            real time (see `fusion`), and control on those. Default is None,
+            control on HR samples as they arrive.
         """
 
         # Set up attributes
-        self.trainer_control: Union[TacxTrainerControl, None] = None
+        self.trainer_control: Union[FecTransport, None] = None
         self.hr_client: Union[BleakClient, None] = None
+        self.power_meter_client: Union[BleakClient, None] = None
         self.hr_setpoint: int = hr_setpoint
         self.max_power: int = max_power
         self.min_power: int = min_power
@@ -50,17 +141,86 @@ class Giger:
         self._update_power_callback: Callable = update_power_callback or (
             lambda power: None
         )
+        self.event_bus: EventBus = event_bus or EventBus()
+        self._remember_devices: bool = remember_devices
         self._is_running: bool = False
         self._never_started: bool = True
         self._instant_power_deque = deque(maxlen=3)
+        self.fec = FecTelemetry()
+        # Shared by every trainer connected, so timings survive a swap
+        self.trainer_write_stats = WriteStats()
+        self.mean_max_power = MeanMaxPower()
+        # Last data seen from each device, and swaps waiting on the new
+        # device's first data to measure the gap
+        self._last_data_time = {"hrm": None, "trainer": None, "power_meter": None}
+        self._pending_swaps = {}
+
+        self.control_rate_hz: Optional[float] = control_rate_hz
+        self._hr_hold = SampleHold()
+        self.hr_filter: HRFilter = hr_filter or HRFilter()
+
+        self.fusion: Optional[SensorFusion] = None
+        if fusion_delay is not None:
+            if control_rate_hz is None:
+                raise ValueError("Sensor fusion requires control_rate_hz")
+            self.fusion = SensorFusion(control_rate_hz, fusion_delay)
+            self.fusion.streams["filtered_hr"].latency += self.hr_filter.latency
+        # The HRM's own clock, as the sum of the RR intervals it has sent
+        self._beat_clock = 0.0
+        # Crank revolutions and event time last seen from the power meter
+        self._last_crank: Optional[tuple] = None
+        self.current_meter_cadence: Optional[float] = None
 
-        self.pid = PID(1, 0.1, 0.05, setpoint=self.hr_setpoint, sample_time=5)
+        # In fixed-rate mode dt comes from the measurements, so don't let
+        # simple_pid second-guess it with the wall clock
+        sample_time = 5 if control_rate_hz is None else None
+        self.pid = PID(1, 0.1, 0.05, setpoint=self.hr_setpoint, sample_time=sample_time)
         self.pid.output_limits = (self.min_power, self.max_power)
 
         self.pid.auto_mode = False
+        # P, I and D contributions of each step, to see why the output moved
+        self.pid_components = PIDComponentRing()
 
         self.current_pid_control_power: int = starting_power
+        self.last_written_power: Optional[int] = None
         self.current_hr: int = 0
+        self.ramp: Optional[PowerRamp] = None
+        if ramp_rate is not None:
+            self.ramp = PowerRamp(
+                self._write_power, lambda: (self.min_power, self.max_power), ramp_rate
+            )
+
+        # Set by `restore` to start control again once both devices are back
+        self._resume_pending: bool = False
+        self._restored_gear: Optional[int] = None
+
+        self.fallback: Optional[str] = fallback
+        self.watchdog: Optional[Watchdog] = None
+        self._fallback_active: bool = False
+        # Set when deadlines are met again; the next HR sample re-seats the PID
+        self._rejoin_pending: bool = False
+        self._fallback_ramp: Optional[PowerRamp] = None
+        if fallback is not None:
+            if fallback not in FALLBACKS:
+                raise ValueError(f"Unknown fallback: {fallback}")
+            self.watchdog = Watchdog(self._on_deadline_miss, self._on_deadline_met)
+            self.watchdog.add(HR_DEADLINE, HR_DEADLINE_S)
+            self.watchdog.add(POWER_WRITE_DEADLINE, POWER_WRITE_DEADLINE_S)
+            if control_rate_hz is not None:
+                self.watchdog.add(
+                    CONTROL_TICK_DEADLINE, CONTROL_TICK_DEADLINE_PERIODS / control_rate_hz
+                )
+            if fallback == "ramp_down" and self.ramp is None:
+                self._fallback_ramp = PowerRamp(
+                    self._write_power,
+                    lambda: (self.min_power, self.max_power),
+                    FALLBACK_RAMP_RATE_W_PER_S,
+                )
+
+        self.control_mode: str = "pid"
+        self._adaptive: Optional[AdaptiveModel] = None
+        self._schedule: Optional[GainSchedule] = None
+        self.set_control_mode(control_mode)
 
         if trainer_control is not None:
             self.trainer_control = trainer_control
@@ -74,12 +234,71 @@ class Giger:
             return 0
         return sum(self._instant_power_deque) / len(self._instant_power_deque)
 
-    async def hr_subscribe(self):
-        await self.hr_client.start_notify(
-            HR_MEASUREMENT_UUID, self.hr_notification_callback
+    @property
+    def devices_connected(self) -> bool:
+        return self.trainer_control is not None and self.hr_client is not None
+
+    def checkpoint(self) -> ControllerCheckpoint:
+        pid = self.pid
+        kp, ki, kd = pid.tunings
+        return ControllerCheckpoint(
+            time(),
+            self._is_running,
+            CONTROL_MODES.index(self.control_mode),
+            self.hr_setpoint,
+            self.min_power,
+            self.max_power,
+            kp,
+            ki,
+            kd,
+            pid._integral,
+            pid._last_input,
+            pid._last_output,
+            self.current_pid_control_power,
+            self.last_written_power,
+            getattr(self.trainer_control, "gear", None),
+        )
+
+    def restore(self, checkpoint: ControllerCheckpoint):
+        """Pick up where a checkpoint left off, PID internals included."""
+        self.set_target_hr(checkpoint.hr_setpoint)
+        self.min_power = checkpoint.min_power
+        self.max_power = checkpoint.max_power
+        self.pid.output_limits = (self.min_power, self.max_power)
+        mode = CONTROL_MODES[checkpoint.control_mode]
+        if mode == "scheduled" and settings.gain_schedule is None:
+            logger.warning(
+                f"No gain schedule for {settings.rider_name}, restoring with fixed gains"
+            )
+            mode = "pid"
+        self.set_control_mode(mode)
+        pid = self.pid
+        pid.tunings = (checkpoint.kp, checkpoint.ki, checkpoint.kd)
+        pid.set_auto_mode(True, last_output=checkpoint.last_output)
+        pid._integral = checkpoint.integral
+        pid._last_input = checkpoint.last_input
+        pid._last_output = checkpoint.last_output
+        self.current_pid_control_power = int(checkpoint.target_power)
+        self._restored_gear = checkpoint.gear
+        self._resume_pending = checkpoint.running
+        logger.info(
+            f"Restored controller state from {time() - checkpoint.timestamp:.1f} s ago"
         )
+
+    def _resume_if_restored(self):
+        if self._resume_pending and self.devices_connected:
+            self._resume_pending = False
+            logger.info("Resuming control after restore")
+            self.start()
+
+    async def hr_subscribe(self, hr_client):
+        async def callback(sender, data):
+            # Until the swap, the new HRM's samples are dropped
+            if hr_client is self.hr_client:
+                await self.hr_notification_callback(sender, data)
+
+        await hr_client.start_notify(HR_MEASUREMENT_UUID, callback)
         logger.info("hr subscribed")
-        settings.last_used_hrm_uuid = self.hr_client.address
 
     def start(self):
         if self.trainer_control is None or self.hr_client is None:
@@ -113,45 +332,284 @@ class Giger:
         # logger.info(f"Setting Kd to {value}")
         self.pid.Kd = value
 
+    def set_gains(self, kp, ki, kd):
+        """Change all three gains without a jump in the PID output."""
+        pid = self.pid
+        if pid._last_input is not None:
+            # Move the P-term change into the integral so output is continuous
+            error = pid.setpoint - pid._last_input
+            low, high = pid.output_limits
+            pid._integral = min(max(pid._integral + (pid.Kp - kp) * error, low), high)
+        pid.tunings = (kp, ki, kd)
+
+    def set_control_mode(self, mode):
+        if mode not in CONTROL_MODES:
+            raise ValueError(f"Unknown control mode: {mode}")
+        if mode == "adaptive" and self.control_mode != "adaptive":
+            model = settings.rider_model
+            self._adaptive = AdaptiveModel(RiderModel(**model) if model else None)
+        if mode == "scheduled":
+            schedule = settings.gain_schedule
+            if schedule is None:
+                raise ValueError(f"No gain schedule for {settings.rider_name}")
+            self._schedule = GainSchedule.from_dict(schedule)
+        self.control_mode = mode
+        logger.info(f"Control mode set to {mode}")
+
     def set_target_hr(self, value):
         self.hr_setpoint = value
+        self.pid.setpoint = value
+
+    def set_power_limits(self, min_power, max_power):
+        # Both at once, so the pair is never briefly inverted
+        if not min_power < max_power:
+            raise ValueError(
+                f"Minimum power {min_power} W must be below maximum {max_power} W"
+            )
+        self.min_power = min_power
+        self.max_power = max_power
+        self.pid.output_limits = (min_power, max_power)
 
     def set_min_power(self, watts):
-        self.min_power = watts
-        self.pid.output_limits = (self.min_power, self.max_power)
+        self.set_power_limits(watts, self.max_power)
 
     def set_max_power(self, watts):
-        self.max_power = watts
-        self.pid.output_limits = (self.min_power, self.max_power)
+        self.set_power_limits(self.min_power, watts)
+
+    # Remote command name -> setter, in the order a batch is applied, after
+    # the power limits
+    _COMMAND_SETTERS = (
+        ("target_hr", "set_target_hr"),
+        ("kp", "set_kp"),
+        ("ki", "set_ki"),
+        ("kd", "set_kd"),
+    )
+
+    @property
+    def state(self) -> dict:
+        return {
+            "target_hr": self.hr_setpoint,
+            "min_power": self.min_power,
+            "max_power": self.max_power,
+            "power": self.current_pid_control_power,
+            "written_power": self.last_written_power,
+            "kp": self.pid.Kp,
+            "ki": self.pid.Ki,
+            "kd": self.pid.Kd,
+            "running": self._is_running,
+            "control_mode": self.control_mode,
+        }
+
+    async def apply_commands(self, commands: dict) -> dict:
+        """
+        Apply a batch of remote commands and return the resulting state.
+
+        The batch is validated up front and the setters run without yielding
+        to the event loop, so no HR sample is ever handled against a half
+        applied batch. A "power" command pauses PID control, the same as
+        setting watts by hand in the UI. The new state is also published as
+        `CommandsApplied`, so the UI can follow.
+        """
+        known = {name for name, _ in self._COMMAND_SETTERS}
+        known |= {"min_power", "max_power", "power"}
+        unknown = set(commands) - known
+        if unknown:
+            raise ValueError(f"Unknown commands: {', '.join(sorted(unknown))}")
+        # float(True) is 1.0, which would quietly set 1 W
+        flags = [name for name, value in commands.items() if isinstance(value, bool)]
+        if flags:
+            raise ValueError(f"Not a number: {', '.join(sorted(flags))}")
+        values = {name: float(value) for name, value in commands.items()}
+        not_finite = [name for name, value in values.items() if not math.isfinite(value)]
+        if not_finite:
+            raise ValueError(f"Not a finite number: {', '.join(sorted(not_finite))}")
+        if "power" in values and self.trainer_control is None:
+            raise ValueError("No trainer connected")
+        min_power = values.get("min_power", self.min_power)
+        max_power = values.get("max_power", self.max_power)
+        if not min_power < max_power:
+            raise ValueError(
+                f"Minimum power {min_power} W must be below maximum {max_power} W"
+            )
+
+        if "min_power" in values or "max_power" in values:
+            self.set_power_limits(min_power, max_power)
+        for name, setter in self._COMMAND_SETTERS:
+            if name in values:
+                getattr(self, setter)(values[name])
+        if "power" in values:
+            self.pause()
+            watts = min(max(values["power"], self.min_power), self.max_power)
+            await self.set_current_power(int(watts))
+        state = self.state
+        self.event_bus.publish(CommandsApplied(time(), state))
+        return state
 
     async def set_hr_client(self, hr_client):
-        if self.hr_client is not None:
-            await self.hr_client.disconnect()
+        """
+        Switch to `hr_client` once it is connected and subscribed.
+
+        The current HRM keeps feeding the controller until then, and is
+        only disconnected after the switch.
+        """
+        old_client = self.hr_client
+        if old_client is not None and old_client.address == hr_client.address:
+            # The same device can't be connected twice, so break first
+            await self._disconnect("hrm", old_client)
+            old_client = self.hr_client = None
+        try:
+            if not hr_client.is_connected:
+                await hr_client.connect()
+            await self.hr_subscribe(hr_client)
+        except Exception:
+            await self._disconnect("hrm", hr_client, publish=False)
+            raise
+        self._begin_swap("hrm", old_client, hr_client)
         self.hr_client = hr_client
-        await self.hr_client.connect()
-        await self.hr_subscribe()
+        if self._remember_devices:
+            settings.last_used_hrm_uuid = hr_client.address
+        self.event_bus.publish(ConnectionEvent(time(), "hrm", hr_client.address, True))
+        self._resume_if_restored()
+        if old_client is not None:
+            await self._disconnect("hrm", old_client)
+
+    async def set_power_meter_client(self, power_meter_client):
+        """Switch to `power_meter_client` once it is connected and subscribed."""
+        old_client = self.power_meter_client
+        if old_client is not None and old_client.address == power_meter_client.address:
+            await self._disconnect("power_meter", old_client)
+            old_client = self.power_meter_client = None
+
+        def handler(sender, data):
+            if power_meter_client is self.power_meter_client:
+                self._power_meter_notification_handler(sender, data)
+
+        try:
+            if not power_meter_client.is_connected:
+                await power_meter_client.connect()
+            await power_meter_client.start_notify(CYCLING_POWER_MEASUREMENT_UUID, handler)
+        except Exception:
+            await self._disconnect("power_meter", power_meter_client, publish=False)
+            raise
+        self._begin_swap("power_meter", old_client, power_meter_client)
+        self.power_meter_client = power_meter_client
+        self._last_crank = None
+        if self._remember_devices:
+            settings.last_used_power_meter_uuid = power_meter_client.address
+        self.event_bus.publish(
+            ConnectionEvent(time(), "power_meter", power_meter_client.address, True)
+        )
+        if old_client is not None:
+            await self._disconnect("power_meter", old_client)
 
     async def set_trainer_control(self, trainer_control):
-        self.pause()
-        if self.trainer_control is not None:
-            await self.trainer_control._client.disconnect()
+        """
+        Switch to `trainer_control` once it is connected, subscribed and
+        holding the current power; the old trainer carries on until then.
+        """
+        client = trainer_control._client
+        old_control = self.trainer_control
+        if old_control is not None and old_control._client.address == client.address:
+            self.pause()
+            await self._disconnect("trainer", old_control._client)
+            old_control = self.trainer_control = None
+
+        def handler(sender, data):
+            if trainer_control is self.trainer_control:
+                self._fec_notification_handler(sender, data)
+
+        if isinstance(trainer_control, FecTransport):
+            trainer_control.stats = self.trainer_write_stats
+        def held_power():
+            watts = self.last_written_power
+            return self.current_pid_control_power if watts is None else watts
+
+        try:
+            if not client.is_connected:
+                await client.connect()
+            # Subscribe to the raw FE-C characteristic ourselves rather than via
+            # enable_fec_notifications, which only decodes pages 16 and 25
+            await client.start_notify(TACX_FEC_READ_UUID, handler)
+            if self._restored_gear is not None and hasattr(trainer_control, "set_gear"):
+                await trainer_control.set_gear(self._restored_gear)
+                self._restored_gear = None
+            # Last, and again if the old trainer was written meanwhile, so the
+            # new one takes over at the power actually held when we switch
+            watts = None
+            while watts != held_power():
+                watts = held_power()
+                await trainer_control.set_target_power(watts)
+        except Exception:
+            await self._disconnect("trainer", client, publish=False)
+            raise
+        old_client = old_control._client if old_control is not None else None
+        self._begin_swap("trainer", old_client, client)
         self.trainer_control = trainer_control
-        if not self.trainer_control._client.is_connected:
-            await self.trainer_control._client.connect()
-        # self.trainer_control.set_general_fe_data_page_handler(lambda x: print(x))
-        self.trainer_control.set_specific_trainer_data_page_handler(
-            self._specific_trainer_data_page_handler
-        )
-        await self.trainer_control.enable_fec_notifications()
-        await self.set_current_power(self.current_pid_control_power)
-        settings.last_used_trainer_uuid = self.trainer_control._client.address
+        self.last_written_power = watts
+        if self.ramp is not None and self.ramp.current is None:
+            # Ramp from what the trainer is holding, not from nothing
+            self.ramp.current = watts
+        self.event_bus.publish(PowerWrite(time(), watts))
+        if self._remember_devices:
+            settings.last_used_trainer_uuid = client.address
+        self.event_bus.publish(ConnectionEvent(time(), "trainer", client.address, True))
+        self._resume_if_restored()
+        if old_client is not None:
+            await self._disconnect("trainer", old_client)
+
+    async def _disconnect(self, device, client, publish=True):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            # Often the reason for the swap is that it has already gone
+            logger.warning(f"Disconnecting {device} {client.address} failed: {e}")
+        if publish:
+            self.event_bus.publish(ConnectionEvent(time(), device, client.address, False))
+
+    def _begin_swap(self, device, old_client, new_client):
+        if old_client is None:
+            return
+        last_seen = self._last_data_time[device] or time()
+        self._pending_swaps[device] = (last_seen, old_client.address, new_client.address)
+
+    def _on_device_data(self, device, timestamp):
+        if self._pending_swaps:
+            swap = self._pending_swaps.pop(device, None)
+            if swap is not None:
+                last_seen, old_address, new_address = swap
+                gap = timestamp - last_seen
+                logger.info(
+                    f"Swapped {device} {old_address} -> {new_address}, {gap:.2f} s without data"
+                )
+                self.event_bus.publish(
+                    DeviceSwap(timestamp, device, old_address, new_address, gap)
+                )
+        self._last_data_time[device] = timestamp
 
         ## not sure why this was here, but let's leave it for now, commented out
         # if not self._never_started:
         #     self.start()
 
+    def _fec_notification_handler(self, _, data: bytearray):
+        timestamp = time()
+        self._on_device_data("trainer", timestamp)
+        record = self.fec.decode(data, timestamp)
+        if record is None:
+            return
+        if type(record) is TrainerData:
+            self._specific_trainer_data_page_handler(record)
+        elif type(record) is CommandStatus and isinstance(
+            self.trainer_control, FecTransport
+        ):
+            self.trainer_control.on_command_status(record)
+        self.event_bus.publish(record)
+
     def _specific_trainer_data_page_handler(self, data):
         self._instant_power_deque.append(data.instantaneous_power)
+        if self.fusion is not None:
+            self.fusion.add("trainer_power", data.timestamp, data.instantaneous_power)
+            self.fusion.add("trainer_cadence", data.timestamp, data.cadence)
+        self.mean_max_power.on_trainer_data(data)
         self._update_power_callback(self.current_trainer_power)
 
     @staticmethod
@@ -166,25 +624,245 @@ class Giger:
         return hr
 
     async def hr_notification_callback(self, _, data: bytearray):
-        hr: int = self.parse_hr_data(data)
+        hr, rr_intervals = parse_hr_measurement(data)
+        timestamp = time()
+        self._on_device_data("hrm", timestamp)
+        if self.watchdog is not None:
+            self.watchdog.kick(HR_DEADLINE)
+        filtered_hr = self.hr_filter.update(hr, rr_intervals)
         self.current_hr = hr
-        logger.info(f"Received new HR value {hr}")
+        logger.info("Received new HR value {} (filtered {:.1f})", hr, filtered_hr)
+        self._hr_hold.put(timestamp, filtered_hr)
+        if self.fusion is not None:
+            device_time = None
+            if rr_intervals:
+                # The last interval ends on the beat this HR was sent for
+                self._beat_clock += sum(rr_intervals)
+                device_time = self._beat_clock
+            self.fusion.add("hr", timestamp, hr, device_time)
+            self.fusion.add("filtered_hr", timestamp, filtered_hr, device_time)
+        self.event_bus.publish(HRSample(timestamp, hr, filtered_hr))
         self._update_hr_callback(hr)
-        control = self.pid(hr)
-        try:
-            logstr = f"PID control value changing from {self.current_pid_control_power:.2f} to {control: .2f}"
-            if not self._is_running:
-                logstr += " (but doing nothing because PID control disabled)"
-            logger.info(logstr)
-        except (TypeError, ValueError):
-            pass
-        if not self._is_running:
+        if self.control_rate_hz is None:
+            await self.control_step(Measurement(timestamp, filtered_hr))
+
+    def _power_meter_notification_handler(self, _, data: bytearray):
+        timestamp = time()
+        self._on_device_data("power_meter", timestamp)
+        record = parse_cycling_power_measurement(data, timestamp)
+        # Only a crank event that has moved on says when the power was measured
+        device_time = None
+        if record.crank_revolutions is not None:
+            last = self._last_crank
+            if last is None:
+                self._last_crank = (record.crank_revolutions, record.crank_event_time)
+            elif record.crank_revolutions != last[0]:
+                revolutions = (record.crank_revolutions - last[0]) & 0xFFFF
+                elapsed = (record.crank_event_time - last[1]) % CRANK_EVENT_TIME_WRAP
+                if elapsed:
+                    self.current_meter_cadence = 60 * revolutions / elapsed
+                    device_time = record.crank_event_time
+                self._last_crank = (record.crank_revolutions, record.crank_event_time)
+        if self.fusion is not None:
+            self.fusion.add(
+                "meter_power", timestamp, record.instantaneous_power, device_time
+            )
+            if device_time is not None:
+                self.fusion.add(
+                    "meter_cadence", timestamp, self.current_meter_cadence, device_time
+                )
+        self.event_bus.publish(record)
+
+    def _adapt(self, timestamp: float, hr: int):
+        power = self.current_trainer_power or self.current_pid_control_power
+        model = self._adaptive.update(timestamp, hr, power)
+        if model is None:
+            return
+        kp, ki, kd = self._adaptive.gains()
+        self.set_gains(kp, ki, kd)
+        self.event_bus.publish(
+            ModelEstimate(
+                timestamp,
+                model.gain,
+                model.time_constant,
+                model.dead_time,
+                model.offset,
+                kp,
+                ki,
+                kd,
+            )
+        )
+
+    async def control_step(self, measurement: Measurement, dt: Optional[float] = None):
+        hr = measurement.value
+        if self._rejoin_pending:
+            self._rejoin(hr)
+            return
+        if self.control_mode == "adaptive":
+            self._adapt(measurement.timestamp, hr)
+        elif self.control_mode == "scheduled":
+            # set_gains carries the P-term change into the integral, so moving
+            # across the table is bumpless
+            self.set_gains(*self._schedule.gains(self.pid.setpoint, hr))
+        control = self.pid(hr, dt=dt)
+        if control is not None:
+            self._record_components(measurement.timestamp, hr, control)
+            self.event_bus.publish(
+                PIDOutput(measurement.timestamp, hr, self.pid.setpoint, control)
+            )
+            # Arguments rather than an f-string so nothing is formatted unless
+            # a sink is going to emit the line
+            logger.info(
+                "PID control value changing from {:.2f} to {: .2f}{}",
+                self.current_pid_control_power,
+                control,
+                (
+                    ""
+                    if self._is_running
+                    else " (but doing nothing because PID control disabled)"
+                ),
+            )
+        if not self._is_running or self._fallback_active:
             return
         if control is not None:
             new_power = int(control)
             await self.set_current_power(new_power)
 
+    def _record_components(self, timestamp, hr, control):
+        pid = self.pid
+        low, high = pid.output_limits
+        if low is not None and control <= low:
+            clamp = CLAMP_LOW
+        elif high is not None and control >= high:
+            clamp = CLAMP_HIGH
+        else:
+            clamp = CLAMP_NONE
+        p, i, d = pid.components
+        self.pid_components.append(
+            timestamp, pid.setpoint - hr, p, i, d, control, clamp
+        )
+
+    async def run_control_loop(self):
+        """
+        Tick the controller at `control_rate_hz` on the running event loop.
+
+        Each tick reads the held HR sample and, if a new one has arrived,
+        steps the PID with dt taken from the sample timestamps, so the
+        result depends only on the measurements and not on when ticks ran.
+        With sensor fusion, each tick publishes the fused samples that have
+        come due and steps on the latest of them instead.
+        """
+        if self.control_rate_hz is None:
+            raise ValueError("Fixed-rate control requires control_rate_hz")
+        fusion = self.fusion
+        loop = asyncio.get_running_loop()
+        period = 1 / self.control_rate_hz
+        next_tick = loop.time()
+        last_timestamp: Optional[float] = None
+        while True:
+            if self.watchdog is not None:
+                self.watchdog.kick(CONTROL_TICK_DEADLINE)
+            if fusion is None:
+                sample = self._hr_hold.get()
+            else:
+                sample = self._advance_fusion()
+            if sample is not None and (
+                last_timestamp is None or sample.timestamp > last_timestamp
+            ):
+                dt = period if last_timestamp is None else sample.timestamp - last_timestamp
+                last_timestamp = sample.timestamp
+                await self.control_step(sample, dt=dt)
+            next_tick += period
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Overran; drop the missed ticks instead of bursting to catch up
+                skipped = int(-delay // period) + 1
+                next_tick += skipped * period
+                delay = next_tick - loop.time()
+            await asyncio.sleep(delay)
+
+    def _advance_fusion(self) -> Optional[Measurement]:
+        """Publish the fused samples now due; the latest HR among them, if any."""
+        samples = self.fusion.advance(time())
+        for sample in samples:
+            self.event_bus.publish(sample)
+        if not samples or math.isnan(samples[-1].filtered_hr):
+            return None
+        return Measurement(samples[-1].timestamp, samples[-1].filtered_hr)
+
     async def set_current_power(self, watts):
-        await self.trainer_control.set_target_power(watts)
         self.current_pid_control_power = watts
+        if self.ramp is not None:
+            self.ramp.set_target(watts)
+            return
+        await self._write_power(watts)
         # self._update_power_callback(watts)
+
+    async def _write_power(self, watts):
+        watchdog = self.watchdog
+        if watchdog is not None:
+            # Only a finished write meets the deadline; starting one doesn't
+            watchdog.arm(POWER_WRITE_DEADLINE)
+        written = False
+        try:
+            await self.trainer_control.set_target_power(watts)
+            written = True
+        finally:
+            # A write that raised leaves the deadline armed from the first
+            # unfinished one, so writes that keep failing end in a miss and
+            # the fallback rather than counting as met
+            if watchdog is not None and written:
+                watchdog.disarm(POWER_WRITE_DEADLINE)
+        self.last_written_power = watts
+        self.event_bus.publish(PowerWrite(time(), watts))
+
+    def _on_deadline_miss(self, miss: DeadlineMiss):
+        self.event_bus.publish(miss)
+        if not self._is_running or self._fallback_active:
+            return
+        self._fallback_active = True
+        self._rejoin_pending = False
+        logger.warning(
+            f"Falling back to {self.fallback} after missing the {miss.deadline} "
+            f"deadline, handled {miss.loop_delay * 1000:.0f} ms after detection"
+        )
+        if self.fallback == "freeze":
+            self.pid.auto_mode = False
+        elif self.fallback == "ramp_down":
+            ramp = self.ramp
+            if ramp is None:
+                ramp = self._fallback_ramp
+                ramp.current = self.last_written_power
+            ramp.set_target(self.min_power)
+
+    def _on_deadline_met(self, deadline):
+        if not self._fallback_active or not self.watchdog.healthy:
+            return
+        logger.info(f"{deadline} deadline met again, returning to PID control")
+        self._fallback_active = False
+        self._rejoin_pending = True
+        for ramp in (self.ramp, self._fallback_ramp):
+            if ramp is not None:
+                ramp.stop()
+
+    def _rejoin(self, hr):
+        """
+        Take over from whatever power the fallback left on the trainer.
+
+        The PID is re-seated so that its output for `hr` is that power, and
+        stepping resumes from the next sample, so there's no jump from the
+        gap showing up in dt.
+        """
+        self._rejoin_pending = False
+        held = self.last_written_power
+        if held is None:
+            held = self.current_pid_control_power
+        pid = self.pid
+        if not pid.auto_mode:
+            pid.set_auto_mode(True, last_output=held)
+        low, high = pid.output_limits
+        pid._integral = min(max(held - pid.Kp * (pid.setpoint - hr), low), high)
+        pid._last_input = hr
+        pid._last_output = held
+        pid._last_time = pid.time_fn()
+        self.current_pid_control_power = held
@@ -0,0 +1,240 @@
+"""
+Converts recorded sessions into one columnar dataset for fleet analysis.
+
+Sessions land in a hive-partitioned tree,
+rider=<rider>/date=<YYYY-MM-DD>/station=<station>/<session>.parquet, with a
+manifest of what has been converted and a summary index of every session.
+
+    python convert.py dataset rides/*.giger [--format arrow] [--processes N]
+"""
+import argparse
+import json
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import gmtime, perf_counter, strftime
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from analytics import open_session
+from loguru import logger
+from recorder import SESSION_COLUMNS, SESSION_SUFFIX
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+PARQUET_COMPRESSION = "zstd"
+# Rows read, converted and written at a time; a chunk is ~2 MB of session data
+CHUNK_ROWS = 1 << 16
+
+MANIFEST_FILE = "_manifest.json"
+MANIFEST_VERSION = 1
+SUMMARY_FILE = "_sessions"
+
+SESSION_SCHEMA = pa.schema(
+    [(name, pa.float64() if fmt == "d" else pa.float32()) for name, fmt in SESSION_COLUMNS]
+)
+
+
+def _partition_value(value) -> str:
+    # Keep directory names portable whatever a rider or host is called
+    return re.sub(r"[^\w.-]", "_", str(value)) if value else "unknown"
+
+
+def _open_writer(path: str, file_format: str):
+    if file_format == "parquet":
+        return pq.ParquetWriter(path, SESSION_SCHEMA, compression=PARQUET_COMPRESSION)
+    return pa.ipc.new_file(path, SESSION_SCHEMA)
+
+
+def _write_table(table: pa.Table, path: str, file_format: str):
+    if file_format == "parquet":
+        pq.write_table(table, path, compression=PARQUET_COMPRESSION)
+    else:
+        with pa.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _init_worker():
+    # One process per core already; Arrow's own pools would oversubscribe them
+    pa.set_cpu_count(1)
+    pa.set_io_thread_count(1)
+
+
+def convert_session(
+    path: str, dataset: str, file_format: str = "parquet", chunk_rows: int = CHUNK_ROWS
+) -> Dict:
+    """
+    Write one session into the dataset and return its summary.
+
+    Rows are streamed from the memory-mapped session `chunk_rows` at a time,
+    each chunk becoming a row group or record batch, so memory use doesn't
+    grow with the length of the ride. The file is written under a temporary
+    name and renamed into place once complete.
+    """
+    metadata, rows = open_session(path)
+    start = metadata.get("start")
+    date = strftime("%Y-%m-%d", gmtime(start)) if start else "unknown"
+    rider = _partition_value(metadata.get("rider"))
+    station = _partition_value(metadata.get("station"))
+    directory = os.path.join(f"rider={rider}", f"date={date}", f"station={station}")
+    name = os.path.basename(path)
+    if name.endswith(SESSION_SUFFIX):
+        name = name[: -len(SESSION_SUFFIX)]
+    output = os.path.join(directory, name + FORMATS[file_format])
+    os.makedirs(os.path.join(dataset, directory), exist_ok=True)
+
+    hr_sum = power_sum = 0.0
+    hr_count = power_count = controlled = 0
+    max_hr = max_power = -math.inf
+    final_path = os.path.join(dataset, output)
+    temp_path = final_path + ".tmp"
+    writer = _open_writer(temp_path, file_format)
+    try:
+        for offset in range(0, len(rows), chunk_rows):
+            chunk = rows[offset : offset + chunk_rows]
+            columns = [np.ascontiguousarray(chunk[name]) for name, _ in SESSION_COLUMNS]
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=SESSION_SCHEMA))
+            hr = chunk["hr"][~np.isnan(chunk["hr"])]
+            power = chunk["power"][~np.isnan(chunk["power"])]
+            hr_sum += float(hr.sum(dtype=np.float64))
+            hr_count += len(hr)
+            power_sum += float(power.sum(dtype=np.float64))
+            power_count += len(power)
+            if len(hr):
+                max_hr = max(max_hr, float(hr.max()))
+            if len(power):
+                max_power = max(max_power, float(power.max()))
+            controlled += int(np.count_nonzero(~np.isnan(chunk["pid_output"])))
+    finally:
+        writer.close()
+    os.replace(temp_path, final_path)
+
+    rate_hz = metadata.get("rate_hz", 1)
+    return {
+        "session": name,
+        "output": output,
+        "rider": metadata.get("rider"),
+        "station": metadata.get("station"),
+        "date": date,
+        "start": start,
+        "end": float(rows["timestamp"][-1]) if len(rows) else start,
+        "rows": len(rows),
+        "duration_s": len(rows) / rate_hz,
+        "controlled_s": controlled / rate_hz,
+        "mean_hr": hr_sum / hr_count if hr_count else None,
+        "max_hr": max_hr if hr_count else None,
+        "mean_power": power_sum / power_count if power_count else None,
+        "max_power": max_power if power_count else None,
+    }
+
+
+def _source_state(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(dataset: str) -> dict:
+    try:
+        with open(os.path.join(dataset, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["sessions"]
+
+
+def save_manifest(dataset: str, sessions: dict):
+    path = os.path.join(dataset, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "sessions": sessions}, f)
+    os.replace(path + ".tmp", path)
+
+
+def convert_sessions(
+    paths: Iterable[str],
+    dataset: str,
+    file_format: str = "parquet",
+    processes: Optional[int] = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> dict:
+    """
+    Convert every session not already in the dataset's manifest.
+
+    A session is skipped if its size and modification time match the
+    manifest and its output is still there, so a ride that was still being
+    recorded last time is converted again. The manifest is saved after each
+    session, so an interrupted batch picks up where it stopped. Returns the
+    manifest's sessions.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format: {file_format}")
+    os.makedirs(dataset, exist_ok=True)
+    sessions = load_manifest(dataset)
+    pending = {}
+    for path in paths:
+        key = os.path.realpath(path)
+        entry = sessions.get(key)
+        state = _source_state(path)
+        if (
+            entry is not None
+            and entry["source"] == state
+            and entry["summary"]["output"].endswith(FORMATS[file_format])
+            and os.path.exists(os.path.join(dataset, entry["summary"]["output"]))
+        ):
+            continue
+        pending[key] = state
+    logger.info(f"Converting {len(pending)} sessions, {len(sessions)} in the manifest")
+
+    started = perf_counter()
+    total_rows = 0
+    # Every file is independent, so throughput goes with the number of workers
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(convert_session, key, dataset, file_format, chunk_rows): key
+            for key in pending
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.error(f"Converting {key} failed: {e}")
+                continue
+            sessions[key] = {"source": pending[key], "summary": summary}
+            save_manifest(dataset, sessions)
+            total_rows += summary["rows"]
+    elapsed = perf_counter() - started
+    if pending:
+        logger.info(
+            f"Converted {total_rows} rows in {elapsed:.1f} s, "
+            f"{total_rows / max(elapsed, 1e-9):,.0f} rows/s"
+        )
+    write_summary(dataset, sessions, file_format)
+    return sessions
+
+
+def write_summary(dataset: str, sessions: dict, file_format: str = "parquet"):
+    """One row per converted session, ordered by start time."""
+    summaries = sorted(
+        (entry["summary"] for entry in sessions.values()),
+        key=lambda summary: summary["start"] or 0,
+    )
+    path = os.path.join(dataset, SUMMARY_FILE + FORMATS[file_format])
+    _write_table(pa.Table.from_pylist(summaries), path + ".tmp", file_format)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset", help="directory the dataset is written to")
+    parser.add_argument("sessions", nargs="+", help="session files to convert")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument(
+        "--processes", type=int, default=None, help="worker processes, default one per core"
+    )
+    args = parser.parse_args()
+    convert_sessions(args.sessions, args.dataset, args.format, args.processes)
@@ -3,27 +3,28 @@ from collections import OrderedDict
 
 from bleak import BleakScanner, BleakClient, BLEDevice
 from customtkinter import CTkFrame, CTkToplevel, CTkScrollableFrame, CTkButton
-from devices import HR_SERVICE_UUID, TACX_UART_BLE_UUID
+from devices import HR_SERVICE_UUID, TACX_FEC_WRITE_UUID, TACX_UART_BLE_UUID
+from fec_transport import FecTransport
 from loguru import logger
-from pycycling.tacx_trainer_control import TacxTrainerControl
 from tkinter import ttk
 
 
 class DevicePicker(CTkToplevel):
 
-    def __init__(self, *args, done_callback=None, loop=None, **kwargs):
+    def __init__(self, *args, done_callback=None, loop=None, submit=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.geometry("550x475")
         self.bind("<Configure>", lambda x: print(x))
         self._done_callback = done_callback or (lambda *args, **kwargs: None)
         self._loop = loop or asyncio.get_event_loop()
+        self._submit = submit or (
+            lambda coro: asyncio.run_coroutine_threadsafe(coro, self._loop)
+        )
         self._scan_stop_event = asyncio.Event()
         self._hrm_devices = OrderedDict()
         self._trainer_devices = OrderedDict()
         self._setup_ui()
-        self._scan_future = asyncio.run_coroutine_threadsafe(
-            self._device_scan(), self._loop
-        )
+        self._scan_future = self._submit(self._device_scan())
 
     def _setup_ui(self):
         self._table_frame = CTkFrame(master=self)
@@ -110,20 +111,24 @@ class DevicePicker(CTkToplevel):
         for device in trainers:
             self._add_trainer_device(device)
 
+    def _stop_scan(self):
+        # asyncio.Event isn't thread-safe, so set it on the loop
+        self._loop.call_soon_threadsafe(self._scan_stop_event.set)
+
     def _ok_button_callback(self):
-        self._scan_stop_event.set()
+        self._stop_scan()
         hrm_device = self._hr_table.focus()
         hrm_client = BleakClient(hrm_device) if hrm_device else None
 
         trainer_device = self._trainer_table.focus()
         if trainer_device:
             trainer_client = BleakClient(trainer_device)
-            tacx_client = TacxTrainerControl(trainer_client)
+            tacx_client = FecTransport(trainer_client, TACX_FEC_WRITE_UUID)
         else:
             tacx_client = None
         self._done_callback(hrm_client, tacx_client)
         self.destroy()
 
     def _cancel_button_callback(self):
-        self._scan_stop_event.set()
+        self._stop_scan()
         self.destroy()
@@ -1,13 +1,17 @@
+import struct
 from typing import Tuple
 
+from _types import CyclingPowerData
 from bleak import BleakClient
+from fec_transport import FecTransport
 from loguru import logger
-from pycycling.tacx_trainer_control import TacxTrainerControl
 
 # Define your device UUIDs
 TRAINER_UUID = "EA71FD11-431B-3749-30C7-AF3717508D38"
 # TRAINER_UUID = "5058AE50-D605-4CE1-1D84-7F8A10DBDC78"
 TACX_UART_BLE_UUID = "6e40fec1-b5a3-f393-e0a9-e50e24dcca9e"
+TACX_FEC_READ_UUID = "6e40fec2-b5a3-f393-e0a9-e50e24dcca9e"
+TACX_FEC_WRITE_UUID = "6e40fec3-b5a3-f393-e0a9-e50e24dcca9e"
 
 HR_MONITOR_UUID = "AC9BB01F-731A-FF9A-A51F-3483EC6F638E"
 # HR_MONITOR_UUID = "E990CA57-5D7B-089E-11EE-54FB2E917B38"
@@ -15,8 +19,38 @@ HR_MONITOR_UUID = "AC9BB01F-731A-FF9A-A51F-3483EC6F638E"
 HR_SERVICE_UUID = "0000180d-0000-1000-8000-00805f9b34fb"
 HR_MEASUREMENT_UUID = "00002a37-0000-1000-8000-00805f9b34fb"
 
-
-class TacXWrapper:
+POWER_METER_UUID = None
+CYCLING_POWER_SERVICE_UUID = "00001818-0000-1000-8000-00805f9b34fb"
+CYCLING_POWER_MEASUREMENT_UUID = "00002a63-0000-1000-8000-00805f9b34fb"
+CRANK_EVENT_TIME_UNIT = 1 / 1024  # s
+CRANK_EVENT_TIME_WRAP = 0x10000 * CRANK_EVENT_TIME_UNIT
+
+# Optional Cycling Power Measurement fields ahead of the crank data: flag bit,
+# size in bytes
+_CPS_FIELDS_BEFORE_CRANK = ((0x01, 1), (0x04, 2), (0x10, 6))
+_CPS_CRANK_PRESENT = 0x20
+_CPS_HEADER = struct.Struct("<Hh")
+_CPS_CRANK = struct.Struct("<HH")
+
+
+def parse_cycling_power_measurement(data: bytearray, timestamp: float) -> CyclingPowerData:
+    """
+    Power, and crank revolutions and last crank event time (s) if the meter
+    sends them, from a Cycling Power Measurement.
+    """
+    flags, power = _CPS_HEADER.unpack_from(data)
+    offset = _CPS_HEADER.size
+    for flag, size in _CPS_FIELDS_BEFORE_CRANK:
+        if flags & flag:
+            offset += size
+    revolutions = event_time = None
+    if flags & _CPS_CRANK_PRESENT:
+        revolutions, ticks = _CPS_CRANK.unpack_from(data, offset)
+        event_time = ticks * CRANK_EVENT_TIME_UNIT
+    return CyclingPowerData(timestamp, power, revolutions, event_time)
+
+
+class TacXWrapper(FecTransport):
     user_weight = 75
     bicycle_weight = 15
     wheel_diameter = 2.1
@@ -47,18 +81,18 @@ class TacXWrapper:
         24: 5.49,
     }
 
-    def __init__(self, client):
-        self._client = client
-        self._trainer_control = TacxTrainerControl(client)
+    def __init__(self, client, **kwargs):
+        super().__init__(client, TACX_FEC_WRITE_UUID, **kwargs)
         self._gear = 12
 
-    async def set_target_power(self, power):
-        await self._trainer_control.set_target_power(power)
+    @property
+    def gear(self):
+        return self._gear
 
     async def set_gear(self, gear):
         try:
             self.gear_ratios[gear]
-            await self._trainer_control.set_user_configuration(
+            await self.set_user_configuration(
                 self.user_weight,
                 self.bicycle_weight,
                 self.wheel_diameter,
@@ -78,7 +112,7 @@ class TacXWrapper:
 
 async def set_up_devices(
     trainer_device_uuid: str, hr_device_uuid: str
-) -> Tuple[TacxTrainerControl, BleakClient]:
+) -> Tuple[FecTransport, BleakClient]:
     trainer_client = BleakClient(trainer_device_uuid)
     hr_client = BleakClient(hr_device_uuid)
 
@@ -93,7 +127,7 @@ async def set_up_devices(
     if not trainer_client.is_connected:
         raise RuntimeError("Failed to connect to trainer")
     logger.info("Trainer connected!")
-    trainer_control = TacxTrainerControl(trainer_client)
+    trainer_control = FecTransport(trainer_client, TACX_FEC_WRITE_UUID)
     return trainer_control, hr_client
 
 
@@ -114,10 +148,20 @@ async def set_up_trainer(uuid=TRAINER_UUID):
     if not trainer_client.is_connected:
         raise RuntimeError("Failed to connect to trainer")
     logger.info("Trainer connected!")
-    trainer_control = TacxTrainerControl(trainer_client)
+    trainer_control = FecTransport(trainer_client, TACX_FEC_WRITE_UUID)
     return trainer_control
 
 
+async def set_up_power_meter(uuid=POWER_METER_UUID):
+    logger.info("Connecting to power meter")
+    power_meter_client = BleakClient(uuid)
+    await power_meter_client.connect()
+    if not power_meter_client.is_connected:
+        raise RuntimeError("Failed to connect to power meter")
+    logger.info("Power meter connected!")
+    return power_meter_client
+
+
 async def set_up_trainer_wrapper():
     trainer_client = BleakClient(TRAINER_UUID)
     logger.info("Connecting to trainer")
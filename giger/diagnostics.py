@@ -0,0 +1,221 @@
+import asyncio
+import bisect
+import os
+import sys
+import threading
+from collections import Counter
+from time import perf_counter, sleep, strftime
+from typing import Dict, Optional, Sequence
+
+from loguru import logger
+
+# Upper bucket bounds in milliseconds; the last bucket is open ended
+HISTOGRAM_BOUNDS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; recording is a bisect and an increment."""
+
+    def __init__(self, bounds_ms: Sequence[float] = HISTOGRAM_BOUNDS_MS):
+        self._bounds = tuple(bounds_ms)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.max_ms = 0.0
+
+    def record(self, seconds: float):
+        ms = seconds * 1000
+        self._counts[bisect.bisect_left(self._bounds, ms)] += 1
+        self.count += 1
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th percentile, in ms."""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for bound, count in zip(self._bounds, self._counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max_ms
+
+    def reset(self):
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.count = 0
+        self.max_ms = 0.0
+
+    @property
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max_ms,
+            "buckets": dict(
+                zip([*map(str, self._bounds), "inf"], self._counts)
+            ),
+        }
+
+
+class LoopLagProbe:
+    """Measures how late an asyncio sleep wakes up on the loop it runs on."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.histogram = Histogram()
+        self.thread_ident: Optional[int] = None
+
+    async def run(self):
+        self.thread_ident = threading.get_ident()
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.histogram.record(max(loop.time() - started - self.interval, 0))
+
+
+class TkStallDetector:
+    """Measures how late a Tk `after` timer fires on the widget's mainloop."""
+
+    def __init__(self, widget, interval_ms: int = 50):
+        self._widget = widget
+        self._interval_ms = interval_ms
+        self.histogram = Histogram()
+        self._expected: Optional[float] = None
+
+    def start(self):
+        self._expected = perf_counter() + self._interval_ms / 1000
+        self._widget.after(self._interval_ms, self._tick)
+
+    def _tick(self):
+        now = perf_counter()
+        self.histogram.record(max(now - self._expected, 0))
+        self._expected = now + self._interval_ms / 1000
+        self._widget.after(self._interval_ms, self._tick)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of chosen threads and writes them in collapsed-stack
+    form ("frame;frame;frame count"), ready for flamegraph tools.
+
+    `module` limits the output to stacks that pass through that source file,
+    which is how a single subsystem is picked out of a shared thread.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_idents, seconds: float, path: str, module=None):
+        if self.running:
+            raise RuntimeError("A profile is already being recorded")
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(set(thread_idents), seconds, path, module),
+            name="giger-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self, thread_idents, seconds, path, module):
+        stacks: Counter = Counter()
+        deadline = perf_counter() + seconds
+        while perf_counter() < deadline:
+            frames = sys._current_frames()
+            for ident in thread_idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = self._collapse(frame, module)
+                    if stack:
+                        stacks[stack] += 1
+            sleep(self.interval)
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {sum(stacks.values())} profile samples to {path}")
+
+    @staticmethod
+    def _collapse(frame, module) -> str:
+        names = []
+        matched = module is None
+        while frame is not None:
+            code = frame.f_code
+            if not matched and code.co_filename.endswith(module):
+                matched = True
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names)) if matched else ""
+
+
+class Diagnostics:
+    """
+    Loop lag, Tk stalls, UI input to trainer write latency, event bus lag,
+    watchdog deadline misses, FE-C write timings and on-demand subsystem
+    profiles.
+    """
+
+    # Subsystem -> (threads to sample, source file the stack must pass through)
+    SUBSYSTEMS = {
+        "controller": (("loop",), None),
+        "graph": (("tk",), "graph.py"),
+        "device picker": (("tk", "loop"), "device_picker.py"),
+    }
+
+    def __init__(self, event_bus=None):
+        self._event_bus = event_bus
+        self.loop_lag = LoopLagProbe()
+        self.tk_stall: Optional[TkStallDetector] = None
+        self.input_to_write = Histogram()
+        self.watchdog = None
+        self.trainer_writes = None
+        self.profiler = SamplingProfiler()
+
+    def watch_tk(self, widget):
+        self.tk_stall = TkStallDetector(widget)
+        self.tk_stall.start()
+
+    def watch_deadlines(self, watchdog):
+        self.watchdog = watchdog
+
+    def watch_trainer_writes(self, stats):
+        self.trainer_writes = stats
+
+    def _thread_idents(self, names) -> set:
+        idents = {
+            "loop": self.loop_lag.thread_ident,
+            "tk": threading.main_thread().ident,
+        }
+        return {idents[name] for name in names if idents[name] is not None}
+
+    def profile(self, subsystem: str, seconds: float) -> str:
+        """Start profiling `subsystem` in the background; returns the output path."""
+        if subsystem not in self.SUBSYSTEMS:
+            raise ValueError(f"Unknown subsystem: {subsystem}")
+        threads, module = self.SUBSYSTEMS[subsystem]
+        path = f"profile-{subsystem.replace(' ', '_')}-{strftime('%Y%m%d-%H%M%S')}.collapsed"
+        self.profiler.start(self._thread_idents(threads), seconds, path, module)
+        logger.info(f"Profiling {subsystem} for {seconds:g} s")
+        return path
+
+    def summary(self) -> Dict[str, dict]:
+        summary = {"loop_lag": self.loop_lag.histogram.summary}
+        if self.tk_stall is not None:
+            summary["tk_stall"] = self.tk_stall.histogram.summary
+        if self.input_to_write.count:
+            summary["input_to_write"] = self.input_to_write.summary
+        if self.watchdog is not None:
+            summary["deadlines"] = self.watchdog.summary
+        if self.trainer_writes is not None:
+            summary["trainer_writes"] = self.trainer_writes.summary
+        if self._event_bus is not None:
+            summary["event_bus"] = self._event_bus.metrics()
+        return summary
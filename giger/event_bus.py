@@ -0,0 +1,134 @@
+import asyncio
+import inspect
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Type
+
+from loguru import logger
+
+DEFAULT_QUEUE_SIZE = 256
+
+
+class Subscription:
+    """A subscriber's bounded queue, delivery task and lag metrics."""
+
+    def __init__(self, name: str, callback: Callable, maxsize: int):
+        self.name = name
+        self._callback = callback
+        self._is_coroutine = inspect.iscoroutinefunction(callback)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._task: Optional[asyncio.Task] = None
+        self.delivered: int = 0
+        self.dropped: int = 0
+        self.errors: int = 0
+        self.last_lag: float = 0.0
+        self.max_lag: float = 0.0
+        self._total_lag: float = 0.0
+
+    def offer(self, event):
+        # Drop the oldest event rather than block the publisher
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning(
+                    f"Subscriber {self.name} is falling behind, {self.dropped} events dropped"
+                )
+        self._queue.put_nowait((perf_counter(), event))
+
+    async def _deliver(self):
+        while True:
+            published_at, event = await self._queue.get()
+            lag = perf_counter() - published_at
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._total_lag += lag
+            try:
+                if self._is_coroutine:
+                    await self._callback(event)
+                else:
+                    self._callback(event)
+            except Exception:
+                self.errors += 1
+                logger.exception(f"Subscriber {self.name} raised")
+            self.delivered += 1
+
+    @property
+    def metrics(self) -> dict:
+        mean_lag = self._total_lag / self.delivered if self.delivered else 0.0
+        return {
+            "depth": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_lag_ms": self.last_lag * 1000,
+            "mean_lag_ms": mean_lag * 1000,
+            "max_lag_ms": self.max_lag * 1000,
+        }
+
+
+class EventBus:
+    """
+    In-process publish/subscribe for controller events (see `_types`).
+
+    `publish` never blocks: it only appends to each subscriber's bounded
+    queue, and every subscriber has its own delivery task on the loop.
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._loop = loop
+        self._subscriptions: Dict[Type, List[Subscription]] = {}
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        return self._loop
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._get_loop()
+        except RuntimeError:
+            return False
+
+    def subscribe(
+        self,
+        name: str,
+        callback: Callable,
+        *event_types: Type,
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+    ) -> Subscription:
+        subscription = Subscription(name, callback, maxsize)
+        for event_type in event_types:
+            self._subscriptions.setdefault(event_type, []).append(subscription)
+        if self._on_loop():
+            subscription._task = self._loop.create_task(subscription._deliver())
+        else:
+            # Safe before the loop is running; the task starts with it
+            self._get_loop().call_soon_threadsafe(self._start_delivery, subscription)
+        return subscription
+
+    def _start_delivery(self, subscription: Subscription):
+        subscription._task = self._loop.create_task(subscription._deliver())
+
+    def unsubscribe(self, subscription: Subscription):
+        for subscriptions in self._subscriptions.values():
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+        if subscription._task is not None:
+            subscription._task.cancel()
+
+    def publish(self, event):
+        subscriptions = self._subscriptions.get(type(event))
+        if not subscriptions:
+            return
+        if not self._on_loop():
+            self._get_loop().call_soon_threadsafe(self.publish, event)
+            return
+        for subscription in subscriptions:
+            subscription.offer(event)
+
+    def metrics(self) -> Dict[str, dict]:
+        subscriptions = {
+            sub.name: sub for subs in self._subscriptions.values() for sub in subs
+        }
+        return {name: sub.metrics for name, sub in subscriptions.items()}
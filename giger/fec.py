@@ -0,0 +1,262 @@
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+from _types import (
+    CommandStatus,
+    GeneralFEData,
+    GeneralSettings,
+    ManufacturerInfo,
+    ProductInfo,
+    TrainerData,
+    TrainerTorqueData,
+)
+
+# FE-C over BLE wraps each ANT broadcast message as
+# [sync, length, message id, channel, 8 byte payload, checksum]
+ANT_SYNC = 0xA4
+ANT_BROADCAST_DATA = 0x4E
+ANT_ACKNOWLEDGED_DATA = 0x4F
+ANT_CHANNEL = 0x05
+ANT_MESSAGE_LENGTH = 13
+PAYLOAD_OFFSET = 4
+FIELDS_OFFSET = PAYLOAD_OFFSET + 1
+
+GENERAL_FE_DATA_PAGE = 16
+GENERAL_SETTINGS_PAGE = 17
+SPECIFIC_TRAINER_DATA_PAGE = 25
+TRAINER_TORQUE_DATA_PAGE = 26
+COMMAND_STATUS_PAGE = 71
+MANUFACTURER_INFO_PAGE = 80
+PRODUCT_INFO_PAGE = 81
+# Control pages, written to the trainer
+TARGET_POWER_PAGE = 49
+USER_CONFIGURATION_PAGE = 55
+DATA_PAGE_REQUEST_PAGE = 70
+
+# Units of the raw fields
+ELAPSED_TIME_UNIT = 0.25  # s, rolls over at 64 s
+SPEED_UNIT = 0.001  # m/s
+DISTANCE_ROLLOVER = 256  # m
+ELAPSED_TIME_ROLLOVER = 256
+TARGET_POWER_UNIT = 0.25  # W
+USER_WEIGHT_UNIT = 0.01  # kg
+BICYCLE_WEIGHT_UNIT = 0.05  # kg
+WHEEL_DIAMETER_UNIT = 0.01  # m
+GEAR_RATIO_UNIT = 0.03
+
+# Command status values, from page 71
+COMMAND_PASS = 0
+COMMAND_FAIL = 1
+COMMAND_NOT_SUPPORTED = 2
+COMMAND_REJECTED = 3
+COMMAND_PENDING = 4
+
+_GENERAL_FE = struct.Struct("<BBBHBB")
+_GENERAL_SETTINGS = struct.Struct("<xxBhBB")
+_TRAINER = struct.Struct("<BBHHB")
+_TORQUE = struct.Struct("<BBHHB")
+_COMMAND_STATUS = struct.Struct("<BBBI")
+_MANUFACTURER = struct.Struct("<xxBHH")
+_PRODUCT = struct.Struct("<xBBI")
+_TARGET_POWER = struct.Struct("<B5BH")
+_USER_CONFIGURATION = struct.Struct("<BHBHBB")
+_DATA_PAGE_REQUEST = struct.Struct("<B4BBBB")
+_RESERVED = 0xFF
+
+
+def _general_fe(data, timestamp):
+    equipment, elapsed, distance, speed, hr, state = _GENERAL_FE.unpack_from(
+        data, FIELDS_OFFSET
+    )
+    return GeneralFEData(
+        timestamp, equipment, elapsed, distance, speed, hr, state & 0x0F, state >> 4
+    )
+
+
+def _general_settings(data, timestamp):
+    cycle_length, incline, resistance, state = _GENERAL_SETTINGS.unpack_from(
+        data, FIELDS_OFFSET
+    )
+    return GeneralSettings(
+        timestamp, cycle_length, incline, resistance, state & 0x0F, state >> 4
+    )
+
+
+def _trainer(data, timestamp):
+    events, cadence, accumulated, power_status, state = _TRAINER.unpack_from(
+        data, FIELDS_OFFSET
+    )
+    return TrainerData(
+        timestamp,
+        events,
+        cadence,
+        accumulated,
+        power_status & 0x0FFF,
+        power_status >> 12,
+        state & 0x0F,
+        state >> 4,
+    )
+
+
+def _torque(data, timestamp):
+    events, ticks, period, torque, state = _TORQUE.unpack_from(data, FIELDS_OFFSET)
+    return TrainerTorqueData(
+        timestamp, events, ticks, period, torque, state & 0x0F, state >> 4
+    )
+
+
+def _command_status(data, timestamp):
+    return CommandStatus(timestamp, *_COMMAND_STATUS.unpack_from(data, FIELDS_OFFSET))
+
+
+def _manufacturer(data, timestamp):
+    return ManufacturerInfo(timestamp, *_MANUFACTURER.unpack_from(data, FIELDS_OFFSET))
+
+
+def _product(data, timestamp):
+    return ProductInfo(timestamp, *_PRODUCT.unpack_from(data, FIELDS_OFFSET))
+
+
+PAGE_DECODERS: Dict[int, Callable] = {
+    GENERAL_FE_DATA_PAGE: _general_fe,
+    GENERAL_SETTINGS_PAGE: _general_settings,
+    SPECIFIC_TRAINER_DATA_PAGE: _trainer,
+    TRAINER_TORQUE_DATA_PAGE: _torque,
+    COMMAND_STATUS_PAGE: _command_status,
+    MANUFACTURER_INFO_PAGE: _manufacturer,
+    PRODUCT_INFO_PAGE: _product,
+}
+
+
+def build_fec_message(payload: bytes, message_id: int = ANT_BROADCAST_DATA) -> bytes:
+    """Wrap an 8 byte page in an ANT message, as sent over the FE-C characteristics."""
+    message = bytes((ANT_SYNC, len(payload) + 1, message_id, ANT_CHANNEL)) + payload
+    checksum = 0
+    for byte in message:
+        checksum ^= byte
+    return message + bytes((checksum,))
+
+
+def quantize_target_power(watts) -> float:
+    """`watts` as page 49 carries it, truncated to TARGET_POWER_UNIT."""
+    return int(watts / TARGET_POWER_UNIT) * TARGET_POWER_UNIT
+
+
+def target_power_page(watts) -> bytes:
+    return _TARGET_POWER.pack(
+        TARGET_POWER_PAGE, *(_RESERVED,) * 5, int(watts / TARGET_POWER_UNIT)
+    )
+
+
+def user_configuration_page(
+    user_weight, bicycle_weight, bicycle_wheel_diameter, gear_ratio
+) -> bytes:
+    # Bicycle weight is 12 bits, above a 4 bit wheel diameter offset we leave at 0
+    return _USER_CONFIGURATION.pack(
+        USER_CONFIGURATION_PAGE,
+        int(user_weight / USER_WEIGHT_UNIT),
+        _RESERVED,
+        int(bicycle_weight / BICYCLE_WEIGHT_UNIT) << 4,
+        int(bicycle_wheel_diameter / WHEEL_DIAMETER_UNIT),
+        int(gear_ratio / GEAR_RATIO_UNIT),
+    )
+
+
+def data_page_request(page: int, transmissions: int = 1) -> bytes:
+    """Ask the trainer to send `page` back on the read characteristic."""
+    # The last byte is the command type, 1 for a data page request
+    return _DATA_PAGE_REQUEST.pack(
+        DATA_PAGE_REQUEST_PAGE, *(_RESERVED,) * 4, transmissions, page, 1
+    )
+
+
+def commanded_target_power(status: CommandStatus) -> Optional[float]:
+    """The target power in W a page 71 reports, if its last command set one."""
+    if status.last_command != TARGET_POWER_PAGE:
+        return None
+    # Page 49's data bytes are echoed, the target being the top two
+    return (status.data >> 16) * TARGET_POWER_UNIT
+
+
+def decode_fec_message(data, timestamp: float):
+    """Decode one FE-C notification into its page record, or None if unsupported."""
+    if (
+        len(data) < ANT_MESSAGE_LENGTH
+        or data[0] != ANT_SYNC
+        or data[2] != ANT_BROADCAST_DATA
+    ):
+        return None
+    decoder = PAGE_DECODERS.get(data[PAYLOAD_OFFSET])
+    if decoder is None:
+        return None
+    return decoder(data, timestamp)
+
+
+class FecTelemetry:
+    """
+    Decodes FE-C notifications and keeps the most recent `capacity` records
+    of each page in preallocated rings.
+
+    Decoding is a dict lookup and one precompiled struct unpack per page, so
+    its cost doesn't depend on how often pages arrive or how long the ride
+    has been.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._rings: Dict[int, List] = {
+            page: [None] * capacity for page in PAGE_DECODERS
+        }
+        self._counts: Dict[int, int] = dict.fromkeys(PAGE_DECODERS, 0)
+        self.unknown_pages: int = 0
+        # Rollover-corrected totals from the general FE data page
+        self.elapsed_time: float = 0.0
+        self.distance: int = 0
+        self._last_general: Optional[GeneralFEData] = None
+
+    def decode(self, data, timestamp: float):
+        record = decode_fec_message(data, timestamp)
+        if record is None:
+            self.unknown_pages += 1
+            return None
+        page = data[PAYLOAD_OFFSET]
+        count = self._counts[page]
+        self._rings[page][count % self.capacity] = record
+        self._counts[page] = count + 1
+        if page == GENERAL_FE_DATA_PAGE:
+            self._accumulate(record)
+        return record
+
+    def _accumulate(self, record: GeneralFEData):
+        last = self._last_general
+        if last is not None:
+            elapsed = (record.elapsed_time - last.elapsed_time) % ELAPSED_TIME_ROLLOVER
+            self.elapsed_time += elapsed * ELAPSED_TIME_UNIT
+            self.distance += (record.distance - last.distance) % DISTANCE_ROLLOVER
+        self._last_general = record
+
+    def latest(self, page: int):
+        count = self._counts.get(page, 0)
+        if not count:
+            return None
+        return self._rings[page][(count - 1) % self.capacity]
+
+    def read_since(self, page: int, index: int) -> Tuple[int, List]:
+        """Return the count of `page` records and those decoded after `index`."""
+        count = self._counts.get(page, 0)
+        start = max(index, count - self.capacity)
+        ring = self._rings[page]
+        return count, [ring[i % self.capacity] for i in range(start, count)]
+
+    def history(self, page: int) -> List:
+        """Records of `page` still held, oldest first."""
+        count = self._counts.get(page, 0)
+        ring = self._rings[page]
+        if count <= self.capacity:
+            return ring[:count]
+        start = count % self.capacity
+        return ring[start:] + ring[:start]
+
+    @property
+    def page_counts(self) -> Dict[int, int]:
+        return dict(self._counts)
@@ -0,0 +1,267 @@
+import asyncio
+from collections import Counter
+from time import perf_counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from _types import CommandStatus
+from bleak.exc import BleakError
+from diagnostics import Histogram
+from fec import (
+    ANT_ACKNOWLEDGED_DATA,
+    COMMAND_FAIL,
+    COMMAND_NOT_SUPPORTED,
+    COMMAND_REJECTED,
+    COMMAND_STATUS_PAGE,
+    DATA_PAGE_REQUEST_PAGE,
+    TARGET_POWER_PAGE,
+    USER_CONFIGURATION_PAGE,
+    build_fec_message,
+    commanded_target_power,
+    data_page_request,
+    quantize_target_power,
+    target_power_page,
+    user_configuration_page,
+)
+from loguru import logger
+
+DEFAULT_MAX_IN_FLIGHT = 2
+# Trainers answer a data page request in their next message slot, ~4 Hz
+READBACK_TIMEOUT_S = 1.0
+# A target is only read back once it has held this long. A ramp sets a new
+# one every step, and a request for each would have the trainer answer with
+# page 71 in every slot, leaving none for the data pages
+READBACK_SETTLE_S = 1.0
+MAX_TARGET_RETRIES = 3
+
+# Lower goes first: control, then readback requests, then configuration
+_PAGE_PRIORITY = {
+    TARGET_POWER_PAGE: 0,
+    DATA_PAGE_REQUEST_PAGE: 1,
+    USER_CONFIGURATION_PAGE: 2,
+}
+
+
+class WriteStats:
+    """
+    Timings of FE-C writes, kept across trainer swaps.
+
+    `write_rtt` runs from handing a write to the BLE stack until it
+    completes, `applied` from sending a target power until the trainer's
+    command status confirms it, and `in_flight` counts the writes
+    outstanding as each one is sent.
+    """
+
+    def __init__(self):
+        self.write_rtt = Histogram()
+        self.applied = Histogram()
+        self.in_flight = Counter()
+        self.counts = Counter()
+
+    @property
+    def summary(self) -> dict:
+        return {
+            "write_rtt": self.write_rtt.summary,
+            "applied": self.applied.summary,
+            "in_flight": dict(self.in_flight),
+            **self.counts,
+        }
+
+
+class FecTransport:
+    """
+    Writes FE-C control pages to a trainer, in place of `TacxTrainerControl`.
+
+    Writes are queued per page and sent by one task, up to `max_in_flight`
+    at a time, target power ahead of readback requests ahead of user
+    configuration. A queued write that hasn't gone out yet is replaced by a
+    newer one of the same page, so a burst of targets only sends the last.
+    Writes go without response when the characteristic allows it, unless
+    `response` says otherwise.
+
+    Each target power that holds for READBACK_SETTLE_S is checked by
+    requesting page 71 (command status) and comparing what the trainer
+    applied; one that didn't take is sent again,
+    up to MAX_TARGET_RETRIES times. This is what makes writes without
+    response safe to use. The owner passes page 71 records to
+    `on_command_status`.
+    """
+
+    def __init__(
+        self,
+        client,
+        write_uuid: str,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        response: Optional[bool] = None,
+        verify: bool = True,
+        stats: Optional[WriteStats] = None,
+    ):
+        self._client = client
+        self._write_uuid = write_uuid
+        self.max_in_flight = max_in_flight
+        self._response = response
+        self.verify = verify
+        self.stats = stats or WriteStats()
+        # Page -> latest payload and everyone waiting for it to be written
+        self._queued: Dict[int, Tuple[bytes, List[asyncio.Future]]] = {}
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._sender: Optional[asyncio.Task] = None
+        self._sends: Set[asyncio.Task] = set()
+        self._in_flight = 0
+        self.target_power: Optional[int] = None
+        self.applied_power: Optional[float] = None
+        self._target_sent: Optional[float] = None
+        # Loop time the target last changed or was resent
+        self._target_time = 0.0
+        self._readback: Optional[asyncio.Future] = None
+        self._verifier: Optional[asyncio.Task] = None
+        self._retries = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def response(self) -> bool:
+        if self._response is None:
+            try:
+                properties = self._client.services.get_characteristic(
+                    self._write_uuid
+                ).properties
+                self._response = "write-without-response" not in properties
+            except (AttributeError, BleakError):
+                # Services not discovered yet, or not a BleakClient
+                return True
+        return self._response
+
+    async def set_target_power(self, power):
+        self.target_power = power
+        self._target_time = asyncio.get_running_loop().time()
+        self._retries = 0
+        await self._write(TARGET_POWER_PAGE, target_power_page(power))
+        if self.verify and (self._verifier is None or self._verifier.done()):
+            self._verifier = asyncio.get_running_loop().create_task(self._verify())
+
+    async def set_user_configuration(
+        self, user_weight, bicycle_weight, bicycle_wheel_diameter, gear_ratio
+    ):
+        await self._write(
+            USER_CONFIGURATION_PAGE,
+            user_configuration_page(
+                user_weight, bicycle_weight, bicycle_wheel_diameter, gear_ratio
+            ),
+        )
+
+    def on_command_status(self, status: CommandStatus):
+        applied = commanded_target_power(status)
+        if applied is None:
+            return
+        self.applied_power = applied
+        if self._readback is not None and not self._readback.done():
+            self._readback.set_result(status)
+
+    async def _write(self, page: int, payload: bytes):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queued = self._queued.get(page)
+        if queued is None:
+            self._queued[page] = (payload, [future])
+        else:
+            # Everyone waiting on the older payload is served by this one
+            self._queued[page] = (payload, queued[1] + [future])
+            self.stats.counts["coalesced"] += 1
+        if self._sender is None or self._sender.done():
+            self._sender = loop.create_task(self._send_queued())
+        await future
+
+    async def _send_queued(self):
+        loop = asyncio.get_running_loop()
+        while self._queued:
+            await self._slots.acquire()
+            # Chosen only once a slot is free, so a late control write goes first
+            page = min(self._queued, key=_PAGE_PRIORITY.__getitem__)
+            payload, waiters = self._queued.pop(page)
+            self._in_flight += 1
+            self.stats.in_flight[self._in_flight] += 1
+            send = loop.create_task(self._send(page, payload, waiters))
+            self._sends.add(send)
+            send.add_done_callback(self._sends.discard)
+
+    async def _send(self, page, payload, waiters):
+        started = perf_counter()
+        if page == TARGET_POWER_PAGE:
+            self._target_sent = started
+        try:
+            await self._client.write_gatt_char(
+                self._write_uuid,
+                build_fec_message(payload, ANT_ACKNOWLEDGED_DATA),
+                response=self.response,
+            )
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            self.stats.write_rtt.record(perf_counter() - started)
+            self.stats.counts["writes"] += 1
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    async def _verify(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # One task, so there's never more than one request outstanding
+            settle = self._target_time + READBACK_SETTLE_S - loop.time()
+            if settle > 0:
+                await asyncio.sleep(settle)
+                continue
+            target = self.target_power
+            self._readback = loop.create_future()
+            try:
+                await self._write(
+                    DATA_PAGE_REQUEST_PAGE, data_page_request(COMMAND_STATUS_PAGE)
+                )
+                status = await asyncio.wait_for(self._readback, READBACK_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                status = None
+            except Exception as e:
+                logger.warning(f"Couldn't read back the trainer's target power: {e}")
+                return
+            finally:
+                self._readback = None
+            if self.target_power != target:
+                # A newer target went out while we waited; check that one
+                continue
+            if status is not None and status.status in (
+                COMMAND_NOT_SUPPORTED,
+                COMMAND_REJECTED,
+            ):
+                logger.warning(f"Trainer rejected a target of {target} W")
+                self.stats.counts["rejected"] += 1
+                return
+            if (
+                status is not None
+                and status.status != COMMAND_FAIL
+                and commanded_target_power(status) == quantize_target_power(target)
+            ):
+                self.stats.applied.record(perf_counter() - self._target_sent)
+                self.stats.counts["verified"] += 1
+                return
+            if status is None:
+                self.stats.counts["unconfirmed"] += 1
+            else:
+                self.stats.counts["mismatches"] += 1
+            if self._retries == MAX_TARGET_RETRIES:
+                logger.warning(f"Trainer didn't confirm a target of {target} W")
+                return
+            self._retries += 1
+            self.stats.counts["retries"] += 1
+            self._target_time = loop.time()
+            try:
+                await self._write(TARGET_POWER_PAGE, target_power_page(target))
+            except Exception as e:
+                logger.warning(f"Resending a target of {target} W failed: {e}")
+                return
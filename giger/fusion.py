@@ -0,0 +1,228 @@
+"""
+Aligns samples from every sensor onto one timebase.
+
+Each notification is stamped with time() when it arrives, which is late by
+however long the sensor took to measure it and the BLE link took to deliver
+it, by a different amount for each sensor and from one notification to the
+next. Streams with a clock of their own (RR intervals, crank event times)
+are mapped onto the host clock through the smallest offset seen recently,
+which takes out the link's jitter; each stream's known measurement latency
+is taken off too. The corrected streams are then interpolated onto a fixed
+rate grid a little behind real time, so every stream has data either side
+of each grid point.
+"""
+import math
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+from _types import FusedSample
+from devices import CRANK_EVENT_TIME_WRAP
+
+# How far behind real time the grid runs, to let late streams catch up
+FUSION_DELAY_S = 1.5
+# Window the smallest clock offset is taken over; long enough to catch a
+# quick delivery, short enough to follow the sensor's clock drifting
+CLOCK_WINDOW_S = 30.0
+# An offset this far over the window's minimum means the sensor's clock
+# jumped (dropped notifications, a wrap missed in a gap), so start again
+CLOCK_RESYNC_S = 2.0
+# Past this without a sample a stream reads as NaN instead of interpolated
+MAX_GAP_S = 5.0
+STREAM_CAPACITY = 1024
+
+# Measurement latency per stream: HRMs average over the last few beats,
+# trainers and power meters over about a crank revolution
+HR_LATENCY_S = 1.0
+TRAINER_LATENCY_S = 0.5
+POWER_METER_LATENCY_S = 0.5
+
+
+class SensorStream:
+    """
+    One sensor's samples with their timestamps corrected to the host clock.
+
+    Samples are stamped `device_time + offset - latency` when the sensor
+    gives its own time, where `offset` is the smallest `arrival -
+    device_time` in the last CLOCK_WINDOW_S, and `arrival - latency`
+    otherwise. `wrap` is the period a device clock counts up to before
+    starting again from zero.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        wrap: Optional[float] = None,
+        max_gap: float = MAX_GAP_S,
+        capacity: int = STREAM_CAPACITY,
+    ):
+        self.latency = latency
+        self.wrap = wrap
+        self.max_gap = max_gap
+        self._times = np.empty(capacity)
+        self._values = np.empty(capacity)
+        self._count = 0
+        # (arrival, arrival - device time), offsets increasing from the front
+        self._offsets: deque = deque()
+        self._last_raw: Optional[float] = None
+        self._device_time = 0.0
+        self.resyncs = 0
+
+    @property
+    def offset(self) -> Optional[float]:
+        return self._offsets[0][1] if self._offsets else None
+
+    def _unwrap(self, raw: float) -> float:
+        if self._last_raw is not None:
+            delta = raw - self._last_raw
+            if self.wrap is not None:
+                delta %= self.wrap
+            self._device_time += delta
+        self._last_raw = raw
+        return self._device_time
+
+    def _correct(self, arrival: float, device_time: float) -> float:
+        offsets = self._offsets
+        offset = arrival - device_time
+        if offsets and offset - offsets[0][1] > CLOCK_RESYNC_S:
+            offsets.clear()
+            self.resyncs += 1
+        while offsets and offsets[-1][1] >= offset:
+            offsets.pop()
+        offsets.append((arrival, offset))
+        while offsets[0][0] < arrival - CLOCK_WINDOW_S:
+            offsets.popleft()
+        return device_time + offsets[0][1]
+
+    def add(self, arrival: float, value: float, device_time: Optional[float] = None):
+        if device_time is None:
+            timestamp = arrival
+        else:
+            timestamp = self._correct(arrival, self._unwrap(device_time))
+        timestamp -= self.latency
+        n = self._count
+        if n and timestamp <= self._times[n - 1]:
+            # The offset moved back under us; keep the stream in order
+            timestamp = self._times[n - 1] + 1e-6
+        if n == len(self._times):
+            # Drop the older half in one go rather than shifting every add
+            half = n // 2
+            self._times[: n - half] = self._times[half:n]
+            self._values[: n - half] = self._values[half:n]
+            n -= half
+        self._times[n] = timestamp
+        self._values[n] = value
+        self._count = n + 1
+
+    @property
+    def latest_time(self) -> Optional[float]:
+        return self._times[self._count - 1] if self._count else None
+
+    def values_at(self, times: np.ndarray) -> np.ndarray:
+        """
+        Linearly interpolated values at `times`, NaN across gaps longer than
+        `max_gap`, before the first sample, or more than `max_gap` after the
+        last. Just after the last sample it is held.
+        """
+        n = self._count
+        if not n:
+            return np.full(len(times), np.nan)
+        stamps = self._times[:n]
+        values = self._values[:n]
+        result = np.interp(times, stamps, values, left=np.nan)
+        if n > 1:
+            index = np.clip(np.searchsorted(stamps, times), 1, n - 1)
+            gaps = stamps[index] - stamps[index - 1] > self.max_gap
+            result[gaps & (times < stamps[-1])] = np.nan
+        result[times - stamps[-1] > self.max_gap] = np.nan
+        return result
+
+
+class SensorFusion:
+    """
+    Emits `FusedSample`s on a fixed `rate_hz` grid `delay` seconds behind
+    the time passed to `advance`.
+
+    `power` and `cadence` come from the power meter when it has a reading,
+    and the trainer otherwise.
+    """
+
+    def __init__(self, rate_hz: float, delay: float = FUSION_DELAY_S):
+        self.rate_hz = rate_hz
+        self.delay = delay
+        self.streams: Dict[str, SensorStream] = {
+            "hr": SensorStream(HR_LATENCY_S),
+            "filtered_hr": SensorStream(HR_LATENCY_S),
+            "trainer_power": SensorStream(TRAINER_LATENCY_S),
+            "trainer_cadence": SensorStream(TRAINER_LATENCY_S),
+            "meter_power": SensorStream(POWER_METER_LATENCY_S, CRANK_EVENT_TIME_WRAP),
+            "meter_cadence": SensorStream(POWER_METER_LATENCY_S, CRANK_EVENT_TIME_WRAP),
+        }
+        self._next: Optional[float] = None
+        self.latest: Optional[FusedSample] = None
+
+    def add(
+        self,
+        stream: str,
+        arrival: float,
+        value: float,
+        device_time: Optional[float] = None,
+    ):
+        self.streams[stream].add(arrival, value, device_time)
+
+    def set_latency(self, stream: str, latency: float):
+        self.streams[stream].latency = latency
+
+    def resample(self, times: np.ndarray) -> Dict[str, np.ndarray]:
+        values = {
+            name: stream.values_at(times) for name, stream in self.streams.items()
+        }
+        meter_power = values["meter_power"]
+        values["power"] = np.where(
+            np.isnan(meter_power), values["trainer_power"], meter_power
+        )
+        meter_cadence = values["meter_cadence"]
+        values["cadence"] = np.where(
+            np.isnan(meter_cadence), values["trainer_cadence"], meter_cadence
+        )
+        return values
+
+    def advance(self, now: float) -> List[FusedSample]:
+        """Every grid point up to `now - delay` not already emitted, in order."""
+        period = 1 / self.rate_hz
+        until = now - self.delay
+        if self._next is None:
+            # Start on a whole period, so grids from different runs line up
+            self._next = math.ceil(until / period) * period
+        if until < self._next:
+            return []
+        count = int((until - self._next) // period) + 1
+        times = self._next + period * np.arange(count)
+        self._next = times[-1] + period
+        values = self.resample(times)
+        samples = [
+            FusedSample(*row)
+            for row in zip(
+                times.tolist(),
+                values["hr"].tolist(),
+                values["filtered_hr"].tolist(),
+                values["power"].tolist(),
+                values["cadence"].tolist(),
+                values["trainer_power"].tolist(),
+                values["meter_power"].tolist(),
+            )
+        ]
+        self.latest = samples[-1]
+        return samples
+
+    @property
+    def summary(self) -> dict:
+        return {
+            name: {
+                "offset": stream.offset,
+                "latency": stream.latency,
+                "resyncs": stream.resyncs,
+            }
+            for name, stream in self.streams.items()
+            if stream.latest_time is not None
+        }
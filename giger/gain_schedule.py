@@ -0,0 +1,316 @@
+"""
+HR gain scheduling: PID gains looked up by setpoint and current HR.
+
+The rider's HR response isn't the same at 120 bpm as at 175 bpm, so one
+set of gains is either sluggish low down or oscillates near threshold.
+Local first-order-plus-dead-time models are fitted across a grid of HR,
+from recorded rides or from the simulated rider, and tuned into a table
+that is kept in settings per rider.
+
+    python gain_schedule.py rides/*.giger
+    python gain_schedule.py --simulate [--max-hr 190]
+"""
+import argparse
+import math
+import random
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from adaptive import DEFAULT_MODEL, GAIN_LIMITS, TIME_CONSTANT_LIMITS
+from analytics import open_session
+from loguru import logger
+from settings import settings
+from sim import RiderPhysiology
+from sysid import (
+    FIT_RATE_HZ,
+    RiderModel,
+    fit_rider_model,
+    pid_gains,
+    resample_for_fit,
+)
+
+# One grid serves both axes: setpoint and current HR
+HR_GRID_START = 90
+HR_GRID_STEP = 5
+HR_GRID_POINTS = 21  # up to 190 bpm
+
+SIMULATED_HOURS = 4
+SIMULATED_STEP_S = (180, 420)
+# Simulated steps stay this far inside the HR grid and the rider's max HR
+SIMULATED_HR_MARGIN = 5
+
+
+class GainSchedule:
+    """
+    Kp, Ki and Kd tables over a regular grid of setpoint and current HR.
+
+    `gains` interpolates bilinearly and clamps at the edges of the grid;
+    the grid is regular, so a lookup is a couple of divisions and a dozen
+    multiplies however big the table.
+    """
+
+    def __init__(self, start: float, step: float, kp, ki, kd, source: str = ""):
+        self.start = start
+        self.step = step
+        self.points = len(kp)
+        self._tables = (kp, ki, kd)
+        self.source = source
+
+    def _position(self, value: float) -> Tuple[int, float]:
+        position = (value - self.start) / self.step
+        position = min(max(position, 0.0), self.points - 1.0)
+        index = min(int(position), self.points - 2)
+        return index, position - index
+
+    def gains(self, setpoint: float, hr: float) -> Tuple[float, float, float]:
+        i, fi = self._position(setpoint)
+        j, fj = self._position(hr)
+        result = []
+        for table in self._tables:
+            row, next_row = table[i], table[i + 1]
+            low = row[j] + (row[j + 1] - row[j]) * fj
+            high = next_row[j] + (next_row[j + 1] - next_row[j]) * fj
+            result.append(low + (high - low) * fi)
+        return tuple(result)
+
+    def to_dict(self) -> dict:
+        kp, ki, kd = self._tables
+        return {
+            "start": self.start,
+            "step": self.step,
+            "kp": kp,
+            "ki": ki,
+            "kd": kd,
+            "source": self.source,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GainSchedule":
+        return cls(
+            data["start"], data["step"], data["kp"], data["ki"], data["kd"], data["source"]
+        )
+
+
+def hr_grid(
+    start: float = HR_GRID_START, step: float = HR_GRID_STEP, points: int = HR_GRID_POINTS
+) -> np.ndarray:
+    return start + step * np.arange(points)
+
+
+def _clean(hr, power) -> Tuple[np.ndarray, np.ndarray]:
+    valid = ~(np.isnan(hr) | np.isnan(power))
+    return (
+        np.asarray(hr[valid], dtype=np.float64),
+        np.asarray(power[valid], dtype=np.float64),
+    )
+
+
+def fit_local_models(
+    series: Iterable[Tuple[np.ndarray, np.ndarray, float]], grid: Sequence[float]
+) -> List[Optional[RiderModel]]:
+    """
+    A local model at each grid HR, or None where the rides never got there.
+
+    HR heads for a steady state that flattens out as the rider works
+    harder, so the rides are fitted with a quadratic in power in place of
+    `sysid`'s linear term, by instrumental variables with the global fit's
+    noise-free simulated HR as the instrument. Each local model's gain is
+    the slope of that steady state at its HR; the time constant and dead
+    time are shared. `series` holds (hr, power, rate_hz) per ride; rides
+    are resampled to `sysid`'s FIT_RATE_HZ, and the normal equations are
+    summed over the rides that fit so none are stitched together.
+    """
+    rate_hz = FIT_RATE_HZ
+    dt = 1 / rate_hz
+    fitted = []
+    global_models = []
+    for hr, power, ride_rate_hz in series:
+        hr, power = _clean(*resample_for_fit(hr, power, ride_rate_hz))
+        try:
+            global_models.append(fit_rider_model(hr, power, rate_hz))
+        except ValueError as e:
+            logger.info(f"Skipping a ride for the schedule: {e}")
+            continue
+        fitted.append((hr, power))
+    if not global_models:
+        raise ValueError("No ride could be fitted")
+    model = RiderModel(*np.median(np.array(global_models), axis=0).tolist())
+
+    normal = np.zeros((4, 4))
+    rhs = np.zeros(4)
+    low_power, high_power = math.inf, -math.inf
+    delay = int(round(model.dead_time * rate_hz))
+    for hr, power in fitted:
+        if len(hr) <= delay + 1:
+            continue
+        a = math.exp(-dt / model.time_constant)
+        driven = model.gain * (1 - a) * power + model.offset * (1 - a)
+        simulated = np.empty_like(hr)
+        simulated[: delay + 1] = hr[: delay + 1]
+        for k in range(delay + 1, len(hr)):
+            simulated[k] = a * simulated[k - 1] + driven[k - 1 - delay]
+        start = delay + 1
+        y = hr[start:]
+        # In hundreds of watts, to keep the squares from swamping the fit
+        inputs = power[: len(power) - start] / 100
+        inputs_sq = inputs**2
+        ones = np.ones(len(y))
+        design = np.column_stack((hr[start - 1 : -1], inputs, inputs_sq, ones))
+        instruments = np.column_stack((simulated[start - 1 : -1], inputs, inputs_sq, ones))
+        normal += instruments.T @ design
+        rhs += instruments.T @ y
+        low_power = min(low_power, float(inputs.min()))
+        high_power = max(high_power, float(inputs.max()))
+
+    try:
+        a, b1, b2, c = np.linalg.solve(normal, rhs)
+    except np.linalg.LinAlgError:
+        raise ValueError("Rides don't vary power enough to fit")
+    if not 0 < a < 1:
+        raise ValueError(f"Fitted HR response isn't stable: a={a:.3f}")
+    time_constant = -dt / math.log(a)
+
+    models: List[Optional[RiderModel]] = []
+    for g in grid:
+        # Power (in hundreds of watts) whose steady state is g, on the rising side
+        target = c - (1 - a) * g
+        if abs(b2) < 1e-9:
+            roots = [-target / b1] if b1 else []
+        else:
+            discriminant = b1**2 - 4 * b2 * target
+            if discriminant < 0:
+                roots = []
+            else:
+                root = math.sqrt(discriminant)
+                roots = [(-b1 - root) / (2 * b2), (-b1 + root) / (2 * b2)]
+        local = None
+        for u in sorted(roots):
+            slope = b1 + 2 * b2 * u
+            if low_power <= u <= high_power and slope > 0:
+                gain = slope / 100 / (1 - a)
+                if (
+                    GAIN_LIMITS[0] <= gain <= GAIN_LIMITS[1]
+                    and TIME_CONSTANT_LIMITS[0] <= time_constant <= TIME_CONSTANT_LIMITS[1]
+                ):
+                    local = RiderModel(
+                        gain, time_constant, model.dead_time, g - gain * 100 * u, 0.0
+                    )
+                break
+        models.append(local)
+    return models
+
+
+def build_schedule(
+    models: Sequence[Optional[RiderModel]],
+    start: float = HR_GRID_START,
+    step: float = HR_GRID_STEP,
+    source: str = "",
+) -> GainSchedule:
+    """
+    Tune a table from local models on the HR grid.
+
+    Heading from HR h to setpoint s, the rider passes through every band
+    in between, so the entry for (s, h) is tuned for the models averaged
+    over that stretch of the grid. Bands without a model borrow the
+    nearest one that has.
+    """
+    known = [g for g, model in enumerate(models) if model is not None]
+    if not known:
+        raise ValueError("No HR band has a usable model")
+    filled = [models[min(known, key=lambda k: abs(k - g))] for g in range(len(models))]
+    points = len(filled)
+    kp = [[0.0] * points for _ in range(points)]
+    ki = [[0.0] * points for _ in range(points)]
+    kd = [[0.0] * points for _ in range(points)]
+    for i in range(points):
+        for j in range(points):
+            path = filled[min(i, j) : max(i, j) + 1]
+            model = RiderModel(
+                sum(m.gain for m in path) / len(path),
+                sum(m.time_constant for m in path) / len(path),
+                sum(m.dead_time for m in path) / len(path),
+                0.0,
+                0.0,
+            )
+            kp[i][j], ki[i][j], kd[i][j] = (float(k) for k in pid_gains(model))
+    return GainSchedule(start, step, kp, ki, kd, source)
+
+
+def schedule_from_sessions(paths: Iterable[str]) -> GainSchedule:
+    series = []
+    for path in paths:
+        metadata, rows = open_session(path)
+        series.append((rows["hr"], rows["power"], metadata.get("rate_hz", 1)))
+    models = fit_local_models(series, hr_grid())
+    return build_schedule(models, source="rides")
+
+
+def simulate_ride(
+    model: RiderModel = DEFAULT_MODEL,
+    max_hr: Optional[float] = None,
+    hours: float = SIMULATED_HOURS,
+    seed: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    HR and power at 1 Hz for random power steps, without waiting for them.
+
+    Each step is to the power that would settle at a random HR on the grid,
+    so every band gets ridden.
+    """
+    rng = random.Random(seed)
+    physiology = RiderPhysiology(model, max_hr=max_hr, rng=rng)
+    grid = hr_grid()
+    low = max(grid[0], model.offset) + SIMULATED_HR_MARGIN
+    high = grid[-1] if max_hr is None else min(grid[-1], max_hr - SIMULATED_HR_MARGIN)
+    samples = int(hours * 3600)
+    hr = np.empty(samples)
+    power = np.empty(samples)
+    watts = 0.0
+    next_step = 0
+    for k in range(samples):
+        if k >= next_step:
+            rise = rng.uniform(low, high) - model.offset
+            if max_hr is not None:
+                headroom = max_hr - model.offset
+                rise = -headroom * math.log(1 - rise / headroom)
+            watts = rise / model.gain
+            next_step = k + rng.uniform(*SIMULATED_STEP_S)
+        physiology.add_power(k, watts)
+        hr[k] = physiology.heart_rate(k)
+        power[k] = watts
+    return hr, power
+
+
+def schedule_from_simulation(
+    model: RiderModel = DEFAULT_MODEL,
+    max_hr: Optional[float] = None,
+    hours: float = SIMULATED_HOURS,
+    seed: Optional[int] = None,
+) -> GainSchedule:
+    hr, power = simulate_ride(model, max_hr, hours, seed)
+    models = fit_local_models([(hr, power, 1)], hr_grid())
+    return build_schedule(models, source="simulator")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sessions", nargs="*", help="session files to build from")
+    parser.add_argument(
+        "--simulate", action="store_true", help="build from the simulated rider instead"
+    )
+    parser.add_argument(
+        "--max-hr", type=float, default=None, help="simulated rider's max HR"
+    )
+    args = parser.parse_args()
+    if args.simulate:
+        model = settings.rider_model
+        schedule = schedule_from_simulation(
+            RiderModel(**model) if model else DEFAULT_MODEL, args.max_hr
+        )
+    else:
+        schedule = schedule_from_sessions(args.sessions)
+    settings.gain_schedule = schedule.to_dict()
+    print(f"{settings.rider_name}: gain schedule from {schedule.source}")
+    for setpoint in range(120, 181, 15):
+        kp, ki, kd = schedule.gains(setpoint, setpoint)
+        print(f"  {setpoint} bpm: Kp={kp:.3f} Ki={ki:.4f} Kd={kd:.3f}")
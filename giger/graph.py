@@ -1,9 +1,58 @@
 from collections import deque
+from time import perf_counter
 from _types import Measurement
-from customtkinter import CTkSlider, CTkLabel, CTkFrame
-from typing import Callable, Tuple
+from customtkinter import CTkCheckBox, CTkSlider, CTkLabel, CTkFrame
+from typing import Callable, Dict, List, Optional, Tuple
 from tkinter import Frame, Canvas
 
+# Share of the UI thread the graph may spend rendering
+GRAPH_CPU_BUDGET = 0.25
+MIN_FRAME_RATE_HZ = 1
+_SMOOTHING = 0.2
+# Recover only with this much of the budget to spare, so the rate doesn't
+# oscillate around the limit
+_HEADROOM = 0.7
+_RECOVERY_FACTOR = 1.1
+_BACKOFF_FACTOR = 0.8
+_STATUS_INTERVAL_S = 0.5
+
+
+class FrameRateGovernor:
+    """
+    Keeps the time spent rendering within a share of the UI thread.
+
+    The rate drops as soon as smoothed render time * rate exceeds `budget`,
+    and climbs back a little each frame while there is headroom, up to
+    `max_rate_hz` (the slider), so a cheap frame keeps scrolling smoothly.
+    """
+
+    def __init__(self, max_rate_hz: float, budget: float = GRAPH_CPU_BUDGET):
+        self.max_rate_hz = max_rate_hz
+        self.budget = budget
+        self.rate_hz = max_rate_hz
+        self.render_s = 0.0
+        self.fps = 0.0
+        self._last_frame: Optional[float] = None
+
+    @property
+    def budget_used(self) -> float:
+        return self.render_s * self.rate_hz / self.budget
+
+    def record(self, started: float, render_s: float) -> float:
+        """Account for one frame; returns the rate to run at next."""
+        if self._last_frame is not None and started > self._last_frame:
+            fps = 1 / (started - self._last_frame)
+            self.fps += (fps - self.fps) * _SMOOTHING if self.fps else fps
+        self._last_frame = started
+        self.render_s += (render_s - self.render_s) * _SMOOTHING
+        affordable = self.budget / self.render_s if self.render_s else self.max_rate_hz
+        if self.render_s * self.rate_hz > self.budget:
+            self.rate_hz = min(self.rate_hz * _BACKOFF_FACTOR, affordable)
+        elif self.render_s * self.rate_hz < self.budget * _HEADROOM:
+            self.rate_hz *= _RECOVERY_FACTOR
+        self.rate_hz = min(max(self.rate_hz, MIN_FRAME_RATE_HZ), self.max_rate_hz)
+        return self.rate_hz
+
 
 class Graph:
 
@@ -17,6 +66,16 @@ class Graph:
     _max_hr = 220
     _max_watts = 500
     _graph_size_ms = 60000
+    # Optional series: colour and the value range mapped onto the plot height
+    _overlay_series = {
+        "error": ("orange", -30, 30),
+        "p": ("green", -500, 500),
+        "i": ("purple", 0, 500),
+        "d": ("brown", -500, 500),
+        "clamp": ("black", -1.5, 1.5),
+        "cadence": ("teal", 0, 150),
+        "target": ("light blue", 0, 500),
+    }
 
     def __init__(
         self,
@@ -25,6 +84,7 @@ class Graph:
         height: int,
         get_data_callback: Callable[[], Tuple[Measurement, Measurement, Measurement]],
         default_pack=True,
+        get_overlay_callback: Optional[Callable[[], Dict[str, List[float]]]] = None,
     ):
         self._master = master
         self.width = width
@@ -34,7 +94,10 @@ class Graph:
         self._hr_scaling_factor = 0
         self._power_scaling_factor = 0
         self.get_data_callback = get_data_callback
+        self.get_overlay_callback = get_overlay_callback or (lambda: {})
         self.update_period_ms = 33
+        self._governor = FrameRateGovernor(30)
+        self._last_status = 0.0
 
         self._master.grid_columnconfigure(0, weight=1)
         self._master.grid_rowconfigure(0, weight=1)
@@ -56,12 +119,31 @@ class Graph:
         )
         self._update_rate_slider.pack(side="left", padx=5, ipadx=5)
         self._update_rate_value_label.pack(side="left", padx=10)
+        self._frame_rate_status_label = CTkLabel(master=self._control_frame, text="")
+        self._frame_rate_status_label.pack(side="left", padx=10)
         self._control_frame.pack(side="bottom", fill="x", expand=False, pady=5)
 
+        self._overlay_frame = CTkFrame(master=self._master)
+        self._overlay_checkboxes = {}
+        for name in self._overlay_series:
+            checkbox = CTkCheckBox(
+                master=self._overlay_frame,
+                text=name,
+                width=20,
+                command=lambda name=name: self._overlay_checkbox_callback(name),
+            )
+            checkbox.pack(side="left", padx=5)
+            self._overlay_checkboxes[name] = checkbox
+        self._overlay_frame.pack(side="bottom", fill="x", expand=False, pady=5)
+
         self._hr_vals = deque(maxlen=width)  # Tuple of (timestamp, value)
         self._power_vals = deque(maxlen=width)
         self._hr_setpoint_vals = deque(maxlen=width)
         self.hr_setpoint: int = 0
+        # Only enabled overlays are drawn. Like the main traces each holds one
+        # pixel column per frame, but a column carries every value recorded
+        # since the frame before, so steps between frames aren't lost
+        self._overlay_vals: Dict[str, deque] = {}
         self._canvas.bind("<Configure>", self._onsize)
 
     def _onsize(self, event):
@@ -70,6 +152,8 @@ class Graph:
             self._hr_vals = deque(self._hr_vals, maxlen=event.width)
             self._power_vals = deque(self._power_vals, maxlen=event.width)
             self._hr_setpoint_vals = deque(self._hr_setpoint_vals, maxlen=event.width)
+            for name, vals in self._overlay_vals.items():
+                self._overlay_vals[name] = deque(vals, maxlen=event.width)
         if event.height:
             self._height = event.height
             available_pixels = self._height - self._y_axis_pad
@@ -78,7 +162,16 @@ class Graph:
 
         self._y_axis_pad = self._x_axis_pad + self._control_frame.winfo_height() + 15
 
+    def _overlay_checkbox_callback(self, name):
+        if self._overlay_checkboxes[name].get():
+            self._overlay_vals[name] = deque(maxlen=self._width)
+        else:
+            self._overlay_vals.pop(name, None)
+
     def _update_rate_slider_callback(self, value):
+        # The slider is now the governor's ceiling
+        self._governor.max_rate_hz = value
+        self._governor.rate_hz = value
         self.update_period_ms = int(1000 / value)
         self._update_rate_value_label.configure(text=f"{value: .0f} hz")
 
@@ -151,6 +244,26 @@ class Graph:
             self._power_vals, self._calculate_power_y_value, self._power_color
         )
 
+    def _draw_overlays(self):
+        available_pixels = self._height - self._y_axis_pad
+        for name, vals in self._overlay_vals.items():
+            if not vals:
+                continue
+            color, low, high = self._overlay_series[name]
+            scale = available_pixels / (high - low)
+            coords = []
+            for idx, (_, values) in enumerate(vals):
+                # Spread the frame's values across its column
+                for step, value in enumerate(values):
+                    value = min(max(value, low), high)
+                    coords += [
+                        idx + step / len(values) + self._x_axis_pad,
+                        self._calculate_y_value(value - low, scale),
+                    ]
+            if len(coords) == 2:
+                coords *= 2
+            self._canvas.create_line(*coords, fill=color)
+
     def _draw_hr_setpoint(self):
         if not self._hr_setpoint_vals:
             return
@@ -159,16 +272,42 @@ class Graph:
         )
 
     def update(self):
+        started = perf_counter()
+        self._sample()
+        self._width = self._master.winfo_width()
+        self._height = self._master.winfo_height()
+        self._render()
+        rate_hz = self._governor.record(started, perf_counter() - started)
+        self.update_period_ms = int(1000 / rate_hz)
+        if started - self._last_status >= _STATUS_INTERVAL_S:
+            self._last_status = started
+            self._frame_rate_status_label.configure(
+                text=f"{self._governor.fps:.0f} fps, "
+                f"{self._governor.budget_used:.0%} of budget"
+            )
+
+    def _sample(self):
         hr_measurement, power_measurement, hr_setpoint = self.get_data_callback()
         self._hr_vals.append(hr_measurement)
         self._power_vals.append(power_measurement)
         self._hr_setpoint_vals.append(hr_setpoint)
-        self._width = self._master.winfo_width()
-        self._height = self._master.winfo_height()
+        # Read even with no overlay enabled, so one enabled later starts now
+        # rather than with everything buffered before it
+        samples = self.get_overlay_callback()
+        for name, vals in self._overlay_vals.items():
+            values = samples.get(name)
+            if values:
+                vals.append(Measurement(hr_setpoint.timestamp, tuple(values)))
+            elif vals:
+                # Nothing new this frame; hold the last level
+                vals.append(Measurement(hr_setpoint.timestamp, vals[-1].value[-1:]))
+
+    def _render(self):
         self._canvas.delete("all")
         self._draw_hr_plot()
         self._draw_power_plot()
         self._draw_hr_setpoint()
+        self._draw_overlays()
         self._draw_axes()
 
     # def _draw_hr_plot(self):
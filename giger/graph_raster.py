@@ -0,0 +1,123 @@
+import numpy as np
+from graph import Graph
+from tkinter import PhotoImage
+
+_BACKGROUND = 255
+
+
+def _column(measurement):
+    """Highest, lowest and last value drawn in a measurement's column."""
+    values = measurement.value
+    if not isinstance(values, tuple):
+        # Main traces have one value a column; overlays every one since the last frame
+        return values, values, values
+    return max(values), min(values), values[-1]
+
+
+class RasterGraph(Graph):
+    """
+    `Graph` drawn into a NumPy RGB buffer and shown as a single PhotoImage.
+
+    The canvas only ever holds the image and the axes. Each frame scrolls
+    the buffer one column left and draws the newest column of every trace,
+    so a frame costs the same however many points are on screen. The whole
+    buffer is redrawn only when the plot is resized.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._buffer = np.empty((0, 0, 3), dtype=np.uint8)
+        self._photo = PhotoImage(master=self._canvas)
+        self._image_item = None
+        self._last_y = {}
+        self._last_drawn = {}
+        self._colors = {}
+
+    def _rgb(self, color):
+        if color not in self._colors:
+            # winfo_rgb gives 16 bit channels
+            self._colors[color] = np.array(
+                [channel >> 8 for channel in self._canvas.winfo_rgb(color)],
+                dtype=np.uint8,
+            )
+        return self._colors[color]
+
+    def _series(self):
+        yield "hr", self._hr_vals, self._hr_color, 0, self._max_hr
+        yield "power", self._power_vals, self._power_color, 0, self._max_watts
+        yield "setpoint", self._hr_setpoint_vals, self._hr_setpoint_color, 0, self._max_hr
+        for name, vals in self._overlay_vals.items():
+            color, low, high = self._overlay_series[name]
+            yield name, vals, color, low, high
+
+    def _to_rows(self, values, low, high):
+        rows = self._buffer.shape[0]
+        fraction = (np.asarray(values, dtype=np.float64) - low) / (high - low)
+        return (rows - 1 - np.clip(fraction, 0, 1) * (rows - 1)).astype(np.intp)
+
+    def _render(self):
+        width = max(self._width - self._x_axis_pad, 1)
+        height = max(self._height - self._y_axis_pad, 1)
+        if self._buffer.shape[:2] != (height, width):
+            self._redraw(height, width)
+        else:
+            self._scroll()
+        self._blit()
+
+    def _redraw(self, height, width):
+        self._buffer = np.full((height, width, 3), _BACKGROUND, dtype=np.uint8)
+        self._last_y.clear()
+        self._last_drawn.clear()
+        rows = np.arange(height)[:, None]
+        for name, vals, color, low, high in self._series():
+            if not vals:
+                continue
+            columns = [_column(measurement) for measurement in vals][-width:]
+            highest, lowest, last = (
+                self._to_rows(values, low, high) for values in zip(*columns)
+            )
+            # Each column spans from the previous point's row to its own,
+            # joining the points into a line
+            previous = np.concatenate((last[:1], last[:-1]))
+            top = np.minimum(previous, highest)
+            bottom = np.maximum(previous, lowest)
+            mask = (rows >= top) & (rows <= bottom)
+            self._buffer[:, width - len(last) :][mask] = self._rgb(color)
+            self._last_y[name] = int(last[-1])
+            self._last_drawn[name] = vals[-1]
+        self._canvas.delete("all")
+        self._image_item = self._canvas.create_image(
+            self._x_axis_pad, 0, image=self._photo, anchor="nw"
+        )
+        self._draw_axes()
+
+    def _scroll(self):
+        buffer = self._buffer
+        buffer[:, :-1] = buffer[:, 1:]
+        buffer[:, -1] = _BACKGROUND
+        for name, vals, color, low, high in self._series():
+            if not vals:
+                continue
+            newest = vals[-1]
+            previous_y = self._last_y.get(name)
+            if newest is not self._last_drawn.get(name) or previous_y is None:
+                top, bottom, y = (
+                    int(row) for row in self._to_rows(_column(newest), low, high)
+                )
+            else:
+                # No new point for this series this frame; hold its level
+                top = bottom = y = previous_y
+            if previous_y is None:
+                previous_y = y
+            top = min(previous_y, top)
+            bottom = max(previous_y, bottom)
+            buffer[top : bottom + 1, -1] = self._rgb(color)
+            self._last_y[name] = y
+            self._last_drawn[name] = newest
+
+    def _blit(self):
+        height, width = self._buffer.shape[:2]
+        header = f"P6 {width} {height} 255 ".encode()
+        self._photo.configure(
+            data=header + self._buffer.tobytes(), format="PPM", width=width, height=height
+        )
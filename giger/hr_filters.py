@@ -0,0 +1,211 @@
+import math
+import struct
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Optional, Sequence, Tuple
+
+# HR notifications arrive about once a second; latencies are quoted against that
+HR_SAMPLE_PERIOD_S = 1.0
+DEFAULT_LATENCY_BUDGET_S = 3.0
+
+RR_INTERVAL_UNIT = 1 / 1024  # s
+MIN_RR_S = 0.25  # 240 bpm
+MAX_RR_S = 2.0  # 30 bpm
+RR_ARTIFACT_FRACTION = 0.25
+# Past this many artefacts in a row the signal has really moved, so the
+# filters give up rejecting and start again from the new value
+MAX_CONSECUTIVE_ARTIFACTS = 3
+# With no usable RR interval for this long, the RR filter's window is stale
+RR_TIMEOUT_S = 3.0
+
+_UINT16 = struct.Struct("<H")
+
+
+def parse_hr_measurement(data: bytearray) -> Tuple[int, Tuple[float, ...]]:
+    """HR in bpm and any RR intervals (s) from a Heart Rate Measurement."""
+    flags = data[0]
+    if flags & 0x01:
+        hr = _UINT16.unpack_from(data, 1)[0]
+        offset = 3
+    else:
+        hr = data[1]
+        offset = 2
+    if flags & 0x08:
+        # Energy expended field, which we don't use
+        offset += 2
+    if not flags & 0x10:
+        return hr, ()
+    rr_intervals = tuple(
+        _UINT16.unpack_from(data, i)[0] * RR_INTERVAL_UNIT
+        for i in range(offset, len(data) - 1, 2)
+    )
+    return hr, rr_intervals
+
+
+class HRFilter:
+    """
+    A streaming HR filter: one O(1) `update` per notification.
+
+    `latency` is the filter's typical delay in seconds, which is checked
+    against the stage's latency budget when it is built.
+    """
+
+    latency: float = 0.0
+
+    def update(self, hr: int, rr_intervals: Sequence[float] = ()) -> float:
+        return hr
+
+    def reset(self):
+        pass
+
+
+class MedianFilter(HRFilter):
+    """Median of the last `n` samples; removes single-sample spikes and dropouts."""
+
+    def __init__(self, n: int = 3):
+        if n < 1:
+            raise ValueError("Median filter needs at least one sample")
+        self._n = n
+        self.latency = (n - 1) / 2 * HR_SAMPLE_PERIOD_S
+        self.reset()
+
+    def reset(self):
+        self._window: deque = deque()
+        self._sorted: list = []
+
+    def update(self, hr, rr_intervals=()):
+        if len(self._window) == self._n:
+            oldest = self._window.popleft()
+            del self._sorted[bisect_left(self._sorted, oldest)]
+        self._window.append(hr)
+        insort(self._sorted, hr)
+        return self._sorted[len(self._sorted) // 2]
+
+
+class KalmanFilter(HRFilter):
+    """
+    Scalar random-walk Kalman filter with innovation gating.
+
+    Samples whose innovation exceeds `gate` standard deviations are treated
+    as artefacts and skipped, so a strap dropout to 0 bpm doesn't move it.
+    """
+
+    def __init__(
+        self,
+        process_noise: float = 0.5,
+        measurement_noise: float = 2.0,
+        gate: float = 5.0,
+    ):
+        self._q = process_noise
+        self._r = measurement_noise
+        self._gate = gate
+        # Steady-state gain of a local-level model gives its lag in samples
+        p = (self._q + math.sqrt(self._q**2 + 4 * self._q * self._r)) / 2
+        gain = p / (p + self._r)
+        self.latency = (1 - gain) / gain * HR_SAMPLE_PERIOD_S
+        self.reset()
+
+    def reset(self):
+        self._estimate: Optional[float] = None
+        self._variance = 0.0
+        self._rejected = 0
+
+    def update(self, hr, rr_intervals=()):
+        if self._estimate is None:
+            self._estimate = float(hr)
+            self._variance = self._r
+            return self._estimate
+        predicted_variance = self._variance + self._q
+        innovation = hr - self._estimate
+        innovation_variance = predicted_variance + self._r
+        if (
+            innovation**2 > self._gate**2 * innovation_variance
+            and self._rejected < MAX_CONSECUTIVE_ARTIFACTS
+        ):
+            # Don't gate forever or a genuine step would never be accepted
+            self._rejected += 1
+            self._variance = predicted_variance
+            return self._estimate
+        self._rejected = 0
+        gain = predicted_variance / innovation_variance
+        self._estimate += gain * innovation
+        self._variance = (1 - gain) * predicted_variance
+        return self._estimate
+
+
+class RRIntervalFilter(HRFilter):
+    """
+    HR from the mean of the last `beats` artefact-free RR intervals.
+
+    RR intervals carry sub-bpm resolution that the integer HR field loses.
+    Falls back to the reported HR when the strap sends no RR intervals, or
+    has sent none usable for `timeout` seconds of notifications.
+    """
+
+    def __init__(self, beats: int = 4, timeout: float = RR_TIMEOUT_S):
+        self._beats = beats
+        self._timeout = max(1, round(timeout / HR_SAMPLE_PERIOD_S))
+        # Half the window, at a typical exercise HR of ~120 bpm
+        self.latency = beats / 2 * 0.5
+        self.reset()
+
+    def reset(self):
+        self._intervals: deque = deque()
+        self._total = 0.0
+        self._rejected = 0
+        self._missed = 0
+
+    def update(self, hr, rr_intervals=()):
+        accepted = False
+        for rr in rr_intervals:
+            if not MIN_RR_S <= rr <= MAX_RR_S:
+                continue
+            if self._intervals:
+                mean = self._total / len(self._intervals)
+                if abs(rr - mean) > RR_ARTIFACT_FRACTION * mean:
+                    if self._rejected < MAX_CONSECUTIVE_ARTIFACTS:
+                        self._rejected += 1
+                        continue
+                    # A genuine jump, or a window left over from before a
+                    # dropout: start again from this beat
+                    self._intervals.clear()
+                    self._total = 0.0
+            self._rejected = 0
+            if len(self._intervals) == self._beats:
+                self._total -= self._intervals.popleft()
+            self._intervals.append(rr)
+            self._total += rr
+            accepted = True
+        if accepted:
+            self._missed = 0
+        else:
+            self._missed += 1
+            if self._missed >= self._timeout:
+                # Don't hold the last beats' HR for as long as RR stays away
+                self._intervals.clear()
+                self._total = 0.0
+        if not self._intervals:
+            return hr
+        return 60 * len(self._intervals) / self._total
+
+
+HR_FILTERS = {
+    "none": HRFilter,
+    "median": MedianFilter,
+    "kalman": KalmanFilter,
+    "rr": RRIntervalFilter,
+}
+
+
+def make_hr_filter(
+    name: str, latency_budget: float = DEFAULT_LATENCY_BUDGET_S, **kwargs
+) -> HRFilter:
+    if name not in HR_FILTERS:
+        raise ValueError(f"Unknown HR filter: {name}")
+    hr_filter = HR_FILTERS[name](**kwargs)
+    if hr_filter.latency > latency_budget:
+        raise ValueError(
+            f"{name} HR filter adds {hr_filter.latency:.1f} s of latency, "
+            f"over the {latency_budget:.1f} s budget"
+        )
+    return hr_filter
@@ -1,14 +1,29 @@
+import argparse
 import asyncio
 import math
+from queue import Empty, SimpleQueue
 from threading import Thread
 from time import time
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
-from _types import Measurement
+from _types import CommandsApplied, HRSample, Measurement, PowerWrite, TrainerData
 import controller
 import customtkinter
+from checkpoint import Checkpointer
+from command_server import CommandServer, DEFAULT_COMMAND_ADDRESS
+from control_process import ControlProcess
+from diagnostics import Diagnostics
+from fec import SPECIFIC_TRAINER_DATA_PAGE
+from mmp import STANDARD_DURATIONS
+from recorder import SessionRecorder
+from sysid import starting_gains
+from event_bus import EventBus
 import devices
 from graph import Graph
+from graph_raster import RasterGraph
+from hr_filters import make_hr_filter
+from sim import SIM_HRM_ADDRESS, SIM_TRAINER_ADDRESS, SimulatedRide
+from tk_asyncio import CooperativeLoop
 from customtkinter import (
     CTkSlider,
     CTkLabel,
@@ -17,6 +32,7 @@ from customtkinter import (
     CTkButton,
     CTkTextbox,
     CTkTabview,
+    CTkOptionMenu,
 )
 from loguru import logger
 from settings import settings
@@ -31,9 +47,61 @@ customtkinter.set_default_color_theme(
 STARTING_HR_SETPOINT_VALUE = 140
 STARTING_MIN_WATTS_VALUE = 180
 STARTING_MAX_WATTS_VALUE = 300
+# The min and max sliders stop this far short of each other, as the
+# controller rejects a minimum that isn't below the maximum
+MIN_POWER_RANGE_W = 1
 
+# Used until the rider has a fitted model, see sysid.py
 KPID = (0.5, 0.01, 0.05)
 
+# Set to run the PID at a fixed rate instead of on every HR notification
+CONTROL_RATE_HZ: Optional[float] = None
+
+# Align HR, trainer and power meter samples onto the control rate grid this
+# many seconds behind real time (see fusion.py); needs CONTROL_RATE_HZ. None
+# to control on HR samples as they arrive
+SENSOR_FUSION_DELAY_S: Optional[float] = None
+
+# HR conditioning before the controller: "none", "median", "kalman" or "rr"
+HR_FILTER = "none"
+
+# Slew power changes at this many W/s so steps aren't felt as a jolt
+POWER_RAMP_RATE_W_PER_S: Optional[float] = 25
+
+# Run the controller and BLE clients in a child process, away from the UI
+USE_CONTROL_PROCESS = False
+CONTROL_PROCESS_POLL_MS = 100
+
+# Run the asyncio loop and Tk on the main thread, taking turns, instead of
+# giving the asyncio loop its own thread
+SINGLE_THREAD = False
+# How long asyncio runs on each of its turns; Tk's waits at most this long
+ASYNCIO_SLICE_S = 0.01
+
+COMMAND_SERVER_ADDRESS = DEFAULT_COMMAND_ADDRESS
+
+# What to do when HR stops arriving, control ticks stall or a power write
+# hangs: "hold", "ramp_down" to min power, "freeze" the PID, or None to not
+# watch for it
+WATCHDOG_FALLBACK: Optional[str] = "hold"
+
+# Controller state is checkpointed here so a crash mid-ride can resume
+CHECKPOINT_FILE = "giger.checkpoint"
+
+LOG_BOX_MAX_LINES = 500
+LOG_BOX_DRAIN_MS = 100
+LOG_FILE = "giger.log"
+
+DIAGNOSTICS_REFRESH_MS = 1000
+PROFILE_SECONDS = 10
+
+MMP_REFRESH_MS = 1000
+
+# "canvas" draws traces as Canvas lines, "raster" into one PhotoImage, which
+# is much cheaper on slow machines
+GRAPH_BACKEND = "canvas"
+GRAPH_BACKENDS = {"canvas": Graph, "raster": RasterGraph}
+
 
 class SliderPair:
     def __init__(self, master, logscale=False, callback=None):
@@ -101,18 +169,50 @@ class SliderPair:
 
 
 class TextBoxLogger:
-    def __init__(self, textbox):
+    """
+    loguru sink for the log box.
+
+    `write` only queues the line, so it is cheap on whatever thread logged.
+    The Tk thread calls `drain` on a timer to insert everything queued in
+    one go and trim the box to the last `max_lines` lines.
+    """
+
+    def __init__(self, textbox, max_lines=LOG_BOX_MAX_LINES):
         self._textbox = textbox
+        self._max_lines = max_lines
+        self._pending = SimpleQueue()
 
     def write(self, writeable):
+        self._pending.put(writeable)
+
+    def drain(self):
+        lines = []
+        while True:
+            try:
+                lines.append(self._pending.get_nowait())
+            except Empty:
+                break
+        if not lines:
+            return
         self._textbox.configure(state="normal")
-        self._textbox.insert("end", writeable)
+        self._textbox.insert("end", "".join(lines[-self._max_lines :]))
+        # The text widget always ends with an empty line after the last newline
+        excess = int(self._textbox.index("end-1c").split(".")[0]) - self._max_lines - 1
+        if excess > 0:
+            self._textbox.delete("1.0", f"{excess + 1}.0")
         self._textbox.configure(state="disabled")
         self._textbox._textbox.see("end")
 
 
 class HRTrainer(customtkinter.CTk):
-    def __init__(self):
+    def __init__(
+        self,
+        control_process: bool = USE_CONTROL_PROCESS,
+        simulate: bool = False,
+        single_thread: bool = SINGLE_THREAD,
+        asyncio_slice: float = ASYNCIO_SLICE_S,
+        graph_backend: str = GRAPH_BACKEND,
+    ):
         super().__init__()
         self._geometry = (820, 800)
         self._graph_geometry = (780, 300)
@@ -120,21 +220,134 @@ class HRTrainer(customtkinter.CTk):
         self.geometry(f"{width}x{height}")
         self.title("CustomTkinter simple_example.py")
         self._topmost = False
-        # Instantiate giger controller
-        self._giger = controller.Giger(
-            None,
-            None,
+        self._loop = asyncio.new_event_loop()
+        self._event_bus = EventBus(self._loop)
+        self._control_process = control_process
+        self._single_thread = single_thread
+        self._asyncio_slice = asyncio_slice
+        self._graph_class = GRAPH_BACKENDS[graph_backend]
+        # When the last power change was asked for, until it is written
+        self._power_input_time: Optional[float] = None
+        self._control_mode = controller.CONTROL_MODES[0]
+        # How far the graph's overlays have read each ring
+        self._overlay_cursors = {"telemetry": 0, "pid": 0, "fec": 0}
+        giger_kwargs = dict(
             max_power=STARTING_MAX_WATTS_VALUE,
             min_power=STARTING_MIN_WATTS_VALUE,
             hr_setpoint=STARTING_HR_SETPOINT_VALUE,
-            update_hr_callback=self._current_hr_callback,
-            update_power_callback=self._current_watts_callback,
+            control_rate_hz=CONTROL_RATE_HZ,
+            hr_filter=make_hr_filter(HR_FILTER),
+            ramp_rate=POWER_RAMP_RATE_W_PER_S,
+            fallback=WATCHDOG_FALLBACK,
+            fusion_delay=SENSOR_FUSION_DELAY_S,
+            # Simulated devices mustn't replace the real ones for next time
+            remember_devices=not simulate,
         )
-        self._loop = asyncio.new_event_loop()
+        self._simulation = SimulatedRide() if simulate else None
+        if self._control_process:
+            # The child owns the controller, its event bus and the command server
+            self._giger = ControlProcess(
+                COMMAND_SERVER_ADDRESS,
+                simulate=simulate,
+                checkpoint_path=CHECKPOINT_FILE,
+                **giger_kwargs,
+            )
+        else:
+            # Instantiate giger controller
+            self._giger = controller.Giger(
+                None, None, event_bus=self._event_bus, **giger_kwargs
+            )
+            self._event_bus.subscribe(
+                "hr_label", lambda sample: self._current_hr_callback(sample.hr), HRSample
+            )
+            self._event_bus.subscribe(
+                "power_label",
+                lambda _: self._current_watts_callback(
+                    self._giger.current_trainer_power
+                ),
+                TrainerData,
+                maxsize=1,
+            )
+            self._event_bus.subscribe(
+                "input_to_write", self._record_input_to_write, PowerWrite
+            )
+            self._event_bus.subscribe(
+                "remote_state", lambda event: self._show_state(event.state), CommandsApplied
+            )
+        # In control-process mode this watches the UI process; the child's own
+        # diagnostics are reachable through its command server
+        self._diagnostics = Diagnostics(self._event_bus)
+        if not self._control_process:
+            self._command_server = CommandServer(
+                self._giger, COMMAND_SERVER_ADDRESS, self._diagnostics
+            )
+            self._recorder = SessionRecorder(self._giger)
         self._setup_ui()
         for element in self._stateful_ui_elements:
             element.configure(state="disabled")
 
+        checkpointer = Checkpointer(CHECKPOINT_FILE)
+        restored = checkpointer.load()
+        if self._control_process:
+            # The child restores and keeps the checkpoint; it's only read
+            # here to show the restored settings
+            checkpointer.close()
+            checkpointer = None
+        self._checkpointer = checkpointer
+        if restored is not None:
+            self._show_checkpoint(restored)
+            if not self._control_process:
+                self._giger.restore(restored)
+
+    def _show_checkpoint(self, checkpoint):
+        # Through the usual callbacks, which also reach a control process
+        self._hr_setpoint_slider.set(checkpoint.hr_setpoint)
+        self._hr_setpoint_callback(checkpoint.hr_setpoint)
+        # The limits go as a pair: one at a time, a new minimum above the old
+        # maximum would be rejected
+        self._giger.set_power_limits(checkpoint.min_power, checkpoint.max_power)
+        for slider, label, value in (
+            (self._min_watts_slider, self._min_watts_value_label, checkpoint.min_power),
+            (self._max_watts_slider, self._max_watts_value_label, checkpoint.max_power),
+        ):
+            slider.set(value)
+            label.configure(text=f"{value:.0f}")
+        for sliders, value in (
+            (self._kp_sliders, checkpoint.kp),
+            (self._ki_sliders, checkpoint.ki),
+            (self._kd_sliders, checkpoint.kd),
+        ):
+            sliders.set(value, do_callback=True)
+            sliders.callback(value)
+        mode = controller.CONTROL_MODES[checkpoint.control_mode]
+        self._control_mode_menu.set(mode)
+        self._control_mode_callback(mode)
+        if checkpoint.running:
+            self._on_off_switch.select()
+
+    def _show_state(self, state):
+        # After commands from the command server; the controller already has
+        # these values, so the widgets are set without their callbacks
+        self._hr_setpoint_slider.set(state["target_hr"])
+        self._hr_setpoint_value_label.configure(text=f"{state['target_hr']:.0f}")
+        self._graph.hr_setpoint = state["target_hr"]
+        for slider, label, value in (
+            (self._min_watts_slider, self._min_watts_value_label, state["min_power"]),
+            (self._max_watts_slider, self._max_watts_value_label, state["max_power"]),
+        ):
+            slider.set(value)
+            label.configure(text=f"{value:.0f}")
+        for sliders, name in (
+            (self._kp_sliders, "kp"),
+            (self._ki_sliders, "ki"),
+            (self._kd_sliders, "kd"),
+        ):
+            sliders.set(state[name], do_callback=True)
+        if state["running"]:
+            self._on_off_switch.select()
+        else:
+            self._on_off_switch.deselect()
+
     # Callbacks for giger controller instantiation
     def _current_watts_callback(self, watts):
         self._current_watts_value_label.configure(text=f"{watts:.0f}")
@@ -150,6 +363,15 @@ class HRTrainer(customtkinter.CTk):
 
     def _get_measurements(self) -> Tuple[Measurement, Measurement, Measurement]:
         global giger
+        fusion = None if self._control_process else self._giger.fusion
+        if fusion is not None and fusion.latest is not None:
+            # Aligned samples carry the time they were measured, not drawn
+            sample = fusion.latest
+            return (
+                Measurement(sample.timestamp, sample.hr),
+                Measurement(sample.timestamp, sample.power),
+                Measurement(sample.timestamp, self._giger.hr_setpoint),
+            )
         ts = time()
         return (
             Measurement(ts, self._giger.current_hr),
@@ -157,6 +379,26 @@ class HRTrainer(customtkinter.CTk):
             Measurement(ts, self._giger.hr_setpoint),
         )
 
+    def _get_overlay_values(self) -> Dict[str, List[float]]:
+        """Each overlay's values recorded since the last call, oldest first."""
+        if self._control_process:
+            # Only the telemetry ring crosses the process boundary
+            self._overlay_cursors["telemetry"], records = (
+                self._giger.telemetry.read_since(self._overlay_cursors["telemetry"])
+            )
+            return {"target": [record[4] for record in records]}
+        values = {"target": [self._giger.current_pid_control_power]}
+        self._overlay_cursors["pid"], steps = self._giger.pid_components.read_since(
+            self._overlay_cursors["pid"]
+        )
+        for name in ("error", "p", "i", "d", "clamp"):
+            values[name] = [getattr(step, name) for step in steps]
+        self._overlay_cursors["fec"], pages = self._giger.fec.read_since(
+            SPECIFIC_TRAINER_DATA_PAGE, self._overlay_cursors["fec"]
+        )
+        values["cadence"] = [page.cadence for page in pages]
+        return values
+
     def _grid_metrics_slider_group(self, row, label: CTkLabel, slider, value):
         label.grid(row=row, column=0, sticky="w", padx=5, pady=5, ipadx=5)
         slider.grid(row=row, column=1, sticky="ew", padx=5, pady=5, ipadx=5)
@@ -177,19 +419,36 @@ class HRTrainer(customtkinter.CTk):
             self._giger.stop()
 
     def _reset_button_command(self):
-        self._giger.pid.reset()
+        self._giger.reset()
 
     def _hr_setpoint_callback(self, hr):
         self._hr_setpoint_value_label.configure(text=f"{hr:.0f}")
-        self._giger.hr_setpoint = hr
-        self._giger.pid.setpoint = hr
+        self._giger.set_target_hr(hr)
         self._graph.hr_setpoint = hr
 
+    def _control_mode_callback(self, mode):
+        if mode == "scheduled" and settings.gain_schedule is None:
+            logger.warning(
+                f"No gain schedule for {settings.rider_name}, build one with gain_schedule.py"
+            )
+            self._control_mode_menu.set(self._control_mode)
+            return
+        self._giger.set_control_mode(mode)
+        self._control_mode = mode
+
     def _min_watts_callback(self, watts):
+        limit = self._max_watts_slider.get() - MIN_POWER_RANGE_W
+        if watts > limit:
+            watts = limit
+            self._min_watts_slider.set(watts)
         self._giger.set_min_power(watts)
         self._min_watts_value_label.configure(text=f"{watts:.0f}")
 
     def _max_watts_callback(self, watts):
+        limit = self._min_watts_slider.get() + MIN_POWER_RANGE_W
+        if watts < limit:
+            watts = limit
+            self._max_watts_slider.set(watts)
         self._giger.set_max_power(watts)
         self._max_watts_value_label.configure(text=f"{watts:.0f}")
 
@@ -199,11 +458,23 @@ class HRTrainer(customtkinter.CTk):
         if self._on_off_switch.get():
             self._on_off_switch.toggle()
         watts = self._set_current_watts_slider.get()
-        asyncio.run_coroutine_threadsafe(
-            self._giger.set_current_power(watts), self._loop
-        )
+        self._power_input_time = time()
+        self._submit(self._giger.set_current_power(watts))
         # future.add_done_callback(lambda *args, **kwargs: self._current_watts_callback(watts))
 
+    def _submit(self, coro):
+        if self._single_thread:
+            # Same thread as the loop, so no handoff; it runs on asyncio's turn
+            return self._loop.create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _record_input_to_write(self, write):
+        if self._power_input_time is not None:
+            self._diagnostics.input_to_write.record(
+                write.timestamp - self._power_input_time
+            )
+            self._power_input_time = None
+
     def _enable_interface(self):
         # future.result()
         for element in self._stateful_ui_elements:
@@ -217,7 +488,7 @@ class HRTrainer(customtkinter.CTk):
             or not self._device_picker_window.winfo_exists()
         ):
             self._device_picker_window = DevicePicker(
-                loop=self._loop, done_callback=self._change_devices
+                loop=self._loop, done_callback=self._change_devices, submit=self._submit
             )
             self._device_picker_window.attributes("-topmost", True)
         else:
@@ -225,16 +496,22 @@ class HRTrainer(customtkinter.CTk):
         self._device_picker_window.lift(aboveThis=self)
 
     def _change_devices(self, hrm_device, trainer_device):
-        asyncio.run_coroutine_threadsafe(
-            self._async_change_devices(hrm_device, trainer_device), self._loop
-        )
+        self._submit(self._async_change_devices(hrm_device, trainer_device))
 
     async def _async_change_devices(self, hrm_device, trainer_device):
-        future = asyncio.gather(
+        results = await asyncio.gather(
             self._change_hrm_device(hrm_device),
             self._change_trainer_device(trainer_device),
+            return_exceptions=True,
         )
-        future.add_done_callback(lambda *args, **kwargs: self._giger.start())
+        failed = False
+        for device, result in zip(("HRM", "trainer"), results):
+            if isinstance(result, Exception):
+                # The previous device, if any, is still in use
+                logger.error(f"Switching {device} failed: {result}")
+                failed = True
+        if not failed:
+            self._giger.start()
 
     async def _change_hrm_device(self, hrm_device):
         if hrm_device is not None:
@@ -297,14 +574,72 @@ class HRTrainer(customtkinter.CTk):
         self._graph_frame = CTkFrame(master=self._right_frame)
         self._graph_frame.pack(fill="both", expand=True)
         width, height = self._graph_geometry
-        self._graph = Graph(self._graph_frame, width, height, self._get_measurements)
+        self._graph = self._graph_class(
+            self._graph_frame,
+            width,
+            height,
+            self._get_measurements,
+            get_overlay_callback=self._get_overlay_values,
+        )
 
         self._hr_favorites_frame = self._weights_favorites_tab.add("HR Favs")
         self._hr_favorites_frame.grid_columnconfigure(1, weight=1)
         self._watt_favorites_frame = self._weights_favorites_tab.add("Pwr Favs")
         self._kweights_frame = self._weights_favorites_tab.add("K-Weights")
+        self._diagnostics_frame = self._weights_favorites_tab.add("Diag")
+        self._mmp_frame = self._weights_favorites_tab.add("Bests")
         self._weights_favorites_tab.set("HR Favs")
 
+        self._mmp_value_labels = {}
+        for row, duration in enumerate(STANDARD_DURATIONS):
+            minutes, seconds = divmod(duration, 60)
+            name = f"{minutes} min" if minutes else f"{seconds} s"
+            CTkLabel(master=self._mmp_frame, text=name).grid(
+                row=row, column=0, sticky="w", padx=10, pady=5
+            )
+            self._mmp_value_labels[duration] = CTkLabel(
+                master=self._mmp_frame, text="-"
+            )
+            self._mmp_value_labels[duration].grid(
+                row=row, column=1, sticky="e", padx=10, pady=5
+            )
+
+        self._loop_lag_label = CTkLabel(
+            master=self._diagnostics_frame, text="Loop lag", justify="left"
+        )
+        self._loop_lag_label.pack(pady=5, padx=10, anchor="w")
+        self._tk_stall_label = CTkLabel(
+            master=self._diagnostics_frame, text="Tk stalls", justify="left"
+        )
+        self._tk_stall_label.pack(pady=5, padx=10, anchor="w")
+        self._input_to_write_label = CTkLabel(
+            master=self._diagnostics_frame, text="Input to write", justify="left"
+        )
+        self._input_to_write_label.pack(pady=5, padx=10, anchor="w")
+        self._deadlines_label = CTkLabel(
+            master=self._diagnostics_frame, text="Deadline misses", justify="left"
+        )
+        self._deadlines_label.pack(pady=5, padx=10, anchor="w")
+        self._trainer_writes_label = CTkLabel(
+            master=self._diagnostics_frame, text="Trainer writes", justify="left"
+        )
+        self._trainer_writes_label.pack(pady=5, padx=10, anchor="w")
+        self._bus_lag_label = CTkLabel(
+            master=self._diagnostics_frame, text="", justify="left"
+        )
+        self._bus_lag_label.pack(pady=5, padx=10, anchor="w")
+        self._profile_subsystem_menu = CTkOptionMenu(
+            master=self._diagnostics_frame,
+            values=list(Diagnostics.SUBSYSTEMS),
+        )
+        self._profile_subsystem_menu.pack(pady=5, padx=10)
+        self._profile_button = CTkButton(
+            master=self._diagnostics_frame,
+            text=f"Profile {PROFILE_SECONDS} s",
+            command=self._profile_button_callback,
+        )
+        self._profile_button.pack(pady=5, padx=10)
+
         self._kweights_frame_label = CTkLabel(
             master=self._kweights_frame, text="K weights", justify="left"
         )
@@ -319,6 +654,13 @@ class HRTrainer(customtkinter.CTk):
         self._kd_frame = CTkFrame(master=self._kweights_frame)
         self._kd_frame.pack(pady=10, padx=10, fill="both", expand=False, side="top")
 
+        self._control_mode_menu = CTkOptionMenu(
+            master=self._kweights_frame,
+            values=list(controller.CONTROL_MODES),
+            command=self._control_mode_callback,
+        )
+        self._control_mode_menu.pack(pady=10, padx=10)
+
         for idx, watts in enumerate(reversed(range(150, 450, 25))):
 
             def callback_factory(_watts):
@@ -390,6 +732,10 @@ class HRTrainer(customtkinter.CTk):
                 "<level>{message}</level>"
             ),
         )
+        # Full log for the whole ride, written from loguru's own thread
+        logger.add(
+            LOG_FILE, level="DEBUG", rotation="10 MB", retention=5, enqueue=True
+        )
 
         # Create 3 pairs of sliders and labels
         self._kp_sliders = SliderPair(master=self._kp_frame, logscale=True)
@@ -399,10 +745,13 @@ class HRTrainer(customtkinter.CTk):
         self._kd_sliders = SliderPair(master=self._kd_frame, logscale=True)
         self._kd_sliders.pack(pady=5, padx=20)
 
-        kp, ki, kd = KPID
+        kp, ki, kd = starting_gains(KPID)
         self._kp_sliders.set(kp, do_callback=True)
         self._ki_sliders.set(ki, do_callback=True)
         self._kd_sliders.set(kd, do_callback=True)
+        self._giger.set_kp(kp)
+        self._giger.set_ki(ki)
+        self._giger.set_kd(kd)
 
         # METRICS_WIDGETS
 
@@ -579,46 +928,222 @@ class HRTrainer(customtkinter.CTk):
         self._graph.update()
         self.after(self._graph.update_period_ms, self._update_graph)
 
+    def _profile_button_callback(self):
+        subsystem = self._profile_subsystem_menu.get()
+        try:
+            self._diagnostics.profile(subsystem, PROFILE_SECONDS)
+        except RuntimeError as e:
+            logger.warning(str(e))
+
+    def _refresh_diagnostics(self):
+        summary = self._diagnostics.summary()
+        for label, name, title in (
+            (self._loop_lag_label, "loop_lag", "Loop lag"),
+            (self._tk_stall_label, "tk_stall", "Tk stalls"),
+            (self._input_to_write_label, "input_to_write", "Input to write"),
+        ):
+            histogram = summary.get(name)
+            if histogram is not None:
+                label.configure(
+                    text=(
+                        f"{title}: p50 {histogram['p50_ms']:.1f} ms, "
+                        f"p99 {histogram['p99_ms']:.1f} ms, "
+                        f"max {histogram['max_ms']:.1f} ms"
+                    )
+                )
+        deadlines = summary.get("deadlines")
+        if deadlines is not None:
+            misses = ", ".join(
+                f"{name} {count}" for name, count in deadlines["misses"].items()
+            )
+            self._deadlines_label.configure(
+                text=(
+                    f"Deadline misses: {misses or 'none'}, "
+                    f"handled within {deadlines['loop_delay']['max_ms']:.1f} ms"
+                )
+            )
+        writes = summary.get("trainer_writes")
+        if writes is not None:
+            depth = max(writes["in_flight"], default=0)
+            self._trainer_writes_label.configure(
+                text=(
+                    f"Trainer writes: RTT p50 {writes['write_rtt']['p50_ms']:.1f} ms, "
+                    f"applied p50 {writes['applied']['p50_ms']:.0f} ms, "
+                    f"max {depth} in flight, {writes.get('retries', 0)} resent"
+                )
+            )
+        bus_lines = [
+            f"{name}: {metrics['max_lag_ms']:.1f} ms max, {metrics['dropped']} dropped"
+            for name, metrics in summary.get("event_bus", {}).items()
+        ]
+        self._bus_lag_label.configure(text="\n".join(bus_lines))
+        self.after(DIAGNOSTICS_REFRESH_MS, self._refresh_diagnostics)
+
+    def _refresh_mean_max_power(self):
+        mean_max_power = self._giger.mean_max_power
+        for duration, label in self._mmp_value_labels.items():
+            best = mean_max_power.best(duration)
+            label.configure(text=f"{best:.0f} W" if best else "-")
+        self.after(MMP_REFRESH_MS, self._refresh_mean_max_power)
+
+    def _drain_log_box(self):
+        self._log_box_handler.drain()
+        self.after(LOG_BOX_DRAIN_MS, self._drain_log_box)
+
+    def _poll_control_process(self):
+        self._current_hr_callback(self._giger.current_hr)
+        self._current_watts_callback(self._giger.current_trainer_power)
+        for level, message in self._giger.drain_logs():
+            logger.log(level, "[control] {}", message)
+        state = self._giger.pop_state()
+        if state is not None:
+            self._show_state(state)
+        self.after(CONTROL_PROCESS_POLL_MS, self._poll_control_process)
+
     # We run the controller in a separate thread
     async def _run_controller(self):
+        asyncio.ensure_future(self._diagnostics.loop_lag.run())
+        if self._checkpointer is not None:
+            asyncio.ensure_future(self._checkpointer.run(self._giger))
+        if not self._control_process:
+            self._diagnostics.watch_trainer_writes(self._giger.trainer_write_stats)
+            if self._giger.watchdog is not None:
+                self._giger.watchdog.start(asyncio.get_running_loop())
+                self._diagnostics.watch_deadlines(self._giger.watchdog)
+        if self._control_process:
+            self._giger.launch()
+            while not self._giger.devices_connected:
+                await asyncio.sleep(1)
+            self._enable_interface()
+            # Keep the loop alive for the device picker's scans
+            while True:
+                await asyncio.sleep(1)
+
+        device_source = self._simulation or devices
+
         ### TODO load hr and trainer UUIDs from file written at exit
         async def set_up_hr(hrm_uuid):
             if hrm_uuid is not None:
-                hr_client = await devices.set_up_hr(hrm_uuid)
+                hr_client = await device_source.set_up_hr(hrm_uuid)
                 await self._giger.set_hr_client(hr_client)
 
         async def set_up_trainer(trainer_uuid):
             if trainer_uuid is not None:
-                trainer_control = await devices.set_up_trainer(trainer_uuid)
+                trainer_control = await device_source.set_up_trainer(trainer_uuid)
                 await self._giger.set_trainer_control(trainer_control)
 
-        # logger.warning("UNCOMMENT THE STUFF BELOW")
-        hrm_uuid = settings.last_used_hrm_uuid
-        trainer_uuid = settings.last_used_trainer_uuid
-        asyncio.gather(set_up_hr(hrm_uuid), set_up_trainer(trainer_uuid))
+        async def set_up_power_meter(power_meter_uuid):
+            if power_meter_uuid is not None:
+                power_meter_client = await devices.set_up_power_meter(power_meter_uuid)
+                await self._giger.set_power_meter_client(power_meter_client)
 
-        while self._giger.trainer_control is None or self._giger.hr_client is None:
+        # logger.warning("UNCOMMENT THE STUFF BELOW")
+        if self._simulation is not None:
+            hrm_uuid, trainer_uuid = SIM_HRM_ADDRESS, SIM_TRAINER_ADDRESS
+            power_meter_uuid = None
+        else:
+            hrm_uuid = settings.last_used_hrm_uuid
+            trainer_uuid = settings.last_used_trainer_uuid
+            power_meter_uuid = settings.last_used_power_meter_uuid
+        asyncio.gather(
+            set_up_hr(hrm_uuid),
+            set_up_trainer(trainer_uuid),
+            set_up_power_meter(power_meter_uuid),
+        )
+        try:
+            await self._command_server.start()
+        except OSError as e:
+            # Remote control is optional; don't let a taken port stop the ride
+            logger.error(f"Command server not started on {COMMAND_SERVER_ADDRESS}: {e}")
+        if CONTROL_RATE_HZ is not None:
+            asyncio.ensure_future(self._giger.run_control_loop())
+
+        while not self._giger.devices_connected:
             await asyncio.sleep(1)
 
         self._enable_interface()
+        self._recorder.start()
 
         while True:
             await asyncio.sleep(1)
 
     def run(self):
-        thread = Thread(
-            target=self._loop.run_until_complete, args=(self._run_controller(),)
-        )
-        thread.start()
+        if self._single_thread:
+            self._loop.create_task(self._run_controller())
+        else:
+            thread = Thread(
+                target=self._loop.run_until_complete, args=(self._run_controller(),)
+            )
+            thread.start()
         self.focus_force()
         self.attributes("-topmost", self._topmost)
         self._update_graph()
+        self._drain_log_box()
+        self._diagnostics.watch_tk(self)
+        self._refresh_diagnostics()
+        if not self._control_process:
+            self._refresh_mean_max_power()
+        if self._control_process:
+            self._poll_control_process()
         self.after_idle(self._show_graph_switch_callback)
-        self.mainloop()
-        self._loop.stop()
-        thread.join()
+        if self._single_thread:
+            CooperativeLoop(self, self._loop, asyncio_slice=self._asyncio_slice).run()
+        else:
+            self.mainloop()
+        if not self._control_process and self._giger.watchdog is not None:
+            # Before the loop stops, or it would read as a stall
+            self._giger.watchdog.stop()
+        if self._control_process:
+            self._giger.shutdown()
+        elif self._single_thread:
+            self._recorder.stop()
+        else:
+            self._loop.call_soon_threadsafe(self._recorder.stop)
+        if not self._single_thread:
+            self._loop.stop()
+            thread.join()
+        if self._checkpointer is not None:
+            # A clean exit, so there's nothing to resume next time
+            self._checkpointer.clear()
 
 
 if __name__ == "__main__":
-    app = HRTrainer()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--control-process",
+        action="store_true",
+        default=USE_CONTROL_PROCESS,
+        help="run the controller and BLE clients in a separate process",
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="use a simulated HRM and trainer instead of BLE devices",
+    )
+    parser.add_argument(
+        "--single-thread",
+        action="store_true",
+        default=SINGLE_THREAD,
+        help="run the asyncio loop and the UI on one thread, taking turns",
+    )
+    parser.add_argument(
+        "--asyncio-slice-ms",
+        type=float,
+        default=ASYNCIO_SLICE_S * 1000,
+        help="with --single-thread, how long asyncio runs on each turn",
+    )
+    parser.add_argument(
+        "--graph-backend",
+        choices=list(GRAPH_BACKENDS),
+        default=GRAPH_BACKEND,
+        help="how the graph is drawn",
+    )
+    args = parser.parse_args()
+    app = HRTrainer(
+        control_process=args.control_process,
+        simulate=args.simulate,
+        single_thread=args.single_thread,
+        asyncio_slice=args.asyncio_slice_ms / 1000,
+        graph_backend=args.graph_backend,
+    )
     app.run()
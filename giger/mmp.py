@@ -0,0 +1,126 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from _types import TrainerData
+
+MAX_DURATION_S = 3600
+# Always tracked exactly, whatever the spacing
+STANDARD_DURATIONS = (5, 60, 300, 1200, 3600)
+# Gaps up to this long are filled in; a longer one is a dropout or a pause,
+# and no window spans it
+MAX_GAP_FILL_S = 5
+
+
+def default_durations(max_duration: int = MAX_DURATION_S) -> List[int]:
+    """Roughly log-spaced durations: every second up to 20 s, then ~10% apart."""
+    durations = list(range(1, 21))
+    while durations[-1] < max_duration:
+        durations.append(min(max(int(durations[-1] * 1.1), durations[-1] + 1), max_duration))
+    standard = [duration for duration in STANDARD_DURATIONS if duration <= max_duration]
+    return sorted(set(durations).union(standard))
+
+
+class MeanMaxPower:
+    """
+    Live mean-maximal power curve.
+
+    Power is binned into 1 s samples and kept as a ring of prefix sums long
+    enough for the longest tracked duration. Each new second checks the
+    window ending now for every tracked duration, so an update costs
+    O(len(durations)) and memory is O(max duration), however long the ride.
+    Durations in between are interpolated from the tracked ones either side.
+    A gap longer than MAX_GAP_FILL_S splits the ride, and only windows
+    within one part count.
+    """
+
+    def __init__(self, durations: Optional[Sequence[int]] = None):
+        self.durations: Tuple[int, ...] = tuple(sorted(durations or default_durations()))
+        self._size = self.durations[-1] + 1
+        self._prefix = array("d", bytes(8 * self._size))
+        self._seconds = 0
+        # Seconds ridden before the current part, and the longest part so far
+        self._segment_start = 0
+        self._longest = 0
+        self._best = array("d", bytes(8 * len(self.durations)))
+        # Accumulates samples until a whole second has passed
+        self._bin_start: Optional[float] = None
+        self._bin_sum = 0.0
+        self._bin_count = 0
+
+    def add_sample(self, timestamp: float, watts: float):
+        if self._bin_start is None:
+            self._bin_start = timestamp
+        elapsed = timestamp - self._bin_start
+        if elapsed >= 1:
+            if self._bin_count:
+                self._add_second(self._bin_sum / self._bin_count)
+                self._bin_start += 1
+                elapsed -= 1
+            empty = int(elapsed)
+            if empty > MAX_GAP_FILL_S:
+                self._bin_start += empty
+                self._segment_start = self._seconds
+            else:
+                # A short gap's empty seconds take the sample that ends it
+                for _ in range(empty):
+                    self._add_second(watts)
+                self._bin_start += empty
+            self._bin_sum = 0.0
+            self._bin_count = 0
+        self._bin_sum += watts
+        self._bin_count += 1
+
+    def on_trainer_data(self, data: TrainerData):
+        self.add_sample(data.timestamp, data.instantaneous_power)
+
+    def _add_second(self, watts: float):
+        size = self._size
+        prefix = self._prefix
+        seconds = self._seconds + 1
+        total = prefix[(seconds - 1) % size] + watts
+        prefix[seconds % size] = total
+        self._seconds = seconds
+        ridden = seconds - self._segment_start
+        self._longest = max(self._longest, ridden)
+        best = self._best
+        for idx, duration in enumerate(self.durations):
+            if duration > ridden:
+                break
+            mean = (total - prefix[(seconds - duration) % size]) / duration
+            if mean > best[idx]:
+                best[idx] = mean
+
+    @property
+    def seconds(self) -> int:
+        return self._seconds
+
+    def best(self, duration: int) -> float:
+        """
+        Best mean power for `duration` seconds so far (0 if not ridden that
+        long without a long gap, or outside the tracked durations).
+        """
+        if duration > self._longest or not self.durations[0] <= duration <= self.durations[-1]:
+            return 0.0
+        idx = bisect_left(self.durations, duration)
+        if idx < len(self.durations) and self.durations[idx] == duration:
+            return self._best[idx]
+        # Between two tracked durations: a longer window's best is a lower
+        # bound, a shorter one's an upper bound; interpolate between them
+        shorter, longer = self.durations[idx - 1], self.durations[idx]
+        upper = self._best[idx - 1]
+        lower = self._best[idx] if longer <= self._longest else upper
+        fraction = (duration - shorter) / (longer - shorter)
+        return upper + (lower - upper) * fraction
+
+    def curve(self) -> Dict[int, float]:
+        return {
+            duration: self._best[idx]
+            for idx, duration in enumerate(self.durations)
+            if duration <= self._longest
+        }
+
+    def target_power(self, duration: int, fraction: float = 1.0) -> float:
+        """Power that would be `fraction` of the current best for `duration`."""
+        return self.best(duration) * fraction
+
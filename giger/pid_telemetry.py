@@ -0,0 +1,58 @@
+from array import array
+from typing import List, Optional, Tuple
+
+from _types import PIDComponents
+
+# At one step per HR sample this is over an hour
+DEFAULT_CAPACITY = 4096
+
+# Clamp state of the output
+CLAMP_LOW = -1
+CLAMP_NONE = 0
+CLAMP_HIGH = 1
+
+
+class PIDComponentRing:
+    """
+    The last `capacity` control steps, each field in its own preallocated
+    array of doubles, so recording a step allocates nothing.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._columns = [
+            array("d", bytes(8 * capacity)) for _ in PIDComponents._fields
+        ]
+        self.count = 0
+
+    def append(self, timestamp, error, p, i, d, output, clamp):
+        idx = self.count % self.capacity
+        for column, value in zip(
+            self._columns, (timestamp, error, p, i, d, output, clamp)
+        ):
+            column[idx] = value
+        self.count += 1
+
+    def latest(self) -> Optional[PIDComponents]:
+        if not self.count:
+            return None
+        idx = (self.count - 1) % self.capacity
+        return PIDComponents(*(column[idx] for column in self._columns))
+
+    def read_since(self, index: int) -> Tuple[int, List[PIDComponents]]:
+        """Return the step count and the steps recorded after `index`."""
+        count = self.count
+        start = max(index, count - self.capacity)
+        steps = [
+            PIDComponents(*(column[i % self.capacity] for column in self._columns))
+            for i in range(start, count)
+        ]
+        return count, steps
+
+    def history(self, field: str) -> List[float]:
+        """Values of `field` still held, oldest first."""
+        column = self._columns[PIDComponents._fields.index(field)]
+        if self.count <= self.capacity:
+            return column[: self.count].tolist()
+        start = self.count % self.capacity
+        return column[start:].tolist() + column[:start].tolist()
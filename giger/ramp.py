@@ -0,0 +1,87 @@
+import asyncio
+from typing import Awaitable, Callable, Optional, Tuple
+
+from loguru import logger
+
+# FE-C target power writes the trainer link sustains comfortably
+DEFAULT_RAMP_PERIOD_S = 0.25
+
+
+class PowerRamp:
+    """
+    Moves trainer power toward a target at a bounded rate.
+
+    Intermediate set-points go out every `period` seconds through `write`.
+    `set_target` can be called at any time and the running ramp simply
+    heads for the new target from wherever it is. Every set-point is
+    clamped to the limits returned by `get_limits` at the time it is sent.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[int], Awaitable],
+        get_limits: Callable[[], Tuple[float, float]],
+        rate: float,
+        period: float = DEFAULT_RAMP_PERIOD_S,
+    ):
+        if rate <= 0:
+            raise ValueError("Ramp rate must be positive")
+        self._write = write
+        self._get_limits = get_limits
+        self.rate = rate
+        self.period = period
+        self.target: Optional[float] = None
+        self.current: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ramping(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _clamp(self, watts: float) -> float:
+        low, high = self._get_limits()
+        return min(max(watts, low), high)
+
+    def set_target(self, watts: float):
+        self.target = watts
+        if not self.ramping:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self._task.add_done_callback(self._on_done)
+
+    @staticmethod
+    def _on_done(task: asyncio.Task):
+        # Nothing awaits the task, so a failed write would otherwise vanish;
+        # the next set_target starts a new one from where this stopped
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Power ramp stopped: {task.exception()!r}")
+
+    def stop(self):
+        """
+        Hold at the last set-point sent.
+
+        The ramp task isn't cancelled, as that could abort a write half way;
+        it sees it has arrived on its next step and finishes.
+        """
+        if self.current is not None:
+            self.target = self.current
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        max_step = self.rate * self.period
+        next_write = loop.time()
+        while True:
+            target = self._clamp(self.target)
+            current = target if self.current is None else self._clamp(self.current)
+            step = min(max(target - current, -max_step), max_step)
+            setpoint = current + step
+            changed = self.current is None or int(round(setpoint)) != int(round(self.current))
+            # Before the write, so a stop() during it holds at this set-point
+            self.current = setpoint
+            if changed:
+                await self._write(int(round(setpoint)))
+            # Against the target as it is now: one set during the write saw
+            # the ramp still running and left it to this task
+            if setpoint == self._clamp(self.target):
+                return
+            next_write += self.period
+            await asyncio.sleep(max(next_write - loop.time(), 0))
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import math
+import os
+import socket
+import struct
+from time import strftime, time
+from typing import Optional
+
+from _types import FusedSample, HRSample, PIDOutput, TrainerData
+from loguru import logger
+from settings import settings
+
+SESSION_MAGIC = b"GIGR"
+SESSION_VERSION = 1
+SESSION_SUFFIX = ".giger"
+SESSION_DIRECTORY = "rides"
+# The header is padded to a fixed size so rows can be memory-mapped at an offset
+HEADER_SIZE = 1024
+_PREAMBLE = struct.Struct("<4sHI")
+
+# (column, struct format) in row order; every row is little-endian and packed
+SESSION_COLUMNS = (
+    ("timestamp", "d"),
+    ("hr", "f"),
+    ("power", "f"),
+    ("cadence", "f"),
+    ("setpoint", "f"),
+    ("target_power", "f"),
+    ("pid_output", "f"),
+)
+_ROW = struct.Struct("<" + "".join(fmt for _, fmt in SESSION_COLUMNS))
+ROW_SIZE = _ROW.size
+
+RECORD_RATE_HZ = 1
+FLUSH_EVERY_ROWS = 30
+
+
+def write_header(f, metadata: dict):
+    blob = json.dumps(metadata).encode()
+    if _PREAMBLE.size + len(blob) > HEADER_SIZE:
+        raise ValueError("Session metadata does not fit in the header")
+    f.write(_PREAMBLE.pack(SESSION_MAGIC, SESSION_VERSION, len(blob)))
+    f.write(blob.ljust(HEADER_SIZE - _PREAMBLE.size, b"\0"))
+
+
+def read_header(f) -> dict:
+    magic, version, length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+    if magic != SESSION_MAGIC:
+        raise ValueError(f"Not a giger session file: {getattr(f, 'name', f)}")
+    if version != SESSION_VERSION:
+        raise ValueError(f"Unsupported session file version {version}")
+    return json.loads(f.read(length))
+
+
+class SessionRecorder:
+    """
+    Records a ride to a session file at a fixed rate from the event bus.
+
+    Each row holds the latest HR, the trainer power averaged over the row's
+    interval, cadence, setpoint, the last power written to the trainer and
+    the PID output (NaN while PID control is off).
+
+    When the controller fuses its sensors, there is a row per fused sample
+    instead, at the control rate, with HR, power and cadence aligned as
+    the controller saw them.
+    """
+
+    def __init__(self, giger, directory: str = SESSION_DIRECTORY, rate_hz=RECORD_RATE_HZ):
+        self._giger = giger
+        self._directory = directory
+        self._period = 1 / rate_hz
+        self._file = None
+        self._task: Optional[asyncio.Task] = None
+        self._subscription = None
+        self.path: Optional[str] = None
+        self._rows = 0
+        self._hr = math.nan
+        self._cadence = math.nan
+        self._power_sum = 0.0
+        self._power_count = 0
+        self._pid_output = math.nan
+
+    def _on_event(self, event):
+        if type(event) is HRSample:
+            self._hr = event.hr
+        elif type(event) is TrainerData:
+            self._power_sum += event.instantaneous_power
+            self._power_count += 1
+            self._cadence = event.cadence
+        elif type(event) is PIDOutput:
+            self._pid_output = event.output if self._giger._is_running else math.nan
+        elif type(event) is FusedSample:
+            self._write_row(event.timestamp, event.hr, event.power, event.cadence)
+
+    def start(self):
+        fusion = self._giger.fusion
+        if fusion is not None:
+            self._period = 1 / fusion.rate_hz
+        os.makedirs(self._directory, exist_ok=True)
+        self.path = os.path.join(
+            self._directory, strftime("%Y%m%d-%H%M%S") + SESSION_SUFFIX
+        )
+        self._file = open(self.path, "wb")
+        write_header(
+            self._file,
+            {
+                "rider": settings.rider_name,
+                "station": socket.gethostname(),
+                "start": time(),
+                "rate_hz": 1 / self._period,
+                "ftp": settings.rider_ftp,
+                "threshold_hr": settings.rider_threshold_hr,
+                "columns": SESSION_COLUMNS,
+            },
+        )
+        if fusion is None:
+            self._subscription = self._giger.event_bus.subscribe(
+                "recorder", self._on_event, HRSample, TrainerData, PIDOutput
+            )
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        else:
+            self._subscription = self._giger.event_bus.subscribe(
+                "recorder", self._on_event, FusedSample, PIDOutput
+            )
+        logger.info(f"Recording session to {self.path}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_row = loop.time()
+        while True:
+            next_row += self._period
+            await asyncio.sleep(max(next_row - loop.time(), 0))
+            if self._power_count:
+                power = self._power_sum / self._power_count
+            else:
+                power = self._giger.current_trainer_power
+            self._power_sum = 0.0
+            self._power_count = 0
+            self._write_row(time(), self._hr, power, self._cadence)
+
+    def _write_row(self, timestamp, hr, power, cadence):
+        self._file.write(
+            _ROW.pack(
+                timestamp,
+                hr,
+                power,
+                cadence,
+                self._giger.hr_setpoint,
+                self._giger.current_pid_control_power,
+                self._pid_output,
+            )
+        )
+        self._rows += 1
+        if self._rows % FLUSH_EVERY_ROWS == 0:
+            self._file.flush()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._subscription is not None:
+            self._giger.event_bus.unsubscribe(self._subscription)
+            self._subscription = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Recorded {self._rows} rows to {self.path}")
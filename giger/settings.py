@@ -37,5 +37,55 @@ class __Settings:
     def last_used_trainer_uuid(self, value):
         return self._set_value("trainer", value)
 
+    @property
+    def last_used_power_meter_uuid(self):
+        return self._get_value("power_meter")
+
+    @last_used_power_meter_uuid.setter
+    def last_used_power_meter_uuid(self, value):
+        return self._set_value("power_meter", value)
+
+    @property
+    def rider_name(self):
+        return self._get_value("rider") or "default"
+
+    @rider_name.setter
+    def rider_name(self, value):
+        return self._set_value("rider", value)
+
+    @property
+    def rider_ftp(self):
+        return self._get_value("ftp")
+
+    @rider_ftp.setter
+    def rider_ftp(self, value):
+        return self._set_value("ftp", value)
+
+    @property
+    def rider_threshold_hr(self):
+        return self._get_value("threshold_hr")
+
+    @rider_threshold_hr.setter
+    def rider_threshold_hr(self, value):
+        return self._set_value("threshold_hr", value)
+
+    @property
+    def rider_model(self):
+        # Fitted HR-response model (see sysid.RiderModel), kept per rider
+        return self._get_value(f"rider_model:{self.rider_name}")
+
+    @rider_model.setter
+    def rider_model(self, value):
+        return self._set_value(f"rider_model:{self.rider_name}", value)
+
+    @property
+    def gain_schedule(self):
+        # PID gains by setpoint and HR (see gain_schedule.GainSchedule), per rider
+        return self._get_value(f"gain_schedule:{self.rider_name}")
+
+    @gain_schedule.setter
+    def gain_schedule(self, value):
+        return self._set_value(f"gain_schedule:{self.rider_name}", value)
+
 
 settings = __Settings()
@@ -0,0 +1,471 @@
+"""
+Simulated HRM and trainer, for running giger without hardware.
+
+The clients stand in for `BleakClient`: they connect, notify and take
+writes like the real devices, over a link with
+configurable notify rate, latency, jitter, packet loss and disconnects.
+HR comes from a first-order-plus-dead-time rider driven by the simulated
+trainer's power.
+
+    python sim.py [seconds]
+"""
+import asyncio
+import math
+import random
+import struct
+import sys
+from collections import deque
+from time import time
+from typing import Callable, Dict, Optional
+
+from adaptive import DEFAULT_MODEL
+from bleak.exc import BleakError
+from devices import HR_MEASUREMENT_UUID, TACX_FEC_READ_UUID, TACX_FEC_WRITE_UUID
+from fec import (
+    COMMAND_PASS,
+    COMMAND_STATUS_PAGE,
+    DATA_PAGE_REQUEST_PAGE,
+    ELAPSED_TIME_UNIT,
+    FIELDS_OFFSET,
+    GENERAL_FE_DATA_PAGE,
+    PAYLOAD_OFFSET,
+    SPECIFIC_TRAINER_DATA_PAGE,
+    SPEED_UNIT,
+    TARGET_POWER_PAGE,
+    TARGET_POWER_UNIT,
+    USER_CONFIGURATION_PAGE,
+    build_fec_message,
+)
+from fec_transport import FecTransport
+from hr_filters import RR_INTERVAL_UNIT
+from loguru import logger
+from sysid import RiderModel
+
+SIM_HRM_ADDRESS = "SIM-HRM"
+SIM_TRAINER_ADDRESS = "SIM-TRAINER"
+
+FE_TYPE_TRAINER = 25
+FE_STATE_IN_USE = 3
+# Aero drag only, flat road: P = k * v^3
+DRAG_COEFFICIENT = 0.3  # W / (m/s)^3
+# How quickly the trainer's brake settles on a new ERG target
+ERG_TIME_CONSTANT_S = 1.5
+
+_TRAINER_PAGE = struct.Struct("<BBBHHB")
+_GENERAL_FE_PAGE = struct.Struct("<BBBBHBB")
+_TARGET_POWER_PAGE = struct.Struct("<B5BH")
+_COMMAND_STATUS_PAGE = struct.Struct("<BBBB4s")
+# User weight, reserved, bicycle weight and wheel offset, wheel size, gear ratio
+_USER_CONFIGURATION = struct.Struct("<HBHBB")
+
+
+class LinkConditions:
+    """
+    How a simulated BLE link behaves.
+
+    Notifications are sent at `notify_rate_hz` and arrive `latency` s later,
+    give or take `jitter`, unless lost with probability `loss`. Writes take a
+    latency sample to complete; a lost write with response is retried, a lost
+    write without one is silently dropped. The link drops at random at
+    `disconnect_rate` times per second.
+    """
+
+    def __init__(
+        self,
+        notify_rate_hz: float,
+        latency: float = 0.03,
+        jitter: float = 0.01,
+        loss: float = 0.0,
+        disconnect_rate: float = 0.0,
+        connect_time: float = 0.5,
+    ):
+        self.notify_rate_hz = notify_rate_hz
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.disconnect_rate = disconnect_rate
+        self.connect_time = connect_time
+
+    def sample_latency(self, rng: random.Random) -> float:
+        return max(rng.gauss(self.latency, self.jitter), 0.0)
+
+
+class RiderPhysiology:
+    """
+    HR following power through a first-order-plus-dead-time response.
+
+    Power is recorded as it is ridden; HR is integrated up to each time it is
+    read, using the power from a dead time earlier. With `max_hr`, the rise
+    above resting flattens out towards it, so the rider responds less to
+    power the harder they're working.
+    """
+
+    def __init__(
+        self,
+        model: RiderModel = DEFAULT_MODEL,
+        noise: float = 1.0,
+        drift_per_hour: float = 0.0,
+        rng: Optional[random.Random] = None,
+        max_hr: Optional[float] = None,
+    ):
+        self.model = model
+        self._noise = noise
+        self._max_hr = max_hr
+        self._drift_per_hour = drift_per_hour
+        self._rng = rng or random.Random()
+        self._powers: deque = deque()
+        self._started: Optional[float] = None
+        self._last_time: Optional[float] = None
+        self._hr = model.offset
+
+    def add_power(self, timestamp: float, watts: float):
+        self._powers.append((timestamp, watts))
+
+    def _delayed_power(self, timestamp: float) -> float:
+        cutoff = timestamp - self.model.dead_time
+        powers = self._powers
+        # Keep the newest sample at or before the cutoff, drop older ones
+        while len(powers) > 1 and powers[1][0] <= cutoff:
+            powers.popleft()
+        if not powers or powers[0][0] > cutoff:
+            return 0.0
+        return powers[0][1]
+
+    def heart_rate(self, timestamp: float) -> float:
+        model = self.model
+        if self._started is None:
+            self._started = self._last_time = timestamp
+        dt = timestamp - self._last_time
+        self._last_time = timestamp
+        drift = self._drift_per_hour * (timestamp - self._started) / 3600
+        rise = model.gain * self._delayed_power(timestamp)
+        if self._max_hr is not None:
+            headroom = self._max_hr - model.offset
+            rise = headroom * (1 - math.exp(-rise / headroom))
+        steady = model.offset + drift + rise
+        self._hr += (steady - self._hr) * (1 - math.exp(-dt / model.time_constant))
+        return self._hr + self._rng.gauss(0, self._noise)
+
+
+class SimulatedClient:
+    """Stands in for `BleakClient`."""
+
+    def __init__(
+        self,
+        address: str,
+        link: LinkConditions,
+        rng: Optional[random.Random] = None,
+        disconnected_callback: Optional[Callable] = None,
+    ):
+        self.address = address
+        self.link = link
+        self._rng = rng or random.Random()
+        self._disconnected_callback = disconnected_callback
+        self._connected = False
+        self._callbacks: Dict[str, Callable] = {}
+        self._notify_task: Optional[asyncio.Task] = None
+        self._last_delivery = 0.0
+        self._last_write = 0.0
+        self.stats = dict.fromkeys(
+            ("notifications", "lost", "writes", "retries", "disconnects"), 0
+        )
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.link.connect_time)
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        if self._connected:
+            self._drop(notify=False)
+        return True
+
+    def drop_connection(self):
+        """Lose the link as if the device went out of range."""
+        if self._connected:
+            self._drop(notify=True)
+
+    def _drop(self, notify: bool):
+        self._connected = False
+        self._callbacks.clear()
+        if self._notify_task is not None:
+            self._notify_task.cancel()
+            self._notify_task = None
+        if notify:
+            self.stats["disconnects"] += 1
+            logger.info(f"Simulated {self.address} disconnected")
+            if self._disconnected_callback is not None:
+                self._disconnected_callback(self)
+
+    async def start_notify(self, uuid: str, callback: Callable, **kwargs):
+        if not self._connected:
+            raise BleakError(f"{self.address} is not connected")
+        self._callbacks[uuid] = callback
+        if self._notify_task is None:
+            self._notify_task = asyncio.get_running_loop().create_task(
+                self._notify_loop()
+            )
+
+    async def stop_notify(self, uuid: str):
+        self._callbacks.pop(uuid, None)
+
+    async def write_gatt_char(self, uuid: str, data, response: bool = False):
+        if not self._connected:
+            raise BleakError(f"{self.address} is not connected")
+        self.stats["writes"] += 1
+        await self._write_delay()
+        if self._rng.random() < self.link.loss:
+            if not response:
+                return
+            # Unacknowledged, so the stack sends it again
+            self.stats["retries"] += 1
+            await self._write_delay()
+        if self._connected:
+            self._on_write(uuid, bytes(data))
+
+    async def _write_delay(self):
+        # Like notifications, pipelined writes land in the order they were sent
+        loop = asyncio.get_running_loop()
+        done_at = max(loop.time() + self.link.sample_latency(self._rng), self._last_write)
+        self._last_write = done_at
+        await asyncio.sleep(done_at - loop.time())
+
+    def _on_write(self, uuid: str, data: bytes):
+        pass
+
+    def _next_notification(self, now: float):
+        """(uuid, data) to send this period, or None."""
+        return None
+
+    async def _notify_loop(self):
+        loop = asyncio.get_running_loop()
+        period = 1 / self.link.notify_rate_hz
+        next_send = loop.time()
+        while self._connected:
+            if self._rng.random() < self.link.disconnect_rate * period:
+                self.drop_connection()
+                return
+            notification = self._next_notification(time())
+            if notification is not None:
+                self._send(loop, *notification)
+            next_send += period
+            await asyncio.sleep(max(next_send - loop.time(), 0))
+
+    def _send(self, loop, uuid: str, data: bytes):
+        callback = self._callbacks.get(uuid)
+        if callback is None:
+            return
+        self.stats["notifications"] += 1
+        if self._rng.random() < self.link.loss:
+            self.stats["lost"] += 1
+            return
+        # Notifications on one link arrive in the order they were sent
+        deliver_at = max(
+            loop.time() + self.link.sample_latency(self._rng), self._last_delivery
+        )
+        self._last_delivery = deliver_at
+        loop.call_at(deliver_at, self._deliver, loop, uuid, callback, data)
+
+    def _deliver(self, loop, uuid, callback, data):
+        if not self._connected:
+            return
+        result = callback(uuid, bytearray(data))
+        if asyncio.iscoroutine(result):
+            loop.create_task(result)
+
+
+class SimulatedHRM(SimulatedClient):
+    """Heart Rate Measurements with RR intervals, from a `RiderPhysiology`."""
+
+    def __init__(self, address: str, link: LinkConditions, physiology: RiderPhysiology, **kwargs):
+        super().__init__(address, link, **kwargs)
+        self._physiology = physiology
+        self._last_beat: Optional[float] = None
+
+    def _next_notification(self, now):
+        hr = min(max(self._physiology.heart_rate(now), 30), 250)
+        beat = 60 / hr
+        if self._last_beat is None:
+            self._last_beat = now - beat
+        # An interval for every beat since the last notification, as a strap
+        # sends them, so they add up to the time that has passed
+        beats = 0
+        while self._last_beat + beat <= now:
+            self._last_beat += beat
+            beats += 1
+        rr = int(round(beat / RR_INTERVAL_UNIT))
+        flags = 0x10 if beats else 0x00
+        data = bytes((flags, int(round(hr)))) + struct.pack(f"<{beats}H", *([rr] * beats))
+        return HR_MEASUREMENT_UUID, data
+
+
+class SimulatedTrainer(SimulatedClient):
+    """
+    An FE-C trainer in ERG mode.
+
+    Alternates the general FE data and specific trainer data pages on the
+    read characteristic, and follows target power pages written to it.
+    Requests for page 71 are answered in the next message slot.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        link: LinkConditions,
+        physiology: RiderPhysiology,
+        cadence: int = 85,
+        power_noise: float = 5.0,
+        **kwargs,
+    ):
+        super().__init__(address, link, **kwargs)
+        self._physiology = physiology
+        self.cadence = cadence
+        self._power_noise = power_noise
+        self.target_power = 0.0
+        self.power = 0.0
+        self.user_configuration: Optional[tuple] = None
+        # The last control page taken, for page 71
+        self._last_command = 0xFF
+        self._command_sequence = 0
+        self._command_data = bytes((0xFF,) * 4)
+        self._status_requests = 0
+        self._last_step: Optional[float] = None
+        self._started: Optional[float] = None
+        self._pages_sent = 0
+        self._event_count = 0
+        self._accumulated_power = 0
+        self._distance = 0.0
+
+    def _on_write(self, uuid, data):
+        if uuid != TACX_FEC_WRITE_UUID:
+            return
+        page = data[PAYLOAD_OFFSET]
+        if page == DATA_PAGE_REQUEST_PAGE:
+            # Transmission count is in the low 7 bits, then the page wanted
+            if data[PAYLOAD_OFFSET + 6] == COMMAND_STATUS_PAGE:
+                self._status_requests += data[PAYLOAD_OFFSET + 5] & 0x7F
+            return
+        if page == TARGET_POWER_PAGE:
+            raw = _TARGET_POWER_PAGE.unpack_from(data, PAYLOAD_OFFSET)[-1]
+            self.target_power = raw * TARGET_POWER_UNIT
+        elif page == USER_CONFIGURATION_PAGE:
+            self.user_configuration = _USER_CONFIGURATION.unpack_from(
+                data, FIELDS_OFFSET
+            )
+        else:
+            return
+        self._last_command = page
+        self._command_sequence = (self._command_sequence + 1) & 0xFF
+        self._command_data = bytes(data[PAYLOAD_OFFSET + 4 : PAYLOAD_OFFSET + 8])
+
+    def _step(self, now):
+        if self._last_step is None:
+            self._started = self._last_step = now
+        dt = now - self._last_step
+        self._last_step = now
+        self.power += (self.target_power - self.power) * (
+            1 - math.exp(-dt / ERG_TIME_CONSTANT_S)
+        )
+        self._distance += (self.power / DRAG_COEFFICIENT) ** (1 / 3) * dt
+        self._physiology.add_power(now, self.power)
+
+    def _next_notification(self, now):
+        self._step(now)
+        if self._status_requests:
+            self._status_requests -= 1
+            payload = _COMMAND_STATUS_PAGE.pack(
+                COMMAND_STATUS_PAGE,
+                self._last_command,
+                self._command_sequence,
+                COMMAND_PASS,
+                self._command_data,
+            )
+            return TACX_FEC_READ_UUID, build_fec_message(payload)
+        self._pages_sent += 1
+        if self._pages_sent % 2:
+            watts = int(min(max(self.power + self._rng.gauss(0, self._power_noise), 0), 4094))
+            self._event_count = (self._event_count + 1) & 0xFF
+            self._accumulated_power = (self._accumulated_power + watts) & 0xFFFF
+            payload = _TRAINER_PAGE.pack(
+                SPECIFIC_TRAINER_DATA_PAGE,
+                self._event_count,
+                self.cadence,
+                self._accumulated_power,
+                watts,
+                FE_STATE_IN_USE << 4,
+            )
+        else:
+            speed = (self.power / DRAG_COEFFICIENT) ** (1 / 3)
+            payload = _GENERAL_FE_PAGE.pack(
+                GENERAL_FE_DATA_PAGE,
+                FE_TYPE_TRAINER,
+                int((now - self._started) / ELAPSED_TIME_UNIT) & 0xFF,
+                int(self._distance) & 0xFF,
+                int(speed / SPEED_UNIT),
+                0xFF,  # HR isn't known to the trainer
+                FE_STATE_IN_USE << 4,
+            )
+        return TACX_FEC_READ_UUID, build_fec_message(payload)
+
+
+class SimulatedRide:
+    """
+    A simulated rider, HRM and trainer sharing one physiology.
+
+    `set_up_hr` and `set_up_trainer` mirror their counterparts in `devices`,
+    so the simulator can be dropped in wherever those are used.
+    """
+
+    def __init__(
+        self,
+        model: RiderModel = DEFAULT_MODEL,
+        hr_link: Optional[LinkConditions] = None,
+        trainer_link: Optional[LinkConditions] = None,
+        seed: Optional[int] = None,
+        **physiology_kwargs,
+    ):
+        self._rng = random.Random(seed)
+        self.physiology = RiderPhysiology(model, rng=self._rng, **physiology_kwargs)
+        self.hr_link = hr_link or LinkConditions(notify_rate_hz=1)
+        self.trainer_link = trainer_link or LinkConditions(notify_rate_hz=4)
+
+    async def set_up_hr(self, uuid=SIM_HRM_ADDRESS) -> SimulatedHRM:
+        logger.info("Connecting to simulated heart rate monitor")
+        hr_client = SimulatedHRM(uuid, self.hr_link, self.physiology, rng=self._rng)
+        await hr_client.connect()
+        return hr_client
+
+    async def set_up_trainer(self, uuid=SIM_TRAINER_ADDRESS) -> FecTransport:
+        logger.info("Connecting to simulated trainer")
+        client = SimulatedTrainer(uuid, self.trainer_link, self.physiology, rng=self._rng)
+        await client.connect()
+        return FecTransport(client, TACX_FEC_WRITE_UUID)
+
+
+async def _ride(seconds: float):
+    from controller import Giger
+    from sysid import pid_gains
+
+    ride = SimulatedRide()
+    giger = Giger(None, None, remember_devices=False)
+    giger.set_gains(*pid_gains(ride.physiology.model))
+    await giger.set_hr_client(await ride.set_up_hr())
+    await giger.set_trainer_control(await ride.set_up_trainer())
+    giger.start()
+    started = time()
+    while time() - started < seconds:
+        await asyncio.sleep(10)
+        print(
+            f"{time() - started:6.0f} s  HR {giger.current_hr:3d} / {giger.hr_setpoint}"
+            f"  power {giger.current_pid_control_power:4.0f} W"
+        )
+    for client in (giger.hr_client, giger.trainer_control._client):
+        print(f"{client.address}: {client.stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_ride(float(sys.argv[1]) if len(sys.argv) > 1 else 600))
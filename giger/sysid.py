@@ -0,0 +1,196 @@
+"""
+Rider HR-response identification from recorded sessions.
+
+Fits a first-order-plus-dead-time model, HR responding to power with a
+gain (bpm/W), a time constant and a dead time, and derives starting PID
+gains from it.
+
+    python sysid.py rides/*.giger
+"""
+import math
+import sys
+from collections import namedtuple
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from analytics import open_session
+from loguru import logger
+from settings import settings
+
+RiderModel = namedtuple(
+    "RiderModel", ["gain", "time_constant", "dead_time", "offset", "r_squared"]
+)
+
+MAX_DEAD_TIME_S = 90
+DEAD_TIME_SEARCH_S = 10
+MIN_FIT_SAMPLES = 600
+MIN_CLOSED_LOOP_TIME_CONSTANT_S = 10
+# Rides are fitted at this rate whatever they were recorded at. Faster, HR
+# barely moves between samples next to its noise, which biases the time
+# constant and gain low and the dead time high
+FIT_RATE_HZ = 1.0
+
+
+def _bin_means(values: np.ndarray, bins: np.ndarray) -> np.ndarray:
+    valid = ~np.isnan(values)
+    size = int(bins[-1]) + 1
+    counts = np.bincount(bins[valid], minlength=size)
+    sums = np.bincount(bins[valid], values[valid], minlength=size)
+    with np.errstate(invalid="ignore"):
+        # Bins with no valid samples come out NaN
+        return sums / counts
+
+
+def resample_for_fit(hr, power, rate_hz: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    `hr` and `power` at FIT_RATE_HZ: averaged over each period when recorded
+    faster, interpolated when slower. NaNs are left out of the averages.
+    """
+    hr = np.asarray(hr, dtype=np.float64)
+    power = np.asarray(power, dtype=np.float64)
+    if rate_hz == FIT_RATE_HZ or not len(hr):
+        return hr, power
+    times = np.arange(len(hr)) / rate_hz
+    if rate_hz < FIT_RATE_HZ:
+        grid = np.arange(0, len(hr) / rate_hz, 1 / FIT_RATE_HZ)
+        return np.interp(grid, times, hr), np.interp(grid, times, power)
+    bins = (times * FIT_RATE_HZ).astype(np.int64)
+    return _bin_means(hr, bins), _bin_means(power, bins)
+
+
+def estimate_dead_time(hr: np.ndarray, power: np.ndarray, rate_hz: float) -> float:
+    """
+    Dead time from the FFT cross-correlation of HR and power changes.
+
+    Differencing turns each power step into an impulse, and a first-order
+    response to an impulse is largest right after the dead time.
+    """
+    dhr = np.diff(hr)
+    dpower = np.diff(power)
+    n = len(dhr)
+    size = 1 << (2 * n - 1).bit_length()
+    xcorr = np.fft.irfft(
+        np.fft.rfft(dhr, size) * np.conj(np.fft.rfft(dpower, size)), size
+    )
+    max_lag = min(int(MAX_DEAD_TIME_S * rate_hz), n - 1)
+    return float(np.argmax(xcorr[: max_lag + 1]) / rate_hz)
+
+
+def _fit_arx(hr: np.ndarray, power: np.ndarray, delay: int) -> Tuple[np.ndarray, float]:
+    # hr[k] = a * hr[k-1] + b * power[k-1-delay] + c, solved in one lstsq
+    start = delay + 1
+    y = hr[start:]
+    design = np.column_stack(
+        (hr[start - 1 : -1], power[: len(power) - start], np.ones(len(y)))
+    )
+    coefficients, residuals, *_ = np.linalg.lstsq(design, y, rcond=None)
+    residual = float(residuals[0]) if len(residuals) else float(
+        np.sum((design @ coefficients - y) ** 2)
+    )
+    return coefficients, residual
+
+
+def _refine_iv(hr: np.ndarray, power: np.ndarray, delay: int, coefficients) -> np.ndarray:
+    """
+    One instrumental-variable pass over the least-squares fit.
+
+    Plain least squares biases the time constant and gain low when HR is
+    noisy or quantized; using the noise-free simulated HR as the instrument
+    for hr[k-1] removes most of that bias.
+    """
+    a, b, c = coefficients
+    driven = b * power + c
+    simulated = np.empty_like(hr)
+    simulated[: delay + 1] = hr[: delay + 1]
+    for k in range(delay + 1, len(hr)):
+        simulated[k] = a * simulated[k - 1] + driven[k - 1 - delay]
+    start = delay + 1
+    y = hr[start:]
+    inputs = power[: len(power) - start]
+    ones = np.ones(len(y))
+    design = np.column_stack((hr[start - 1 : -1], inputs, ones))
+    instruments = np.column_stack((simulated[start - 1 : -1], inputs, ones))
+    return np.linalg.solve(instruments.T @ design, instruments.T @ y)
+
+
+def fit_rider_model(hr: np.ndarray, power: np.ndarray, rate_hz: float = 1) -> RiderModel:
+    hr, power = resample_for_fit(hr, power, rate_hz)
+    rate_hz = FIT_RATE_HZ
+    valid = ~(np.isnan(hr) | np.isnan(power))
+    hr = np.asarray(hr[valid], dtype=np.float64)
+    power = np.asarray(power[valid], dtype=np.float64)
+    if len(hr) < MIN_FIT_SAMPLES:
+        raise ValueError(f"Need at least {MIN_FIT_SAMPLES} samples to fit, got {len(hr)}")
+
+    # Refine the correlation estimate with a small least-squares search
+    guess = int(round(estimate_dead_time(hr, power, rate_hz) * rate_hz))
+    window = int(DEAD_TIME_SEARCH_S * rate_hz)
+    candidates = range(max(guess - window, 0), guess + window + 1)
+    delay, (coefficients, residual) = min(
+        ((d, _fit_arx(hr, power, d)) for d in candidates), key=lambda fit: fit[1][1]
+    )
+    a, b, c = _refine_iv(hr, power, delay, coefficients)
+    if not 0 < a < 1 or b <= 0:
+        raise ValueError("Ride does not excite a usable HR response to power")
+
+    dt = 1 / rate_hz
+    variance = float(np.sum((hr[delay + 1 :] - hr[delay + 1 :].mean()) ** 2))
+    return RiderModel(
+        gain=float(b / (1 - a)),
+        time_constant=float(-dt / math.log(a)),
+        dead_time=delay * dt,
+        offset=float(c / (1 - a)),
+        r_squared=1 - residual / variance if variance else 0.0,
+    )
+
+
+def fit_session(path: str) -> RiderModel:
+    metadata, rows = open_session(path)
+    return fit_rider_model(rows["hr"], rows["power"], metadata.get("rate_hz", 1))
+
+
+def fit_sessions(paths: Iterable[str]) -> RiderModel:
+    """Median of the per-ride fits, skipping rides that can't be fitted."""
+    models = []
+    for path in paths:
+        try:
+            models.append(fit_session(path))
+        except ValueError as e:
+            logger.info(f"Skipping {path}: {e}")
+    if not models:
+        raise ValueError("No session could be fitted")
+    return RiderModel(*np.median(np.array(models), axis=0).tolist())
+
+
+def pid_gains(
+    model: RiderModel, closed_loop_time_constant: Optional[float] = None
+) -> Tuple[float, float, float]:
+    """
+    SIMC PI tuning for a first-order-plus-dead-time process.
+
+    The closed-loop time constant defaults to the dead time (but at least
+    10 s), the usual "tight but robust" choice; larger values give gentler
+    power changes.
+    """
+    tau_c = closed_loop_time_constant or max(
+        model.dead_time, MIN_CLOSED_LOOP_TIME_CONSTANT_S
+    )
+    kp = model.time_constant / (model.gain * (tau_c + model.dead_time))
+    integral_time = min(model.time_constant, 4 * (tau_c + model.dead_time))
+    return kp, kp / integral_time, 0.0
+
+
+def starting_gains(default: Tuple[float, float, float]) -> Tuple[float, float, float]:
+    """Gains derived from the current rider's stored model, or `default`."""
+    model = settings.rider_model
+    if model is None:
+        return default
+    return pid_gains(RiderModel(**model))
+
+
+if __name__ == "__main__":
+    model = fit_sessions(sys.argv[1:])
+    settings.rider_model = model._asdict()
+    kp, ki, kd = pid_gains(model)
+    print(f"{settings.rider_name}: {model}")
+    print(f"Starting gains: Kp={kp:.3f} Ki={ki:.4f} Kd={kd:.3f}")
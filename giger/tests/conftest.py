@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules import each other flat, as when run from giger/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def _isolated_settings(tmp_path, monkeypatch):
+    # settings is a shelve in the working directory; keep tests out of the real one
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,63 @@
+import math
+import random
+
+import pytest
+from adaptive import AdaptiveModel
+from sysid import RiderModel
+
+TRUE_MODEL = RiderModel(gain=0.3, time_constant=60.0, dead_time=10.0, offset=80.0, r_squared=0.0)
+START_MODEL = RiderModel(gain=0.15, time_constant=30.0, dead_time=10.0, offset=70.0, r_squared=0.0)
+
+
+def simulated_ride(sample_times, seed=1):
+    """HR and power at `sample_times` from a rider stepping between powers."""
+    rng = random.Random(seed)
+    step = 0.05
+    hr = TRUE_MODEL.offset
+    delay = int(TRUE_MODEL.dead_time / step)
+    powers = [0.0] * delay
+    watts, next_change = 0.0, 0.0
+    samples = []
+    t = 0.0
+    for sample_time in sample_times:
+        while t < sample_time:
+            if t >= next_change:
+                watts = rng.uniform(100, 300)
+                next_change = t + rng.uniform(60, 180)
+            powers.append(watts)
+            driving = TRUE_MODEL.offset + TRUE_MODEL.gain * powers[-1 - delay]
+            hr += (driving - hr) * (1 - math.exp(-step / TRUE_MODEL.time_constant))
+            t += step
+        samples.append((sample_time, hr, watts))
+    return samples
+
+
+@pytest.mark.parametrize("period", [0.25, 1.0, 1.7])
+def test_time_constant_independent_of_sample_rate(period):
+    times = [period * k for k in range(int(3600 / period))]
+    adaptive = AdaptiveModel(START_MODEL)
+    for timestamp, hr, power in simulated_ride(times):
+        adaptive.update(timestamp, hr, power)
+    assert adaptive.model.time_constant == pytest.approx(TRUE_MODEL.time_constant, rel=0.2)
+    assert adaptive.model.gain == pytest.approx(TRUE_MODEL.gain, rel=0.2)
+
+
+def test_irregular_samples():
+    rng = random.Random(2)
+    times, t = [], 0.0
+    while t < 3600:
+        times.append(t)
+        t += rng.uniform(0.3, 2.0)
+    adaptive = AdaptiveModel(START_MODEL)
+    for timestamp, hr, power in simulated_ride(times):
+        adaptive.update(timestamp, hr, power)
+    assert adaptive.model.time_constant == pytest.approx(TRUE_MODEL.time_constant, rel=0.2)
+
+
+def test_long_gap_restarts_history():
+    adaptive = AdaptiveModel(START_MODEL)
+    for k in range(30):
+        adaptive.update(k, 100.0, 150.0)
+    samples = adaptive.samples
+    adaptive.update(100.0, 120.0, 150.0)
+    assert adaptive.samples == samples
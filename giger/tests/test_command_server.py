@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+from _types import CommandsApplied
+from bleak.exc import BleakError
+from command_server import CommandServer
+from controller import Giger
+from event_bus import EventBus
+
+
+class BrokenTrainer:
+    async def set_target_power(self, watts):
+        raise BleakError("Not connected")
+
+
+def make_giger():
+    return Giger(None, None, remember_devices=False, min_power=50, max_power=300)
+
+
+def request(server, commands, request_id=1):
+    line = json.dumps({"id": request_id, "commands": commands}).encode()
+    return asyncio.run(server._handle_line(line))
+
+
+def test_failed_trainer_write_is_replied_to():
+    giger = make_giger()
+    giger.trainer_control = BrokenTrainer()
+    response = request(CommandServer(giger), {"power": 200})
+    assert response["ok"] is False
+    assert "Not connected" in response["error"]
+
+
+def test_bools_are_rejected():
+    giger = make_giger()
+    giger.trainer_control = BrokenTrainer()
+    giger._is_running = True
+    response = request(CommandServer(giger), {"power": True})
+    assert response["ok"] is False
+    assert giger._is_running
+
+
+def test_connection_survives_a_failed_request(tmp_path):
+    giger = make_giger()
+    giger.trainer_control = BrokenTrainer()
+    address = f"unix:{tmp_path / 'giger.sock'}"
+
+    async def run():
+        server = CommandServer(giger, address)
+        await server.start()
+        reader, writer = await asyncio.open_unix_connection(str(tmp_path / "giger.sock"))
+        replies = []
+        for request_id, commands in ((1, {"power": 200}), (2, {"target_hr": 150})):
+            writer.write(json.dumps({"id": request_id, "commands": commands}).encode() + b"\n")
+            await writer.drain()
+            replies.append(json.loads(await reader.readline()))
+        writer.close()
+        await server.stop()
+        return replies
+
+    failed, applied = asyncio.run(run())
+    assert (failed["id"], failed["ok"]) == (1, False)
+    assert (applied["id"], applied["ok"]) == (2, True)
+    assert applied["applied"]["target_hr"] == 150
+
+
+def test_applied_commands_are_published():
+    published = []
+
+    async def run():
+        bus = EventBus(asyncio.get_running_loop())
+        bus.subscribe("test", published.append, CommandsApplied)
+        giger = Giger(None, None, remember_devices=False, event_bus=bus)
+        await giger.apply_commands({"target_hr": 145})
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert [event.state["target_hr"] for event in published] == [145]
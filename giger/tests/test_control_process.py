@@ -0,0 +1,28 @@
+import multiprocessing
+
+from control_process import ControlProcess, TelemetryRing
+
+
+def test_ring_reads_only_unlapped_records():
+    ring = TelemetryRing(capacity=4)
+    try:
+        for i in range(6):
+            ring.write(float(i), 0, 0, 0, 0, 0)
+        count, records = ring.read_since(1)
+        # The slot being written next is never returned
+        assert count == 6
+        assert [record[0] for record in records] == [3.0, 4.0, 5.0]
+        assert ring.read_since(count) == (6, [])
+    finally:
+        ring.close()
+
+
+def test_shutdown_after_the_child_exited():
+    control = ControlProcess("unused")
+    control._process = multiprocessing.get_context("spawn").Process(target=int)
+    control._process.start()
+    control._process.join()
+    control._conn, child_conn = multiprocessing.Pipe()
+    child_conn.close()
+    control.shutdown()
+    assert not control._process.is_alive()
@@ -0,0 +1,88 @@
+import asyncio
+import math
+
+import pytest
+from controller import CONTROL_MODES, Giger
+
+
+def make_giger(**kwargs):
+    kwargs.setdefault("remember_devices", False)
+    return Giger(None, None, **kwargs)
+
+
+def test_power_limits_applied_as_a_pair():
+    giger = make_giger(min_power=50, max_power=300)
+    state = asyncio.run(giger.apply_commands({"min_power": 320, "max_power": 400}))
+    assert (state["min_power"], state["max_power"]) == (320, 400)
+    assert giger.pid.output_limits == (320, 400)
+
+
+@pytest.mark.parametrize(
+    "commands",
+    [{"min_power": 400}, {"kp": "nan"}, {"max_power": math.inf}, {"ki": 1, "kd": "-inf"}],
+)
+def test_rejected_batch_changes_nothing(commands):
+    giger = make_giger(min_power=50, max_power=300)
+    before = giger.state
+    with pytest.raises(ValueError):
+        asyncio.run(giger.apply_commands(commands))
+    assert giger.state == before
+    assert giger.pid.output_limits == (50, 300)
+
+
+class FakeClient:
+    def __init__(self, address, on_connect=None):
+        self.address = address
+        self.is_connected = False
+        self._on_connect = on_connect
+
+    async def connect(self):
+        if self._on_connect is not None:
+            await self._on_connect()
+        self.is_connected = True
+
+    async def start_notify(self, uuid, handler):
+        pass
+
+    async def disconnect(self):
+        self.is_connected = False
+
+
+class FakeTrainerControl:
+    def __init__(self, client):
+        self._client = client
+        self.writes = []
+
+    async def set_target_power(self, watts):
+        self.writes.append(watts)
+
+
+def test_new_trainer_takes_the_power_written_while_it_connected():
+    giger = make_giger()
+
+    async def run():
+        old = FakeTrainerControl(FakeClient("old"))
+        await giger.set_trainer_control(old)
+        await giger.set_current_power(150)
+
+        async def write_to_old_trainer():
+            await giger.set_current_power(180)
+
+        new = FakeTrainerControl(FakeClient("new", write_to_old_trainer))
+        await giger.set_trainer_control(new)
+        return old, new
+
+    old, new = asyncio.run(run())
+    assert old.writes[-1] == 180
+    assert new.writes[-1] == 180
+    assert giger.last_written_power == 180
+
+
+def test_restore_without_a_gain_schedule_falls_back_to_pid():
+    giger = make_giger(min_power=50, max_power=300)
+    checkpoint = giger.checkpoint()._replace(
+        control_mode=CONTROL_MODES.index("scheduled"), min_power=320, max_power=400
+    )
+    giger.restore(checkpoint)
+    assert giger.control_mode == "pid"
+    assert giger.pid.output_limits == (320, 400)
@@ -0,0 +1,331 @@
+import asyncio
+import struct
+
+import fec_transport
+import pytest
+from devices import TACX_FEC_READ_UUID, TACX_FEC_WRITE_UUID
+from fec import (
+    ANT_ACKNOWLEDGED_DATA,
+    COMMAND_PASS,
+    COMMAND_REJECTED,
+    COMMAND_STATUS_PAGE,
+    DATA_PAGE_REQUEST_PAGE,
+    GENERAL_FE_DATA_PAGE,
+    PAYLOAD_OFFSET,
+    SPECIFIC_TRAINER_DATA_PAGE,
+    TARGET_POWER_PAGE,
+    USER_CONFIGURATION_PAGE,
+    FecTelemetry,
+    build_fec_message,
+    commanded_target_power,
+    data_page_request,
+    decode_fec_message,
+    quantize_target_power,
+    target_power_page,
+)
+from fec_transport import MAX_TARGET_RETRIES, FecTransport
+from ramp import PowerRamp
+from sim import LinkConditions, RiderPhysiology, SimulatedTrainer
+
+WRITE_UUID = "write"
+SETTLE_S = 0.02
+
+
+@pytest.fixture(autouse=True)
+def _quick_readback(monkeypatch):
+    monkeypatch.setattr(fec_transport, "READBACK_SETTLE_S", SETTLE_S)
+
+
+def general_fe_page(elapsed, distance, speed=5000, hr=140):
+    return struct.pack("<BBBBHBB", GENERAL_FE_DATA_PAGE, 25, elapsed, distance, speed, hr, 0x30)
+
+
+def command_status(status, watts, timestamp=0.0):
+    # Page 49's last two data bytes, the target, are echoed at the top of page 71's
+    payload = struct.pack(
+        "<BBBBI", COMMAND_STATUS_PAGE, TARGET_POWER_PAGE, 0xFF, status, int(watts * 4) << 16
+    )
+    return decode_fec_message(build_fec_message(payload), timestamp)
+
+
+def test_build_message_checksum():
+    message = build_fec_message(target_power_page(200), ANT_ACKNOWLEDGED_DATA)
+    assert message[:4] == bytes((0xA4, 9, ANT_ACKNOWLEDGED_DATA, 0x05))
+    checksum = 0
+    for byte in message:
+        checksum ^= byte
+    assert checksum == 0
+
+
+def test_target_power_page():
+    page = target_power_page(250)
+    assert len(page) == 8
+    assert page[0] == TARGET_POWER_PAGE
+    assert struct.unpack_from("<H", page, 6)[0] == 1000
+
+
+def test_data_page_request():
+    page = data_page_request(COMMAND_STATUS_PAGE)
+    assert len(page) == 8
+    assert (page[0], page[6], page[7]) == (DATA_PAGE_REQUEST_PAGE, COMMAND_STATUS_PAGE, 1)
+
+
+def test_decode_trainer_data():
+    payload = struct.pack(
+        "<BBBHHB", SPECIFIC_TRAINER_DATA_PAGE, 7, 90, 12345, (2 << 12) | 250, 0x30
+    )
+    record = decode_fec_message(build_fec_message(payload), 1.0)
+    assert record.cadence == 90
+    assert record.accumulated_power == 12345
+    assert record.instantaneous_power == 250
+    assert record.trainer_status == 2
+    assert record.fe_state == 3
+
+
+def test_decode_rejects_other_messages():
+    assert decode_fec_message(b"\xa4\x09", 0.0) is None
+    message = bytearray(build_fec_message(target_power_page(100)))
+    assert decode_fec_message(message, 0.0) is None
+    message[0] = 0
+    assert decode_fec_message(message, 0.0) is None
+
+
+def test_commanded_target_power():
+    status = command_status(COMMAND_PASS, 210)
+    assert status.last_command == TARGET_POWER_PAGE
+    assert commanded_target_power(status) == 210
+    assert commanded_target_power(status._replace(last_command=USER_CONFIGURATION_PAGE)) is None
+
+
+def test_telemetry_accumulates_across_rollovers():
+    telemetry = FecTelemetry(capacity=2)
+    for elapsed, distance in ((250, 250), (4, 10), (8, 20)):
+        telemetry.decode(build_fec_message(general_fe_page(elapsed, distance)), 0.0)
+    assert telemetry.elapsed_time == pytest.approx((10 + 4) * 0.25)
+    assert telemetry.distance == 16 + 10
+    assert [r.elapsed_time for r in telemetry.history(GENERAL_FE_DATA_PAGE)] == [4, 8]
+    assert telemetry.latest(GENERAL_FE_DATA_PAGE).distance == 20
+
+
+def test_telemetry_reads_only_what_is_new():
+    telemetry = FecTelemetry(capacity=2)
+    cursor, records = telemetry.read_since(GENERAL_FE_DATA_PAGE, 0)
+    assert (cursor, records) == (0, [])
+    for elapsed in (1, 2, 3):
+        telemetry.decode(build_fec_message(general_fe_page(elapsed, 0)), 0.0)
+    cursor, records = telemetry.read_since(GENERAL_FE_DATA_PAGE, cursor)
+    # The first was overwritten before it was read
+    assert cursor == 3
+    assert [r.elapsed_time for r in records] == [2, 3]
+    telemetry.decode(build_fec_message(general_fe_page(4, 0)), 0.0)
+    cursor, records = telemetry.read_since(GENERAL_FE_DATA_PAGE, cursor)
+    assert [r.elapsed_time for r in records] == [4]
+
+
+class FakeTrainer:
+    """Collects writes, holding each until `release` when `hold` is set."""
+
+    def __init__(self, hold=False, ignore=0, status=COMMAND_PASS):
+        self.pages = []
+        self.hold = hold
+        # Target power writes to ignore before applying them
+        self.ignore = ignore
+        self.status = status
+        self.transport = None
+        self._released = asyncio.Event()
+        self.target = None
+
+    def release(self):
+        self._released.set()
+
+    async def write_gatt_char(self, uuid, message, response=True):
+        page = message[PAYLOAD_OFFSET]
+        self.pages.append(page)
+        if self.hold:
+            await self._released.wait()
+        if page == TARGET_POWER_PAGE and self.ignore:
+            self.ignore -= 1
+        elif page == TARGET_POWER_PAGE:
+            self.target = struct.unpack_from("<H", message, PAYLOAD_OFFSET + 6)[0] / 4
+        elif page == DATA_PAGE_REQUEST_PAGE and self.target is not None:
+            status = command_status(self.status, self.target)
+            asyncio.get_running_loop().call_soon(self.transport.on_command_status, status)
+
+
+def make_transport(trainer, **kwargs):
+    transport = FecTransport(trainer, WRITE_UUID, response=False, **kwargs)
+    trainer.transport = transport
+    return transport
+
+
+async def settle(transport):
+    while transport._verifier is not None and not transport._verifier.done():
+        await asyncio.sleep(0.001)
+
+
+def test_queued_targets_are_coalesced():
+    trainer = FakeTrainer(hold=True)
+
+    async def run():
+        transport = make_transport(trainer, max_in_flight=1, verify=False)
+        first = asyncio.ensure_future(transport.set_target_power(100))
+        await asyncio.sleep(0)
+        # The first is in flight; these queue behind it and collapse into one
+        later = [asyncio.ensure_future(transport.set_target_power(w)) for w in (110, 120, 130)]
+        await asyncio.sleep(0)
+        trainer.release()
+        await asyncio.gather(first, *later)
+        return transport
+
+    transport = asyncio.run(run())
+    assert trainer.pages == [TARGET_POWER_PAGE, TARGET_POWER_PAGE]
+    assert trainer.target == 130
+    assert transport.stats.counts["coalesced"] == 2
+    assert transport.stats.counts["writes"] == 2
+
+
+def test_target_power_goes_before_configuration():
+    trainer = FakeTrainer(hold=True)
+
+    async def run():
+        transport = make_transport(trainer, max_in_flight=1, verify=False)
+        first = asyncio.ensure_future(transport.set_target_power(100))
+        await asyncio.sleep(0)
+        config = asyncio.ensure_future(transport.set_user_configuration(75, 8, 0.7, 2.0))
+        target = asyncio.ensure_future(transport.set_target_power(150))
+        await asyncio.sleep(0)
+        trainer.release()
+        await asyncio.gather(first, config, target)
+
+    asyncio.run(run())
+    assert trainer.pages == [TARGET_POWER_PAGE, TARGET_POWER_PAGE, USER_CONFIGURATION_PAGE]
+
+
+def test_readback_verifies_the_target():
+    trainer = FakeTrainer()
+
+    async def run():
+        transport = make_transport(trainer)
+        await transport.set_target_power(200)
+        await settle(transport)
+        return transport
+
+    transport = asyncio.run(run())
+    assert trainer.pages == [TARGET_POWER_PAGE, DATA_PAGE_REQUEST_PAGE]
+    assert transport.applied_power == 200
+    assert transport.stats.counts["verified"] == 1
+    assert "retries" not in transport.stats.counts
+
+
+def test_target_not_applied_is_resent():
+    # The trainer takes it second time round
+    trainer = FakeTrainer(ignore=1)
+
+    async def run():
+        transport = make_transport(trainer)
+        trainer.target = 100
+        await transport.set_target_power(200)
+        await settle(transport)
+        return transport
+
+    transport = asyncio.run(run())
+    assert transport.stats.counts["retries"] == 1
+    assert transport.stats.counts["verified"] == 1
+    assert trainer.target == 200
+
+
+def test_retries_are_bounded():
+    trainer = FakeTrainer(ignore=MAX_TARGET_RETRIES + 1)
+
+    async def run():
+        transport = make_transport(trainer)
+        trainer.target = 100
+        await transport.set_target_power(200)
+        await settle(transport)
+        return transport
+
+    transport = asyncio.run(run())
+    assert transport.stats.counts["retries"] == MAX_TARGET_RETRIES
+    assert trainer.pages.count(TARGET_POWER_PAGE) == MAX_TARGET_RETRIES + 1
+
+
+def test_rejected_target_is_not_retried():
+    trainer = FakeTrainer(status=COMMAND_REJECTED)
+
+    async def run():
+        transport = make_transport(trainer)
+        await transport.set_target_power(200)
+        await settle(transport)
+        return transport
+
+    transport = asyncio.run(run())
+    assert transport.stats.counts["rejected"] == 1
+    assert trainer.pages == [TARGET_POWER_PAGE, DATA_PAGE_REQUEST_PAGE]
+
+
+def test_failed_write_reaches_every_waiter():
+    class FailingTrainer(FakeTrainer):
+        async def write_gatt_char(self, uuid, message, response=True):
+            await super().write_gatt_char(uuid, message, response)
+            raise OSError("gone")
+
+    trainer = FailingTrainer(hold=True)
+
+    async def run():
+        transport = make_transport(trainer, max_in_flight=1, verify=False)
+        first = asyncio.ensure_future(transport.set_target_power(100))
+        await asyncio.sleep(0)
+        later = [asyncio.ensure_future(transport.set_target_power(w)) for w in (110, 120)]
+        await asyncio.sleep(0)
+        trainer.release()
+        return await asyncio.gather(first, *later, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, OSError) for result in results)
+
+
+def test_target_between_quarter_watts_verifies():
+    trainer = FakeTrainer()
+
+    async def run():
+        transport = make_transport(trainer)
+        await transport.set_target_power(200.6)
+        await settle(transport)
+        return transport
+
+    transport = asyncio.run(run())
+    assert quantize_target_power(200.6) == 200.5
+    assert transport.stats.counts["verified"] == 1
+    assert "retries" not in transport.stats.counts
+
+
+def test_ramp_leaves_notification_slots_for_data_pages():
+    link = LinkConditions(notify_rate_hz=100, latency=0.001, jitter=0.0, connect_time=0.0)
+    trainer = SimulatedTrainer("trainer", link, RiderPhysiology())
+    pages = []
+
+    async def run():
+        transport = FecTransport(trainer, TACX_FEC_WRITE_UUID)
+
+        def handler(_, data):
+            record = decode_fec_message(data, 0.0)
+            pages.append(data[PAYLOAD_OFFSET])
+            if data[PAYLOAD_OFFSET] == COMMAND_STATUS_PAGE:
+                transport.on_command_status(record)
+
+        await trainer.connect()
+        await trainer.start_notify(TACX_FEC_READ_UUID, handler)
+        # A new target every 10 ms for 0.4 s, as a ramp sends
+        ramp = PowerRamp(transport.set_target_power, lambda: (0, 1000), 500, period=0.01)
+        ramp.current = 100
+        ramp.set_target(300)
+        await asyncio.sleep(0.5)
+        # Then holding, so the last target is read back
+        await asyncio.sleep(SETTLE_S * 5)
+        await trainer.disconnect()
+        return transport
+
+    transport = asyncio.run(run())
+    assert pages.count(SPECIFIC_TRAINER_DATA_PAGE) > len(pages) / 3
+    assert pages.count(COMMAND_STATUS_PAGE) <= 2
+    assert transport.stats.counts["verified"] == 1
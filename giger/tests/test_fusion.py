@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+import pytest
+from fusion import CLOCK_RESYNC_S, SensorFusion, SensorStream
+
+
+def test_values_are_interpolated():
+    stream = SensorStream()
+    stream.add(10.0, 100.0)
+    stream.add(11.0, 110.0)
+    values = stream.values_at(np.array([10.0, 10.5, 11.0]))
+    assert values.tolist() == [100.0, 105.0, 110.0]
+
+
+def test_nan_before_the_first_sample_and_across_gaps():
+    stream = SensorStream(max_gap=2.0)
+    stream.add(10.0, 100.0)
+    stream.add(20.0, 200.0)
+    stream.add(21.0, 210.0)
+    values = stream.values_at(np.array([9.0, 15.0, 20.5]))
+    assert math.isnan(values[0])
+    assert math.isnan(values[1])
+    assert values[2] == pytest.approx(205.0)
+
+
+def test_last_value_held_until_max_gap():
+    stream = SensorStream(max_gap=2.0)
+    stream.add(10.0, 100.0)
+    values = stream.values_at(np.array([11.0, 13.0]))
+    assert values[0] == 100.0
+    assert math.isnan(values[1])
+
+
+def test_empty_stream_is_nan():
+    assert np.isnan(SensorStream().values_at(np.array([1.0, 2.0]))).all()
+
+
+def test_latency_is_taken_off():
+    stream = SensorStream(latency=0.5)
+    stream.add(10.0, 100.0)
+    assert stream.latest_time == 9.5
+
+
+def test_device_clock_takes_the_smallest_offset():
+    stream = SensorStream()
+    # Measured one a second, delivered 0.3 s then 0.1 s then 0.2 s later
+    for device_time, delay in ((0.0, 0.3), (1.0, 0.1), (2.0, 0.2)):
+        stream.add(100.0 + device_time + delay, device_time, device_time)
+    assert stream.offset == pytest.approx(100.1)
+    assert stream.latest_time == pytest.approx(102.1)
+
+
+def test_device_clock_wraps():
+    stream = SensorStream(wrap=64.0)
+    stream.add(100.0, 1.0, 63.0)
+    stream.add(102.0, 2.0, 1.0)
+    assert stream.latest_time - stream._times[0] == pytest.approx(2.0)
+
+
+def test_device_clock_jump_resyncs():
+    stream = SensorStream()
+    stream.add(100.0, 1.0, 0.0)
+    stream.add(101.0 + CLOCK_RESYNC_S + 1, 2.0, 1.0)
+    assert stream.resyncs == 1
+    assert stream.offset == pytest.approx(100.0 + CLOCK_RESYNC_S + 1)
+
+
+def test_stays_in_order_when_the_offset_moves_back():
+    stream = SensorStream()
+    stream.add(100.5, 1.0, 0.0)
+    stream.add(100.6, 2.0, 0.5)
+    times = stream._times[: stream._count]
+    assert (np.diff(times) > 0).all()
+
+
+def test_oldest_half_dropped_when_full():
+    stream = SensorStream(capacity=4)
+    for k in range(5):
+        stream.add(float(k), float(k))
+    assert stream._count == 3
+    assert stream._times[: stream._count].tolist() == [2.0, 3.0, 4.0]
+
+
+def test_advance_emits_each_grid_point_once():
+    fusion = SensorFusion(rate_hz=2, delay=1.0)
+    for k in range(10):
+        fusion.add("hr", float(k), 120.0 + k)
+        fusion.add("filtered_hr", float(k), 120.0 + k)
+    first = fusion.advance(5.0)
+    second = fusion.advance(5.2)
+    third = fusion.advance(6.0)
+    assert [s.timestamp for s in first] == [4.0]
+    assert second == []
+    assert [s.timestamp for s in third] == [4.5, 5.0]
+    # Stamped 1 s early for HR latency, so the sample that arrived at 6 s
+    assert third[-1].hr == pytest.approx(126.0)
+    assert fusion.latest is third[-1]
+
+
+def test_power_prefers_the_meter():
+    fusion = SensorFusion(rate_hz=1, delay=0.0)
+    for k in range(5):
+        fusion.add("trainer_power", float(k), 200.0)
+    fusion.add("meter_power", 3.0, 210.0)
+    fusion.add("meter_power", 4.0, 210.0)
+    fusion.advance(0.0)
+    samples = fusion.advance(4.0)
+    assert [s.power for s in samples] == [200.0, 200.0, 210.0, 210.0]
+    assert samples[-1].trainer_power == 200.0
+    assert math.isnan(samples[0].meter_power)
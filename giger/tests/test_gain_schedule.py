@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from gain_schedule import fit_local_models, hr_grid, simulate_ride
+
+
+@pytest.fixture(scope="module")
+def ride():
+    return simulate_ride(hours=2, seed=3)
+
+
+def time_constants(models):
+    return {model.time_constant for model in models if model is not None}
+
+
+def upsample(values, factor):
+    times = np.arange(len(values))
+    return np.interp(np.arange(len(values) * factor) / factor, times, values)
+
+
+def test_mixed_rates_fit_like_one_rate(ride):
+    hr, power = ride
+    half = len(hr) // 2
+    single = fit_local_models([(hr, power, 1)], hr_grid())
+    mixed = fit_local_models(
+        [(hr[:half], power[:half], 1), (upsample(hr[half:], 4), upsample(power[half:], 4), 4)],
+        hr_grid(),
+    )
+    (expected,) = time_constants(single)
+    (time_constant,) = time_constants(mixed)
+    assert time_constant == pytest.approx(expected, rel=0.1)
+
+
+def test_rides_that_dont_fit_are_left_out(ride):
+    hr, power = ride
+    # HR falling as power rises: sysid won't fit it
+    inverted = (300 - hr, power, 1)
+    assert fit_local_models([(hr, power, 1), inverted], hr_grid()) == fit_local_models(
+        [(hr, power, 1)], hr_grid()
+    )
+
+
+def test_no_ride_fits(ride):
+    hr, power = ride
+    with pytest.raises(ValueError):
+        fit_local_models([(300 - hr, power, 1)], hr_grid())
@@ -0,0 +1,94 @@
+import pytest
+from hr_filters import (
+    KalmanFilter,
+    MAX_CONSECUTIVE_ARTIFACTS,
+    MedianFilter,
+    RRIntervalFilter,
+    make_hr_filter,
+    parse_hr_measurement,
+)
+
+
+def test_parse_uint8_hr_with_rr_intervals():
+    data = bytearray([0x10, 120, 0x00, 0x02, 0x00, 0x04])
+    hr, rr_intervals = parse_hr_measurement(data)
+    assert hr == 120
+    assert rr_intervals == (0.5, 1.0)
+
+
+def test_parse_uint16_hr_skips_energy_expended():
+    data = bytearray([0x19, 0x2C, 0x01, 0xFF, 0xFF, 0x00, 0x02])
+    hr, rr_intervals = parse_hr_measurement(data)
+    assert hr == 300
+    assert rr_intervals == (0.5,)
+
+
+def test_median_removes_a_dropout():
+    hr_filter = MedianFilter(3)
+    outputs = [hr_filter.update(hr) for hr in (140, 141, 0, 142, 143)]
+    assert 0 not in outputs
+
+
+def test_kalman_gates_a_spike():
+    hr_filter = KalmanFilter()
+    for _ in range(20):
+        hr_filter.update(140)
+    assert hr_filter.update(0) == pytest.approx(140)
+
+
+def test_kalman_follows_a_genuine_step():
+    hr_filter = KalmanFilter()
+    for _ in range(20):
+        hr_filter.update(100)
+    for _ in range(20):
+        estimate = hr_filter.update(160)
+    assert estimate == pytest.approx(160, abs=2)
+
+
+def test_rr_filter_rejects_an_artefact():
+    hr_filter = RRIntervalFilter(beats=4)
+    hr_filter.update(120, (0.5, 0.5, 0.5, 0.5))
+    assert hr_filter.update(120, (0.25,)) == pytest.approx(120)
+
+
+def test_rr_filter_recovers_after_a_step():
+    hr_filter = RRIntervalFilter(beats=4)
+    hr_filter.update(100, (0.6,) * 4)
+    # 100 bpm to 150 bpm is more than the artefact fraction in one go
+    for _ in range(MAX_CONSECUTIVE_ARTIFACTS + 4):
+        hr = hr_filter.update(150, (0.4,))
+    assert hr == pytest.approx(150)
+
+
+def test_rr_filter_recovers_after_a_dropout():
+    hr_filter = RRIntervalFilter(beats=4)
+    hr_filter.update(60, (1.0,) * 4)
+    # Strap off for a while, back on with the rider working much harder
+    for _ in range(10):
+        hr_filter.update(0)
+    for _ in range(MAX_CONSECUTIVE_ARTIFACTS + 4):
+        hr = hr_filter.update(160, (0.375,))
+    assert hr == pytest.approx(160)
+
+
+def test_rr_filter_falls_back_to_reported_hr():
+    assert RRIntervalFilter().update(133) == 133
+
+
+def test_rr_filter_falls_back_when_rr_intervals_stop():
+    hr_filter = RRIntervalFilter(beats=4, timeout=3.0)
+    hr_filter.update(120, (0.5,) * 4)
+    # A notification or two without a beat holds the RR estimate
+    assert hr_filter.update(131) == pytest.approx(120)
+    assert hr_filter.update(132) == pytest.approx(120)
+    assert hr_filter.update(133) == 133
+    assert hr_filter.update(134) == 134
+    # RR intervals coming back are used again straight away
+    assert hr_filter.update(134, (0.4,)) == pytest.approx(150)
+
+
+def test_latency_budget():
+    with pytest.raises(ValueError):
+        make_hr_filter("median", latency_budget=1.0, n=5)
+    with pytest.raises(ValueError):
+        make_hr_filter("bogus")
@@ -0,0 +1,67 @@
+import pytest
+from mmp import MeanMaxPower
+
+
+def ride(mmp, watts, start=0.0):
+    for k, w in enumerate(watts):
+        mmp.add_sample(start + k, w)
+
+
+def test_tracked_durations_are_exact():
+    mmp = MeanMaxPower([1, 5, 10])
+    ride(mmp, [100] * 10 + [300] * 5 + [100] * 10)
+    assert mmp.best(1) == 300
+    assert mmp.best(5) == 300
+    assert mmp.best(10) == pytest.approx(200)
+
+
+def test_untracked_durations_read_zero():
+    mmp = MeanMaxPower([5, 10])
+    ride(mmp, [200] * 30)
+    assert mmp.best(20) == 0.0
+    assert mmp.best(3) == 0.0
+    assert mmp.best(0) == 0.0
+
+
+def test_longer_than_tracked_after_a_long_ride():
+    mmp = MeanMaxPower()
+    ride(mmp, [150] * 3700)
+    assert mmp.best(3600) == pytest.approx(150)
+    assert mmp.best(3650) == 0.0
+
+
+def test_interpolates_between_tracked_durations():
+    mmp = MeanMaxPower([10, 20])
+    ride(mmp, [300] * 10 + [100] * 30)
+    assert mmp.best(15) == pytest.approx((300 + 200) / 2)
+
+
+def test_short_gap_is_filled_with_the_sample_ending_it():
+    mmp = MeanMaxPower([1, 2, 3, 4])
+    mmp.add_sample(0.0, 100)
+    mmp.add_sample(3.0, 400)
+    mmp.add_sample(4.0, 0)
+    assert mmp.seconds == 4
+    assert mmp.best(1) == 400
+    assert mmp.best(4) == pytest.approx((100 + 400 * 3) / 4)
+
+
+def test_long_gap_invents_no_power():
+    mmp = MeanMaxPower([1, 5, 60, 300])
+    ride(mmp, [100] * 120)
+    # Ten minutes off the bike, back on hard for a minute
+    ride(mmp, [400] * 61, start=720.0)
+    # The last second is still being binned
+    assert mmp.seconds == 180
+    assert mmp.best(60) == pytest.approx(400)
+    # No window spans the gap, and neither part lasted five minutes
+    assert mmp.best(300) == 0.0
+    assert 300 not in mmp.curve()
+
+
+def test_windows_resume_after_a_long_gap():
+    mmp = MeanMaxPower([1, 5, 60])
+    ride(mmp, [100] * 30)
+    ride(mmp, [200] * 90, start=100.0)
+    assert mmp.best(60) == pytest.approx(200)
+    assert mmp.best(5) == pytest.approx(200)
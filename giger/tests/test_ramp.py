@@ -0,0 +1,124 @@
+import asyncio
+
+import ramp as ramp_module
+from ramp import PowerRamp
+
+
+def make_ramp(writes, limits=(0, 1000), rate=400, on_write=None):
+    async def write(watts):
+        writes.append(watts)
+        if on_write is not None:
+            on_write(watts)
+        await asyncio.sleep(0)
+
+    return PowerRamp(write, lambda: limits, rate, period=0.01)
+
+
+async def wait_for(ramp):
+    while ramp.ramping:
+        await asyncio.sleep(0.005)
+
+
+def test_first_target_is_written_directly():
+    writes = []
+
+    async def run():
+        ramp = make_ramp(writes)
+        ramp.set_target(150)
+        await wait_for(ramp)
+
+    asyncio.run(run())
+    assert writes == [150]
+
+
+def test_steps_are_bounded_by_the_rate():
+    writes = []
+
+    async def run():
+        ramp = make_ramp(writes)
+        ramp.current = 100
+        ramp.set_target(120)
+        await wait_for(ramp)
+
+    asyncio.run(run())
+    # 400 W/s every 10 ms is 4 W a step
+    assert writes == [104, 108, 112, 116, 120]
+
+
+def test_target_set_during_the_last_write_is_kept():
+    writes = []
+    ramp = None
+
+    def on_write(watts):
+        if watts == 120:
+            ramp.set_target(130)
+
+    async def run():
+        nonlocal ramp
+        ramp = make_ramp(writes, on_write=on_write)
+        ramp.current = 112
+        ramp.set_target(120)
+        await wait_for(ramp)
+
+    asyncio.run(run())
+    assert writes[-1] == 130
+    assert ramp.current == 130
+
+
+def test_setpoints_are_clamped_to_the_limits():
+    writes = []
+
+    async def run():
+        ramp = make_ramp(writes, limits=(50, 200))
+        ramp.set_target(500)
+        await wait_for(ramp)
+
+    asyncio.run(run())
+    assert writes == [200]
+
+
+def test_stop_holds_the_last_setpoint():
+    writes = []
+    ramp = None
+
+    def on_write(watts):
+        if watts == 108:
+            ramp.stop()
+
+    async def run():
+        nonlocal ramp
+        ramp = make_ramp(writes, on_write=on_write)
+        ramp.current = 100
+        ramp.set_target(200)
+        await wait_for(ramp)
+
+    asyncio.run(run())
+    assert writes == [104, 108]
+
+
+def test_failed_write_is_logged_and_the_next_target_ramps(monkeypatch):
+    errors = []
+
+    class Logger:
+        error = staticmethod(errors.append)
+
+    monkeypatch.setattr(ramp_module, "logger", Logger)
+    writes = []
+    failing = [True]
+
+    async def write(watts):
+        if failing[0]:
+            raise OSError("trainer gone")
+        writes.append(watts)
+
+    async def run():
+        ramp = PowerRamp(write, lambda: (0, 1000), 400, period=0.01)
+        ramp.set_target(150)
+        await wait_for(ramp)
+        failing[0] = False
+        ramp.set_target(160)
+        await wait_for(ramp)
+
+    asyncio.run(run())
+    assert len(errors) == 1 and "trainer gone" in errors[0]
+    assert writes[-1] == 160
@@ -0,0 +1,54 @@
+import math
+import random
+
+import numpy as np
+import pytest
+from sysid import FIT_RATE_HZ, fit_rider_model, resample_for_fit
+
+GAIN = 0.25
+TIME_CONSTANT = 45.0
+DEAD_TIME = 15.0
+OFFSET = 70.0
+
+
+def noisy_ride(rate_hz, seconds=3600, noise=1.0, seed=1):
+    """HR from a first-order-plus-dead-time rider, sampled at `rate_hz`."""
+    rng = random.Random(seed)
+    n = int(seconds * rate_hz)
+    delay = int(round(DEAD_TIME * rate_hz))
+    power = np.empty(n)
+    watts, next_step = 150.0, 0
+    for k in range(n):
+        if k >= next_step:
+            watts = rng.uniform(100, 300)
+            next_step = k + int(rng.uniform(60, 240) * rate_hz)
+        power[k] = watts
+    a = math.exp(-1 / rate_hz / TIME_CONSTANT)
+    hr = np.empty(n)
+    level = OFFSET + GAIN * power[0]
+    for k in range(n):
+        level = a * level + (1 - a) * (OFFSET + GAIN * power[max(k - 1 - delay, 0)])
+        hr[k] = level + rng.gauss(0, noise)
+    return hr, power
+
+
+@pytest.mark.parametrize("rate_hz", [1, 4])
+def test_fit_recovers_the_rider(rate_hz):
+    model = fit_rider_model(*noisy_ride(rate_hz), rate_hz)
+    assert model.gain == pytest.approx(GAIN, rel=0.1)
+    assert model.time_constant == pytest.approx(TIME_CONSTANT, rel=0.15)
+    assert model.dead_time == pytest.approx(DEAD_TIME, abs=3)
+
+
+def test_resample_averages_faster_rides():
+    hr = np.array([100.0, 102.0, np.nan, 110.0, 120.0])
+    power = np.array([200.0, 200.0, 210.0, 210.0, 300.0])
+    hr_1hz, power_1hz = resample_for_fit(hr, power, 2 * FIT_RATE_HZ)
+    assert hr_1hz.tolist() == [101.0, 110.0, 120.0]
+    assert power_1hz.tolist() == [200.0, 210.0, 300.0]
+
+
+def test_resample_interpolates_slower_rides():
+    hr, power = resample_for_fit(np.array([100.0, 110.0]), np.array([200.0, 220.0]), 0.5)
+    assert hr.tolist() == [100.0, 105.0, 110.0, 110.0]
+    assert power.tolist() == [200.0, 210.0, 220.0, 220.0]
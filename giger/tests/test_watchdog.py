@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from controller import Giger
+from watchdog import POWER_WRITE_DEADLINE, Watchdog
+
+TIMEOUT = 0.05
+CHECK_INTERVAL = 0.01
+
+
+class Events:
+    def __init__(self):
+        self.missed = []
+        self.met = []
+
+    def on_miss(self, miss):
+        self.missed.append(miss.deadline)
+
+    def on_met(self, name):
+        self.met.append(name)
+
+
+def run_with_watchdog(scenario):
+    events = Events()
+
+    async def run():
+        watchdog = Watchdog(events.on_miss, events.on_met, CHECK_INTERVAL)
+        watchdog.add("write", TIMEOUT)
+        watchdog.start(asyncio.get_running_loop())
+        try:
+            await scenario(watchdog)
+        finally:
+            watchdog.stop()
+
+    asyncio.run(run())
+    return events
+
+
+async def miss(watchdog, name="write"):
+    while name not in watchdog.misses:
+        await asyncio.sleep(CHECK_INTERVAL)
+
+
+def test_miss_then_kick_is_met():
+    async def scenario(watchdog):
+        watchdog.kick("write")
+        await miss(watchdog)
+        assert not watchdog.healthy
+        watchdog.kick("write")
+        assert watchdog.healthy
+
+    events = run_with_watchdog(scenario)
+    assert events.missed == ["write"]
+    assert events.met == ["write"]
+
+
+def test_arm_after_a_miss_is_not_met():
+    async def scenario(watchdog):
+        watchdog.arm("write")
+        await miss(watchdog)
+        # A new write starting says nothing about whether writes work
+        watchdog.arm("write")
+        assert not watchdog.healthy
+        await asyncio.sleep(TIMEOUT * 2)
+        watchdog.disarm("write")
+        assert watchdog.healthy
+
+    events = run_with_watchdog(scenario)
+    # Reported once, and met only by the disarm
+    assert events.missed == ["write"]
+    assert events.met == ["write"]
+
+
+def test_arm_keeps_the_oldest_due_time():
+    async def scenario(watchdog):
+        watchdog.arm("write")
+        for _ in range(10):
+            await asyncio.sleep(TIMEOUT / 4)
+            watchdog.arm("write")
+
+    events = run_with_watchdog(scenario)
+    assert events.missed == ["write"]
+
+
+def test_disarmed_deadline_is_not_missed():
+    async def scenario(watchdog):
+        watchdog.arm("write")
+        watchdog.disarm("write")
+        await asyncio.sleep(TIMEOUT * 3)
+
+    events = run_with_watchdog(scenario)
+    assert events.missed == []
+    assert events.met == []
+
+
+def test_unknown_deadline_is_ignored():
+    async def scenario(watchdog):
+        watchdog.kick("other")
+        watchdog.arm("other")
+        await asyncio.sleep(CHECK_INTERVAL * 3)
+
+    assert run_with_watchdog(scenario).missed == []
+
+
+@pytest.mark.parametrize("fails", [False, True])
+def test_power_write_meets_the_deadline_only_when_it_completes(fails):
+    class Trainer:
+        async def set_target_power(self, watts):
+            if fails:
+                raise OSError("write failed")
+
+    giger = Giger(None, None, remember_devices=False, fallback="hold")
+    giger.trainer_control = Trainer()
+    events = Events()
+    giger.watchdog._on_met = events.on_met
+    giger.watchdog._missed.add(POWER_WRITE_DEADLINE)
+    giger.watchdog._due[POWER_WRITE_DEADLINE] = 0.0
+
+    async def run():
+        await giger._write_power(150)
+
+    if fails:
+        with pytest.raises(OSError):
+            asyncio.run(run())
+        assert POWER_WRITE_DEADLINE in giger.watchdog._due
+        assert events.met == []
+    else:
+        asyncio.run(run())
+        assert POWER_WRITE_DEADLINE not in giger.watchdog._due
+        assert events.met == [POWER_WRITE_DEADLINE]
@@ -0,0 +1,67 @@
+import asyncio
+import _tkinter
+from time import perf_counter
+
+# A UI event waits at most one asyncio slice, and asyncio one Tk slice
+TK_SLICE_S = 0.01
+ASYNCIO_SLICE_S = 0.01
+
+_TK_PENDING = _tkinter.ALL_EVENTS | _tkinter.DONT_WAIT
+
+
+class CooperativeLoop:
+    """
+    Runs a Tk mainloop and an asyncio loop on the calling thread, taking turns.
+
+    On its turn Tk handles pending events until there are none left or
+    `tk_slice` is used up. asyncio then runs its callbacks, waiting on I/O
+    and timers when it has nothing to do, for `asyncio_slice`. Nothing
+    crosses a thread: Tk callbacks can create tasks directly and coroutines
+    can touch widgets. A single callback that runs long still overruns its
+    slice, so both sides must keep their callbacks short, as before.
+
+    `root.mainloop()` is entered once before the first turn and left again
+    straight away, so setup a subclass does there still happens. CTk's shows
+    the window and colours its title bar on Windows.
+    """
+
+    def __init__(
+        self,
+        root,
+        loop: asyncio.AbstractEventLoop,
+        tk_slice: float = TK_SLICE_S,
+        asyncio_slice: float = ASYNCIO_SLICE_S,
+    ):
+        self._root = root
+        self._loop = loop
+        self.tk_slice = tk_slice
+        self.asyncio_slice = asyncio_slice
+        self._running = False
+
+    def run(self):
+        """Take turns until `root` is destroyed, in place of `root.mainloop()`."""
+        asyncio.set_event_loop(self._loop)
+        self._root.bind("<Destroy>", self._on_destroy, add="+")
+        self._running = True
+        self._root.after_idle(self._root.quit)
+        self._root.mainloop()
+        while self._running:
+            self._tk_turn()
+            self._asyncio_turn()
+
+    def _on_destroy(self, event):
+        # Children's <Destroy> events reach the root's binding too
+        if event.widget is self._root:
+            self._running = False
+
+    def _tk_turn(self):
+        dooneevent = self._root.tk.dooneevent
+        deadline = perf_counter() + self.tk_slice
+        while self._running and dooneevent(_TK_PENDING):
+            if perf_counter() >= deadline:
+                break
+
+    def _asyncio_turn(self):
+        handle = self._loop.call_later(self.asyncio_slice, self._loop.stop)
+        self._loop.run_forever()
+        handle.cancel()
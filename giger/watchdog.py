@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from collections import Counter
+from time import monotonic, time
+from typing import Callable, Dict, Optional
+
+from _types import DeadlineMiss
+from diagnostics import Histogram
+from loguru import logger
+
+HR_DEADLINE = "hr"
+CONTROL_TICK_DEADLINE = "control_tick"
+POWER_WRITE_DEADLINE = "power_write"
+
+# HR notifications arrive about once a second
+HR_DEADLINE_S = 5.0
+POWER_WRITE_DEADLINE_S = 2.0
+# Missed control ticks allowed before the control loop counts as stalled
+CONTROL_TICK_DEADLINE_PERIODS = 3
+
+WATCHDOG_CHECK_INTERVAL_S = 0.1
+
+FALLBACKS = ("hold", "ramp_down", "freeze")
+
+
+class Watchdog:
+    """
+    Deadlines checked from a thread of its own, so a stalled event loop
+    can't hide its own stall.
+
+    `kick` arms a deadline for its timeout from now and `disarm` stands it
+    down. Both are called from the loop. When an armed deadline passes,
+    `on_miss` is called on the loop with a `DeadlineMiss`; its `loop_delay`
+    is how long the loop took to get to it, which is the loop lag at the
+    time of the miss. `on_met` is called with the deadline's name when a
+    missed deadline is kicked or disarmed again. `arm` is for a deadline
+    that is only met once the work it covers is done, and only by
+    `disarm`: it doesn't count as met, and leaves a deadline that is
+    already armed due when it was, so it runs from the oldest unfinished
+    piece of work.
+    """
+
+    def __init__(
+        self,
+        on_miss: Callable[[DeadlineMiss], None],
+        on_met: Callable[[str], None],
+        check_interval: float = WATCHDOG_CHECK_INTERVAL_S,
+    ):
+        self._on_miss = on_miss
+        self._on_met = on_met
+        self.check_interval = check_interval
+        self._timeouts: Dict[str, float] = {}
+        # Deadline -> monotonic time it is due, while armed
+        self._due: Dict[str, float] = {}
+        self._missed = set()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.misses = Counter()
+        self.loop_delay = Histogram()
+
+    def add(self, name: str, timeout: float):
+        self._timeouts[name] = timeout
+
+    @property
+    def healthy(self) -> bool:
+        return not self._missed
+
+    def kick(self, name: str):
+        self._arm(name, report_met=True)
+
+    def arm(self, name: str):
+        self._arm(name, report_met=False)
+
+    def _arm(self, name: str, report_met: bool):
+        timeout = self._timeouts.get(name)
+        if timeout is None:
+            return
+        with self._lock:
+            if report_met or name not in self._due:
+                self._due[name] = monotonic() + timeout
+            met = report_met and name in self._missed
+            if met:
+                self._missed.discard(name)
+        if met:
+            self._on_met(name)
+
+    def disarm(self, name: str):
+        with self._lock:
+            self._due.pop(name, None)
+            met = name in self._missed
+            self._missed.discard(name)
+        if met:
+            self._on_met(name)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="giger-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            now = monotonic()
+            with self._lock:
+                overdue = [
+                    (name, now - due + self._timeouts[name])
+                    for name, due in self._due.items()
+                    if now > due and name not in self._missed
+                ]
+                self._missed.update(name for name, _ in overdue)
+            for name, elapsed in overdue:
+                # Logged from here so a stalled loop still shows up straight away
+                logger.warning(f"Missed {name} deadline, {elapsed:.2f} s since last")
+                try:
+                    self._loop.call_soon_threadsafe(
+                        self._report, name, time(), elapsed, monotonic()
+                    )
+                except RuntimeError:
+                    # The loop has been closed under us
+                    return
+
+    def _report(self, name, timestamp, elapsed, detected):
+        loop_delay = monotonic() - detected
+        self.misses[name] += 1
+        self.loop_delay.record(loop_delay)
+        self._on_miss(DeadlineMiss(timestamp, name, elapsed, loop_delay))
+
+    @property
+    def summary(self) -> dict:
+        return {"misses": dict(self.misses), "loop_delay": self.loop_delay.summary}